@@ -0,0 +1,219 @@
+"""rate limiting and admission control
+
+two checks run before a request reaches its endpoint. A token bucket per
+client lets `RATE_LIMIT_RPS` requests a second through in bursts of up to
+`RATE_LIMIT_BURST`, and answers the rest 429. Then each route runs at most
+its concurrency limit of requests at once and queues the others in
+arrival order; a request is answered 503 at once when the queue ahead of
+it would take longer than `ADMISSION_MAX_WAIT` to drain, at the route's
+average service time, or once it has waited that long anyway. Both
+answers carry `Retry-After`.
+
+so an overload turns into fast rejections and bounded waits for the
+admitted requests, rather than every request queueing for a pooled
+connection until it times out. Limits and buckets are those of one
+worker process.
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+from app import cfg
+from app.metrics import ADMISSION_WAIT, QUEUED, SHED, match_route
+from app.schema.api_exception import ErrorCategory
+
+__all__ = ['AdmissionMiddleware', 'Limiter', 'TokenBuckets']
+
+logger = logging.getLogger(cfg.LOGGER)
+
+
+class TokenBuckets:
+    """a token bucket per client, for the `RATE_LIMIT_CLIENTS` clients seen
+    last; a client forgotten starts over with a full bucket"""
+    def __init__(self, rate: float, burst: int, size: int):
+        self.rate = rate
+        self.burst = burst
+        self.size = size
+        # client: tokens and when they were counted
+        self._buckets: 'OrderedDict[str, Tuple[float, float]]' = (
+            OrderedDict())
+
+    def take(self, client: str) -> float:
+        """take a token of a client
+
+        :return: 0 if there was one, otherwise seconds until there is
+        """
+        now = time.monotonic()
+        tokens, stamp = self._buckets.pop(client, (self.burst, now))
+        tokens = min(tokens + (now - stamp) * self.rate, self.burst)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[client] = (tokens, now)
+        if len(self._buckets) > self.size:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class Limiter:
+    """at most `limit` requests of a route at once, the others served in
+    arrival order"""
+    def __init__(self, limit: int):
+        self.limit = max(limit, 1)
+        self.active = 0
+        # moving average of the seconds a request takes
+        self.service_time = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def expected_wait(self) -> float:
+        """seconds a request arriving now would queue"""
+        if self.active < self.limit:
+            return 0.0
+        return (self.waiting + 1) * self.service_time / self.limit
+
+    async def acquire(self, timeout: float) -> bool:
+        """wait for a slot for at most `timeout` seconds"""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            self._give_up(waiter)
+            return False
+        except asyncio.CancelledError:
+            self._give_up(waiter)
+            raise
+        return True
+
+    def _give_up(self, waiter: asyncio.Future):
+        if waiter.done():
+            # handed a slot while timing out or cancelled, pass it on
+            self.release()
+        else:
+            waiter.cancel()
+            self._waiters.remove(waiter)
+
+    def release(self, seconds: Optional[float] = None):
+        """give the slot to the next waiter
+
+        :param seconds: time the request took, for the service time
+        """
+        if seconds is not None:
+            self.service_time += 0.2 * (seconds - self.service_time)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # the slot changes hands, `active` stays
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+def _reject(status: int, category: ErrorCategory, message: str,
+            retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=status,
+        content={
+            'category': category.value,
+            'message': message,
+        },
+        headers={'Retry-After': str(max(math.ceil(retry_after), 1))},
+    )
+
+
+class AdmissionMiddleware:
+    """ASGI middleware shedding the requests beyond the rate limit of their
+    client and the concurrency limit of their route"""
+    def __init__(self, app):
+        self.app = app
+        self.buckets = (TokenBuckets(cfg.RATE_LIMIT_RPS, cfg.RATE_LIMIT_BURST,
+                                     cfg.RATE_LIMIT_CLIENTS)
+                        if cfg.RATE_LIMIT_RPS > 0 else None)
+        self.limiters: Dict[str, Limiter] = {}
+
+    @staticmethod
+    def _client(scope) -> str:
+        header = cfg.RATE_LIMIT_CLIENT_HEADER.lower().encode('latin-1')
+        if header:
+            for key, value in scope['headers']:
+                if key == header:
+                    return value.decode('latin-1')
+        client = scope.get('client')
+        return client[0] if client else ''
+
+    def _limiter(self, path: str) -> Limiter:
+        limiter = self.limiters.get(path)
+        if limiter is None:
+            limiter = self.limiters[path] = Limiter(
+                cfg.ADMISSION_LIMITS.get(path, cfg.ADMISSION_CONCURRENCY))
+        return limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'].startswith(
+                cfg.ADMISSION_EXEMPT):
+            await self.app(scope, receive, send)
+            return
+        route = match_route(scope)
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+        # labels the request by route in `MetricsMiddleware` even if it
+        # never reaches the router
+        scope['endpoint'] = route.endpoint
+        if self.buckets is not None:
+            wait = self.buckets.take(self._client(scope))
+            if wait:
+                SHED.labels(route.path, 'rate_limit').inc()
+                await _reject(429, ErrorCategory.RATE_LIMITED,
+                              'too many requests, retry later',
+                              wait)(scope, receive, send)
+                return
+        limiter = self._limiter(route.path)
+        expected = limiter.expected_wait()
+        if expected > cfg.ADMISSION_MAX_WAIT:
+            SHED.labels(route.path, 'overload').inc()
+            logger.warning('%s: %s, %d queued',
+                           ErrorCategory.OVERLOADED.value,
+                           route.path,
+                           limiter.waiting,
+                           extra={
+                               'category': ErrorCategory.OVERLOADED.value,
+                               'status': 503,
+                           })
+            await _reject(503, ErrorCategory.OVERLOADED,
+                          'server overloaded, retry later',
+                          expected)(scope, receive, send)
+            return
+        queued = QUEUED.labels(route.path)
+        queued.inc()
+        start = time.perf_counter()
+        try:
+            admitted = await limiter.acquire(cfg.ADMISSION_MAX_WAIT)
+        finally:
+            queued.dec()
+        if not admitted:
+            SHED.labels(route.path, 'queue_timeout').inc()
+            await _reject(503, ErrorCategory.OVERLOADED,
+                          'server overloaded, retry later',
+                          limiter.expected_wait())(scope, receive, send)
+            return
+        admitted_at = time.perf_counter()
+        ADMISSION_WAIT.labels(route.path).observe(admitted_at - start)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.perf_counter() - admitted_at)
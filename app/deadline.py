@@ -0,0 +1,139 @@
+"""query budgets of requests, and cancellation of abandoned ones
+
+each request gets the budget of its route, `QUERY_TIMEOUTS` or
+`QUERY_TIMEOUT`, counted from when it was admitted. `Dao` queries run with
+what is left of it and are cancelled when it runs out, the request is then
+answered 504. A request whose client went away, or nginx gave up on, is
+cancelled as soon as the server notices, along with the query it waits
+for. asyncpg cancels a query by sending the server a cancel request, as
+`pg_cancel_backend` does, and resets the connection before the pool hands
+it out again, so neither a slow nor an abandoned request holds a pooled
+connection after it stopped being useful.
+"""
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from app import cfg
+from app.metrics import ABANDONED, match_route
+
+__all__ = ['DeadlineMiddleware', 'budget', 'cancel_after', 'remaining']
+
+logger = logging.getLogger(cfg.LOGGER)
+
+_deadline: ContextVar[Optional[float]] = ContextVar('deadline', default=None)
+
+
+@contextmanager
+def budget(seconds: float) -> Iterator[None]:
+    """run the queries of a block within `seconds`, or within the budget
+    around it if that ends sooner
+
+    :param seconds: budget, 0 or less for none
+    """
+    deadline = _deadline.get()
+    if seconds > 0:
+        end = time.monotonic() + seconds
+        deadline = end if deadline is None else min(deadline, end)
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """seconds left of the current budget, `None` without one"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.0)
+
+
+@contextmanager
+def cancel_after(seconds: float) -> Iterator[None]:
+    """cancel the current task if the block runs longer than `seconds`,
+    which then raises `asyncio.TimeoutError`
+
+    unlike `asyncio.wait_for` the block keeps running in the current task,
+    on the connection of its transaction if any
+    """
+    task = asyncio.current_task()
+    expired = False
+
+    def expire():
+        nonlocal expired
+        expired = True
+        task.cancel()
+
+    handle = asyncio.get_event_loop().call_later(seconds, expire)
+    try:
+        yield
+    except asyncio.CancelledError:
+        if not expired:
+            raise
+        if hasattr(task, 'uncancel'):
+            # Python 3.11+ counts the cancellations still to be handled
+            task.uncancel()
+        raise asyncio.TimeoutError() from None
+    finally:
+        handle.cancel()
+
+
+class DeadlineMiddleware:
+    """ASGI middleware giving each request the query budget of its route,
+    and cancelling it when its client disconnects before the response was
+    sent
+
+    the request body is read ahead and queued for the app, so that the
+    disconnect is seen while the app is busy rather than the next time it
+    reads
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        route = match_route(scope)
+        path = route.path if route is not None else 'unmatched'
+        task = asyncio.current_task()
+        inbox: asyncio.Queue = asyncio.Queue()
+        complete = abandoned = False
+
+        async def send_complete(message):
+            nonlocal complete
+            if (message['type'] == 'http.response.body'
+                    and not message.get('more_body', False)):
+                complete = True
+            await send(message)
+
+        async def watch():
+            nonlocal abandoned
+            while True:
+                message = await receive()
+                inbox.put_nowait(message)
+                if message['type'] == 'http.disconnect':
+                    break
+            # the server also reports a disconnect once the response is
+            # complete
+            if not complete:
+                abandoned = True
+                task.cancel()
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            with budget(cfg.QUERY_TIMEOUTS.get(path, cfg.QUERY_TIMEOUT)):
+                await self.app(scope, inbox.get, send_complete)
+        except asyncio.CancelledError:
+            if not abandoned:
+                raise
+            ABANDONED.labels(path).inc()
+            logger.info('client went away: %s %s', scope['method'],
+                        scope['path'])
+        finally:
+            watcher.cancel()
@@ -0,0 +1,204 @@
+"""logging that never blocks a request
+
+with `LOG_ASYNC` the handlers of the loggers in `LOGGING` are moved behind
+a bounded queue and run by one writer thread, the event loop only puts
+records on the queue; when it is full the record is dropped and counted
+instead of waiting for the disk. Records are JSON documents carrying the
+id of the request they were logged in and the time elapsed since it
+started. Repeated records of one category, e.g. a storm of the same
+database error, are rate-limited per logger and level: past `LOG_BURST`
+records in `LOG_PERIOD` seconds the rest are counted and the count is
+attached to the next record let through.
+"""
+import atexit
+import json
+import logging
+import logging.config
+import logging.handlers
+import queue
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from app import cfg
+from app.metrics import LOG_DROPPED, LOG_SUPPRESSED
+
+__all__ = [
+    'JsonFormatter', 'RateLimitFilter', 'RequestContextMiddleware',
+    'setup_logging'
+]
+
+_request_id: ContextVar[Optional[str]] = ContextVar('request_id',
+                                                    default=None)
+_request_start: ContextVar[Optional[float]] = ContextVar('request_start',
+                                                         default=None)
+
+# attributes of every record, the others came in with `extra`
+_RECORD_ATTRS = frozenset(
+    vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {
+        'message', 'asctime', 'route'
+    }
+
+
+def _stamp(record: logging.LogRecord):
+    """attach the request context, on the thread that logs"""
+    if not hasattr(record, 'request_id'):
+        record.request_id = _request_id.get()
+        start = _request_start.get()
+        if start is not None:
+            record.elapsed_ms = round(1000 * (time.perf_counter() - start),
+                                      3)
+
+
+class JsonFormatter(logging.Formatter):
+    """one JSON document per record"""
+    def format(self, record: logging.LogRecord) -> str:
+        _stamp(record)
+        created = datetime.fromtimestamp(record.created, timezone.utc)
+        doc = {
+            'time': created.isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and value is not None:
+                doc[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            doc['exc'] = record.exc_text
+        return json.dumps(doc, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """let through at most `burst` records per `period` seconds for each
+    logger, level and category, the `category` given in `extra` or else
+    the message format
+
+    :param burst: records let through per period
+    :param period: seconds
+    """
+    def __init__(self, burst: int, period: float):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self._windows: Dict[Tuple, List] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.levelno,
+               str(getattr(record, 'category', record.msg)))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                # start, records let through, suppressed ones
+                suppressed = window[2] if window else 0
+                window = self._windows[key] = [now, 0, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+            if window[1] >= self.burst:
+                window[2] += 1
+                LOG_SUPPRESSED.labels(record.name).inc()
+                return False
+            window[1] += 1
+            return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """puts records on a bounded queue without waiting, tagged with the
+    logger whose handlers write them"""
+    def __init__(self, q: queue.Queue, route: str):
+        super().__init__(q)
+        self.route = route
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the message is rendered now, its arguments may change later;
+        # formatting is left to the writer thread
+        _stamp(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        record.route = self.route
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.labels(self.route).inc()
+
+
+class _Writer(logging.handlers.QueueListener):
+    """writer thread, hands each record to the handlers of its logger"""
+    def __init__(self, q: queue.Queue,
+                 routes: Dict[str, List[logging.Handler]]):
+        super().__init__(q, respect_handler_level=True)
+        self.routes = routes
+
+    def handle(self, record: logging.LogRecord):
+        for handler in self.routes.get(record.route, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+_configured = False
+
+
+def setup_logging():
+    """apply `LOGGING`, once per process"""
+    global _configured  # pylint: disable=global-statement
+    if _configured:
+        return
+    _configured = True
+    logging.config.dictConfig(cfg.LOGGING)
+    limiter = RateLimitFilter(cfg.LOG_BURST, cfg.LOG_PERIOD)
+    q = queue.Queue(cfg.LOG_QUEUE_SIZE)
+    routes = {}
+    for name in cfg.LOGGING['loggers']:
+        logger = logging.getLogger(name)
+        logger.addFilter(limiter)
+        if cfg.LOG_ASYNC:
+            routes[name] = logger.handlers[:]
+            for handler in routes[name]:
+                logger.removeHandler(handler)
+            logger.addHandler(_QueueHandler(q, name))
+    if routes:
+        writer = _Writer(q, routes)
+        writer.start()
+        # flush what is left on exit
+        atexit.register(writer.stop)
+
+
+class RequestContextMiddleware:
+    """ASGI middleware giving each request an id, the `X-Request-ID`
+    header of the client or a new one, echoed in the response and
+    attached to the records logged while serving it"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        rid = dict(scope['headers']).get(b'x-request-id', b'').decode(
+            'latin-1')[:64] or uuid.uuid4().hex
+
+        async def send_id(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = [
+                    *message.get('headers', []),
+                    (b'x-request-id', rid.encode('latin-1')),
+                ]
+            await send(message)
+
+        rid_token = _request_id.set(rid)
+        start_token = _request_start.set(time.perf_counter())
+        try:
+            await self.app(scope, receive, send_id)
+        finally:
+            _request_id.reset(rid_token)
+            _request_start.reset(start_token)
@@ -5,13 +5,32 @@ from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 
 from app import cfg
+from app.log import setup_logging
+from app.metrics import worker_exit
 from app.middleware import app
-from app.routers import category, config, summary
+from app.models.replica import replicas
+from app.models.session import database
+from app.routers import (category, config, export, lookup, metrics,
+                         summary)
 from app.schema.api_exception import ApiException, ErrorCategory
 
-logging.config.dictConfig(cfg.LOGGING)
+setup_logging()
 logger = logging.getLogger(cfg.LOGGER)
 
+
+@app.on_event('startup')
+async def connect_db():
+    await database.connect()
+    await replicas.connect()
+
+
+@app.on_event('shutdown')
+async def disconnect_db():
+    await replicas.disconnect()
+    await database.disconnect()
+    worker_exit()
+
+
 app.include_router(
     config.router,
     prefix=f'{cfg.REST_URL_PREFIX}/config',
@@ -36,6 +55,24 @@ app.include_router(
     }},
 )
 
+app.include_router(
+    export.router,
+    prefix=f'{cfg.REST_URL_PREFIX}/export',
+    responses={404: {
+        'detail': 'not found'
+    }},
+)
+
+app.include_router(
+    lookup.router,
+    prefix=f'{cfg.REST_URL_PREFIX}/lookup',
+    responses={404: {
+        'detail': 'not found'
+    }},
+)
+
+app.include_router(metrics.router)
+
 
 @app.exception_handler(ApiException)
 async def api_exception_handler(_: Request, exception: ApiException):
@@ -45,10 +82,11 @@ async def api_exception_handler(_: Request, exception: ApiException):
         'message': exception.message,
     }
     response = JSONResponse(status_code=exception.status_code, content=content)
+    extra = {'category': error_category, 'status': exception.status_code}
     if error_category == ErrorCategory.NOT_FOUND.value:
-        logger.info('%s: %s', error_category, exception.message)
+        logger.info('%s: %s', error_category, exception.message, extra=extra)
     else:
-        logger.error('%s: %s', error_category, exception.message)
+        logger.error('%s: %s', error_category, exception.message, extra=extra)
     return response
 
 
@@ -63,17 +101,24 @@ async def request_exception_handler(
         'message': repr(exception),
     }
     response = JSONResponse(status_code=400, content=content)
-    logger.info('%s: %s', error_category, exception)
+    logger.info('%s: %s',
+                error_category,
+                exception,
+                extra={'category': error_category})
     return response
 
 
 @app.exception_handler(Exception)
 async def unexpected_exception_handler(_: Request, exception: Exception):
-    error_category = ErrorCategory.OTHER
+    error_category = ErrorCategory.OTHER.value
     content = {
         'category': error_category,
         'message': 'please contact the admin for help',
     }
     response = JSONResponse(status_code=500, content=content)
-    logger.error('%s: %s', error_category, exception)
+    logger.error('%s: %s',
+                 error_category,
+                 exception,
+                 exc_info=exception,
+                 extra={'category': error_category})
     return response
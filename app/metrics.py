@@ -0,0 +1,204 @@
+"""Prometheus metrics
+
+with `prometheus_multiproc_dir` set in the environment each worker
+process writes its samples to memory-mapped files there and `/metrics`
+merges the files of all workers, whichever worker answers. The directory
+must be emptied before the workers start, as `wsgi.sh` does. Without it
+the metrics are the answering worker's own.
+"""
+import asyncio
+import os
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from starlette.routing import Match
+
+__all__ = [
+    'ABANDONED', 'ADMISSION_WAIT', 'CACHE_ERRORS', 'CONTENT_TYPE_LATEST',
+    'IN_FLIGHT',
+    'LOG_DROPPED', 'LOG_SUPPRESSED', 'POOL_WAIT', 'QUERY_COALESCED',
+    'QUERY_LATENCY', 'QUERY_ROWS', 'QUERY_TIMEOUTS', 'QUEUED',
+    'REQUEST_LATENCY', 'SHED', 'MetricsMiddleware', 'dao_method',
+    'exposition', 'label_methods', 'match_route', 'worker_exit'
+]
+
+_multiprocess = 'prometheus_multiproc_dir' in os.environ
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'HTTP request latency, until the last body chunk was sent',
+    ['method', 'route', 'status'],
+)
+IN_FLIGHT = Gauge(
+    'http_requests_in_flight',
+    'HTTP requests being served',
+    multiprocess_mode='livesum',
+)
+QUEUED = Gauge(
+    'http_requests_queued',
+    'HTTP requests waiting for admission',
+    ['route'],
+    multiprocess_mode='livesum',
+)
+ADMISSION_WAIT = Histogram(
+    'http_admission_wait_seconds',
+    'time an admitted HTTP request waited in the queue of its route',
+    ['route'],
+    buckets=(.001, .005, .01, .05, .1, .25, .5, 1, 2.5, 5, float('inf')),
+)
+SHED = Counter(
+    'http_requests_shed',
+    'HTTP requests rejected by the rate limit of their client or the '
+    'admission control of their route',
+    ['route', 'reason'],
+)
+ABANDONED = Counter(
+    'http_requests_abandoned',
+    'HTTP requests cancelled as their client went away before the response',
+    ['route'],
+)
+QUERY_LATENCY = Histogram(
+    'db_query_duration_seconds',
+    'duration of a query run by a Dao method, pool wait excluded',
+    ['method'],
+)
+QUERY_ROWS = Histogram(
+    'db_query_rows',
+    'rows returned by a query run by a Dao method',
+    ['method'],
+    buckets=(0, 1, 10, 100, 1000, 10000, 100000, float('inf')),
+)
+QUERY_TIMEOUTS = Counter(
+    'db_query_timeouts',
+    'queries of a Dao method cancelled at the end of the request budget',
+    ['method'],
+)
+QUERY_COALESCED = Counter(
+    'db_query_coalesced',
+    'calls of a Dao method that shared the query of an identical one',
+    ['method'],
+)
+POOL_WAIT = Histogram(
+    'db_pool_wait_seconds',
+    'time waited for a pooled connection',
+    ['database'],
+    buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5, float('inf')),
+)
+CACHE_ERRORS = Counter(
+    'cache_errors',
+    'operations on the shared cache given up, mostly as another '
+    'worker held its lock past the busy timeout',
+    ['operation'],
+)
+LOG_DROPPED = Counter(
+    'log_records_dropped',
+    'log records dropped as the queue to the writer thread was full',
+    ['logger'],
+)
+LOG_SUPPRESSED = Counter(
+    'log_records_suppressed',
+    'log records held back by the rate limit of their category',
+    ['logger'],
+)
+
+_dao_method: ContextVar[str] = ContextVar('dao_method', default='other')
+
+
+def label_methods(cls):
+    """class decorator labelling the queries run by each public coroutine
+    method with the method's name"""
+    for name, fn in list(vars(cls).items()):
+        if not name.startswith('_') and asyncio.iscoroutinefunction(fn):
+            setattr(cls, name, _labelled(name, fn))
+    return cls
+
+
+def _labelled(name, fn):
+    @wraps(fn)
+    async def helper(*args, **kwargs):
+        token = _dao_method.set(name)
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            _dao_method.reset(token)
+
+    return helper
+
+
+def dao_method() -> str:
+    """name of the running Dao method, 'other' outside of one"""
+    return _dao_method.get()
+
+
+def match_route(scope):
+    """the route the router will hand a request to, `None` if none"""
+    for route in scope['app'].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route
+    return None
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing requests by method, route template and status
+
+    the route is the path template, e.g. '/api/v1/category/{pkid}', so
+    that the label values stay bounded
+    """
+    def __init__(self, app):
+        self.app = app
+        self._paths = None
+
+    def _route(self, scope) -> str:
+        # the router sets the endpoint on the scope once a route matched
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return 'unmatched'
+        if self._paths is None:
+            self._paths = {
+                route.endpoint: route.path
+                for route in scope['app'].routes
+                if hasattr(route, 'endpoint')
+            }
+        return self._paths.get(endpoint, 'unmatched')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        start = time.perf_counter()
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            IN_FLIGHT.dec()
+            elapsed = time.perf_counter() - start
+            REQUEST_LATENCY.labels(scope['method'], self._route(scope),
+                                   status).observe(elapsed)
+
+
+def exposition() -> bytes:
+    """samples of all workers in the text exposition format"""
+    if not _multiprocess:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+def worker_exit():
+    """drop the live gauges of this worker, on shutdown"""
+    if _multiprocess:
+        multiprocess.mark_process_dead(os.getpid())
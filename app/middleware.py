@@ -1,8 +1,18 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from app.admission import AdmissionMiddleware
+from app.deadline import DeadlineMiddleware
+from app.log import RequestContextMiddleware
+from app.metrics import MetricsMiddleware
+
 app = FastAPI()
 
+# the budget of a request starts once it was admitted
+app.add_middleware(DeadlineMiddleware)
+# so that its rejections get the CORS headers and are timed
+app.add_middleware(AdmissionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -10,3 +20,7 @@ app.add_middleware(
     allow_methods=['*'],
     allow_headers=['*'],
 )
+
+# outermost, so that its latency covers the other middlewares
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestContextMiddleware)
@@ -0,0 +1,357 @@
+"""cache of `Dao` read results
+
+entries are tagged with the tables they were read from, writes to a table
+invalidate every entry tagged with it. `LocalCache` lives in one process,
+`SharedCache` is shared by every worker process on the host so that one
+worker's query warms all the others and an invalidation reaches them all.
+
+both also keep a version of each table, changed by every invalidation,
+which the routers turn into `ETag`s. Versions only grow and start from the
+clock in nanoseconds, so that they never repeat across restarts.
+"""
+import logging
+import math
+import os
+import pickle
+import sqlite3
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from sqlalchemy import Table
+
+from app import cfg
+from app.metrics import CACHE_ERRORS
+
+__all__ = ['LocalCache', 'SharedCache', 'cache', 'cached']
+
+logger = logging.getLogger(cfg.LOGGER)
+
+
+class LocalCache:
+    """size-bounded LRU mapping with a TTL on every entry
+
+    keys are `(tags, ...)` tuples, the first item being the names of the
+    tables the value was read from
+    """
+    def __init__(self, max_size: int, ttl: float):
+        self._data = OrderedDict()
+        self._max_size = max_size
+        self._ttl = ttl
+        self._versions: Dict[str, Tuple[float, int]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """look a key up
+
+        :return: whether it was found and fresh, and its value
+        """
+        try:
+            expires, value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return False, None
+        if expires < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return False, None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return True, value
+
+    def set(self,
+            key: Hashable,
+            value: Any,
+            fresh: Optional[Callable[[], bool]] = None):
+        """store a value
+
+        :param fresh: called right before the write, which is skipped
+            unless it returns true
+        """
+        if fresh is not None and not fresh():
+            return
+        self._data[key] = (time.monotonic() + self._ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self._max_size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, table: str):
+        """drop every entry read from a table"""
+        for key in [k for k in self._data if table in k[0]]:
+            del self._data[key]
+        self._bump(table)
+
+    def _bump(self, table: str) -> int:
+        _, version = self._versions.get(table, (None, 0))
+        version = max(version + 1, time.time_ns())
+        self._versions[table] = (time.monotonic() + self._ttl, version)
+        return version
+
+    def version(self, table: str) -> int:
+        """version of a table
+
+        this process does not hear of the writes of the others, so a
+        version expires with the TTL like the cached values
+        """
+        expires, version = self._versions.get(table, (-math.inf, 0))
+        if expires < time.monotonic():
+            return self._bump(table)
+        return version
+
+    def clear(self):
+        self._data.clear()
+        self._versions.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+        }
+
+
+class SharedCache:
+    """cross-process cache in a SQLite database, meant to be put on a
+    memory-backed filesystem such as `/dev/shm`
+
+    same interface as `LocalCache`. Values must be picklable. Eviction
+    beyond `max_size` drops the entries closest to expiry, so that a hit
+    never has to write; it runs every `max_size // 16` writes of a process
+    rather than on each, so the cache may overshoot by as many entries per
+    worker. Hit/miss counters are per process.
+
+    SQLite calls block the event loop: reads and writes wait at most
+    `CACHE_BUSY_TIMEOUT` for the lock of another worker, then count as a
+    miss or are skipped. Invalidations wait up to a second. Failures are
+    counted by `CACHE_ERRORS` and never raised: a table version that
+    cannot be read counts as just written, an invalidation that fails
+    falls back on clearing the cache.
+    """
+    def __init__(self, path: str, max_size: int, ttl: float):
+        self._path = path
+        self._max_size = max_size
+        self._ttl = ttl
+        self._conn = None
+        self._pid = None
+        self._evict_every = max(max_size // 16, 1)
+        self._sets = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # connections must not cross a fork, open one per worker process
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self._path,
+                                         timeout=1,
+                                         isolation_level=None,
+                                         check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=OFF')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS entry ('
+                               'key TEXT PRIMARY KEY, tags TEXT, '
+                               'expires REAL, value BLOB)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS entry_expires '
+                               'ON entry (expires)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS version ('
+                               'tag TEXT PRIMARY KEY, version INTEGER)')
+            self._impatient()
+            self._pid = os.getpid()
+        return self._conn
+
+    def _impatient(self):
+        self._conn.execute('PRAGMA busy_timeout = '
+                           f'{int(cfg.CACHE_BUSY_TIMEOUT * 1000)}')
+
+    @contextmanager
+    def _patient(self):
+        """connection waiting up to a second for the lock, for writes
+        that must not be lost"""
+        conn = self.conn
+        conn.execute('PRAGMA busy_timeout = 1000')
+        try:
+            yield conn
+        finally:
+            self._impatient()
+
+    @contextmanager
+    def _transaction(self):
+        """write transaction, which holds the lock from its start"""
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    @staticmethod
+    def _tags(key: Hashable) -> str:
+        return ''.join(f'|{t}|' for t in key[0])
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        try:
+            row = self.conn.execute(
+                'SELECT value FROM entry WHERE key = ? AND expires >= ?',
+                (repr(key), time.time()),
+            ).fetchone()
+        except sqlite3.Error:
+            CACHE_ERRORS.labels('get').inc()
+            row = None
+        if row is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, pickle.loads(row[0])
+
+    def set(self,
+            key: Hashable,
+            value: Any,
+            fresh: Optional[Callable[[], bool]] = None):
+        """store a value
+
+        :param fresh: called in the transaction of the write, which is
+            skipped unless it returns true, so that no invalidation lands
+            in between
+        """
+        now = time.time()
+        value = pickle.dumps(value)
+        try:
+            with self._transaction() as conn:
+                if fresh is not None and not fresh():
+                    return
+                conn.execute(
+                    'INSERT OR REPLACE INTO entry VALUES (?, ?, ?, ?)',
+                    (repr(key), self._tags(key), now + self._ttl, value),
+                )
+            self._sets += 1
+            if self._sets % self._evict_every == 0:
+                self._evict(now)
+        except sqlite3.Error:
+            CACHE_ERRORS.labels('set').inc()
+
+    def _evict(self, now: float):
+        self.conn.execute('DELETE FROM entry WHERE expires < ?', (now, ))
+        self.conn.execute(
+            'DELETE FROM entry WHERE key IN (SELECT key FROM entry '
+            'ORDER BY expires DESC LIMIT -1 OFFSET ?)',
+            (self._max_size, ),
+        )
+
+    def invalidate(self, table: str):
+        try:
+            with self._patient(), self._transaction() as conn:
+                conn.execute('DELETE FROM entry WHERE tags LIKE ?',
+                             (f'%|{table}|%', ))
+                conn.execute(
+                    'INSERT INTO version VALUES (?, ?) ON CONFLICT (tag) '
+                    'DO UPDATE SET version = '
+                    'max(version + 1, excluded.version)',
+                    (table, time.time_ns()),
+                )
+        except sqlite3.Error as exc:
+            CACHE_ERRORS.labels('invalidate').inc()
+            logger.warning('invalidating %s failed, clearing the cache: %r',
+                           table, exc)
+            self.clear()
+
+    def version(self, table: str) -> int:
+        """version of a table, the same in every worker"""
+        try:
+            row = self.conn.execute(
+                'SELECT version FROM version WHERE tag = ?',
+                (table, )).fetchone()
+            if row is not None:
+                return row[0]
+            with self._patient() as conn:
+                conn.execute('INSERT OR IGNORE INTO version VALUES (?, ?)',
+                             (table, time.time_ns()))
+        except sqlite3.Error:
+            CACHE_ERRORS.labels('version').inc()
+            # as if written just now: not cached, read from the primary
+            return time.time_ns()
+        return self.version(table)
+
+    def clear(self):
+        try:
+            with self._patient(), self._transaction() as conn:
+                conn.execute('DELETE FROM entry')
+                conn.execute(
+                    'UPDATE version SET version = max(version + 1, ?)',
+                    (time.time_ns(), ))
+        except sqlite3.Error as exc:
+            CACHE_ERRORS.labels('clear').inc()
+            logger.error('clearing the cache failed, entries may be stale '
+                         'until they expire: %r', exc)
+
+    def stats(self) -> Dict[str, int]:
+        try:
+            size = self.conn.execute(
+                'SELECT count(*) FROM entry').fetchone()[0]
+        except sqlite3.Error:
+            CACHE_ERRORS.labels('stats').inc()
+            size = 0
+        return {'hits': self.hits, 'misses': self.misses, 'size': size}
+
+
+if cfg.CACHE_BACKEND == 'shared':
+    cache = SharedCache(
+        os.path.join(cfg.CACHE_DIR, f'postgres-rest-{cfg.SA_DB}.sqlite'),
+        cfg.CACHE_MAX_SIZE,
+        cfg.CACHE_TTL,
+    )
+else:
+    cache = LocalCache(cfg.CACHE_MAX_SIZE, cfg.CACHE_TTL)
+
+
+def _fresh(tags: Tuple[str, ...], versions: List[int]) -> bool:
+    """whether a value read at `versions` of its tables may be cached
+
+    not if a table was written meanwhile, nor while a replica it may have
+    been read from could still miss the last write: another worker would
+    serve that stale value until it expires, even to the writer's clients
+    """
+    now = time.time_ns()
+    for tag, version in zip(tags, versions):
+        current = cache.version(tag)
+        if current != version:
+            return False
+        # versions are bumped to the clock in nanoseconds
+        if cfg.SA_REPLICAS and now - current < cfg.SA_REPLICA_MAX_LAG * 1e9:
+            return False
+    return True
+
+
+def cached(*tables: Table):
+    """cache the result of an async `Dao` method
+
+    :param tables: tables the method reads, writing any of them
+        invalidates the cached results
+    """
+    tags = tuple(sorted(t.name for t in tables))
+
+    def decorator(fn):
+        @wraps(fn)
+        async def helper(self, *args, **kwargs):
+            key = (tags, fn.__name__, args, tuple(sorted(kwargs.items())))
+            hit, value = cache.get(key)
+            if hit:
+                return value
+            versions = [cache.version(tag) for tag in tags]
+            value = await fn(self, *args, **kwargs)
+            if isinstance(value, Mapping):
+                # DB records hold driver state, keep the plain values
+                value = dict(value)
+            # checked in the transaction of the write
+            cache.set(key, value, lambda: _fresh(tags, versions))
+            return value
+
+        return helper
+
+    return decorator
@@ -0,0 +1,78 @@
+"""single-flight of `Dao` reads
+
+identical calls made while one is running wait for it and share its result
+instead of each running the query, e.g. a dashboard refreshing dozens of
+panels on the same aggregate. A call joins one started after the last
+write to its tables only, as told by the table versions of the cache, so
+that it never gets rows older than its own writes. The query is cancelled
+once every caller waiting for it went away, e.g. on a client disconnect or
+the budget of the request running out.
+"""
+import asyncio
+from functools import wraps
+from typing import Dict, Hashable
+
+from sqlalchemy import Table
+
+from app.metrics import QUERY_COALESCED, dao_method
+from app.models.cache import cache
+from app.models.session import in_transaction
+
+__all__ = ['coalesced']
+
+_flights: Dict[Hashable, asyncio.Future] = {}
+# callers waiting for each flight
+_waiters: Dict[asyncio.Future, int] = {}
+
+
+def _landed(key: Hashable, flight: asyncio.Future):
+    if _flights.get(key) is flight:
+        del _flights[key]
+    if not flight.cancelled():
+        # retrieved, even if every caller went away
+        flight.exception()
+
+
+def coalesced(*tables: Table):
+    """share one run of an async `Dao` method among identical concurrent
+    calls
+
+    :param tables: tables the method reads
+    """
+    names = tuple(sorted(t.name for t in tables))
+
+    def decorator(fn):
+        @wraps(fn)
+        async def helper(self, *args, **kwargs):
+            # a transaction sees its own writes, which the others must not
+            if in_transaction():
+                return await fn(self, *args, **kwargs)
+            key = (fn.__name__, args, tuple(sorted(kwargs.items())),
+                   tuple(cache.version(name) for name in names))
+            flight = _flights.get(key)
+            if flight is None:
+                flight = asyncio.ensure_future(fn(self, *args, **kwargs))
+                _flights[key] = flight
+                flight.add_done_callback(lambda f: _landed(key, f))
+            else:
+                QUERY_COALESCED.labels(dao_method()).inc()
+            _waiters[flight] = _waiters.get(flight, 0) + 1
+            try:
+                # a caller going away must not cancel the query of the
+                # others
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if _waiters[flight] == 1 and not flight.done():
+                    # nobody joins a flight being cancelled
+                    if _flights.get(key) is flight:
+                        del _flights[key]
+                    flight.cancel()
+                raise
+            finally:
+                _waiters[flight] -= 1
+                if not _waiters[flight]:
+                    del _waiters[flight]
+
+        return helper
+
+    return decorator
@@ -0,0 +1,42 @@
+"""opaque cursors for keyset pagination
+
+a cursor wraps the primary key of the last row on a page, the next page
+is then `WHERE pk > :key ORDER BY pk LIMIT :limit` which walks the index
+instead of scanning and discarding `offset` rows.
+"""
+import base64
+import binascii
+import json
+from typing import Any, Optional
+
+from app.schema.api_exception import ApiException, ErrorCategory
+
+__all__ = ['encode_cursor', 'decode_cursor']
+
+
+def encode_cursor(key: Any) -> str:
+    raw = json.dumps({'k': key}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token: Optional[str], kind: type = int) -> Any:
+    """primary key wrapped in a cursor, `None` for the first page
+
+    :param kind: Python type of the primary key, the key of a tampered
+        cursor may be any JSON value
+    :raise ApiException: 400 if the token was not produced by
+        `encode_cursor` for a key of that type
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        key = json.loads(raw)['k']
+    except (binascii.Error, ValueError, KeyError, TypeError) as exc:
+        raise ApiException(400, ErrorCategory.REQUEST_INVALID,
+                           f'invalid cursor "{token}"') from exc
+    # exact type, a bool is no int key
+    if type(key) is not kind:  # pylint: disable=unidiomatic-typecheck
+        raise ApiException(400, ErrorCategory.REQUEST_INVALID,
+                           f'invalid cursor "{token}"')
+    return key
@@ -1,92 +1,623 @@
+import asyncio
+import logging
+import os
 import re
-from typing import Any, List, NoReturn, Optional, Sequence
+import reprlib
+import shutil
+import time
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import (Any, AsyncIterator, Awaitable, Callable, Dict, List,
+                    Mapping, NamedTuple, NoReturn, Optional, Sequence, Tuple)
 
-from sqlalchemy import Column, Table, func
-from sqlalchemy.engine.result import RowProxy
-from sqlalchemy.sql import select
+import asyncpg
+from sqlalchemy import Column, Index, Table, and_, any_, exists, func
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.sql import ClauseElement, bindparam, select, text
 
-from app.models.session import safe_session
-from app.models.tables import (categories, dates, events, listings, sales,
-                               users, venues)
+from app import cfg
+from app.deadline import cancel_after, remaining
+from app.metrics import (QUERY_LATENCY, QUERY_ROWS, QUERY_TIMEOUTS,
+                         dao_method, label_methods)
+from app.models import synth
+from app.models.cache import cache, cached
+from app.models.coalesce import coalesced
+from app.models.cursor import decode_cursor, encode_cursor
+from app.models.prepared import Prepared
+from app.models.replica import read_only, reader, replicas
+from app.models.session import (DISCONNECT_ERRORS, connection, database,
+                                in_transaction, raw_pool)
+from app.models.tables import (categories, daily_sales, dates, events,
+                               listings, sales, users, venues)
 from app.schema.api_exception import ApiException, ErrorCategory
 
-__all__ = ['Dao']
+__all__ = ['Dao', 'LoadStat', 'Lookup', 'SAMPLE_FILES']
 
+logger = logging.getLogger(cfg.LOGGER)
+slow_logger = logging.getLogger('slow_query_logger')
 
+
+# sample file of each table, dimension tables first then fact tables in
+# foreign key order
+SAMPLE_FILES = {
+    users: 'allusers_pipe.txt',
+    venues: 'venue_pipe.txt',
+    categories: 'category_pipe.txt',
+    dates: 'date2008_pipe.txt',
+    events: 'allevents_pipe.txt',
+    listings: 'listings_pipe.txt',
+    sales: 'sales_tab.txt',
+}
+_DIMENSIONS = (users, venues, categories, dates)
+_FACTS = (events, listings, sales)
+
+
+def _not_primaries(table: Table) -> List[str]:
+    """columns of a sample file"""
+    # surrogate keys are generated, a partition key that is part of the
+    # primary key is still in the files
+    return list(
+        col.key
+        for col in filter(lambda x: not x.primary_key or x.foreign_keys,
+                          table.c))
+
+
+def _delimiter(filename: str) -> str:
+    dlm_map = {'pipe': '|', 'tab': '\t'}
+    return dlm_map[next(
+        filter(lambda i: i in ['pipe', 'tab'], re.split(r'[_.]', filename)))]
+
+
+def _concat(parts: List[str], target: str):
+    with open(target, 'wb') as out:
+        for part in parts:
+            with open(part, 'rb') as f:
+                shutil.copyfileobj(f, out, 1 << 20)
+
+
+# records found by key and the keys of none, of a batch lookup
+Lookup = Tuple[Dict[Any, Mapping], List[Any]]
+
+
+class LoadStat(NamedTuple):
+    table: str
+    rows: int
+    seconds: float
+    rows_per_sec: float
+
+
+def _log_slow(name: str, stmt, values: Optional[Mapping], seconds: float,
+              rows: Optional[int]):
+    if isinstance(stmt, Prepared):
+        sql, params = stmt.sql, stmt.args(values)
+    elif isinstance(stmt, str):
+        sql, params = stmt, values
+    else:
+        compiled = stmt.compile(dialect=postgresql.dialect())
+        sql, params = str(compiled), compiled.params
+    slow_logger.info('%.1fms %s rows=%s %s params=%s',
+                     1000 * seconds,
+                     name,
+                     rows,
+                     ' '.join(sql.split()),
+                     reprlib.repr(params),
+                     extra={
+                         'category': name,
+                         'duration_ms': round(1000 * seconds, 3),
+                     })
+
+
+@label_methods
 class Dao:
+    # statements of the hot queries, compiled on first use
+    _prepared: Dict[Tuple, Prepared] = {}
+
     @staticmethod
-    def _exec(stmt: str, *args, **kwargs):
-        try:
-            with safe_session() as sess:
-                res = sess.execute(stmt, *args, **kwargs)
+    async def _run(db, stmt, method: str, **kwargs):
+        async with connection(db) as conn:
+            start = time.perf_counter()
+            if isinstance(stmt, Prepared):
+                res = await stmt.run(conn.raw_connection, method, **kwargs)
+            else:
+                res = await getattr(conn, method)(stmt, **kwargs)
+            seconds = time.perf_counter() - start
+            name = dao_method()
+            QUERY_LATENCY.labels(name).observe(seconds)
+            rows = None
+            if method == 'fetch_all':
+                rows = len(res)
+            elif method == 'fetch_one':
+                rows = int(res is not None)
+            if rows is not None:
+                QUERY_ROWS.labels(name).observe(rows)
+            if 0 <= cfg.SLOW_QUERY_MS <= 1000 * seconds:
+                _log_slow(name, stmt, kwargs.get('values'), seconds, rows)
             return res
+
+    @staticmethod
+    async def _exec(stmt, method: str = 'fetch_all', **kwargs):
+        """run a statement on the async connection pool, of a replica in a
+        `read_only` method
+
+        a read that lost its connection, e.g. to a Postgres restart, is
+        retried once on a fresh one of the primary, unless it ran inside a
+        transaction which went with the connection; the rest of the pool is
+        replaced. A statement still running when the budget of the request
+        runs out is cancelled, see `app.deadline`
+
+        :param stmt: SQLAlchemy Core expression, raw SQL string or
+            `Prepared` statement
+        :param method: `databases.Database` method to run it with, i.e.
+            'fetch_all', 'fetch_one', 'fetch_val' or 'execute'
+        :param kwargs: passed through to that method, `values` only for a
+            `Prepared` statement
+        :return: whatever the method returns
+        :raise ApiException: 503 if the connection was lost, 504 if the
+            budget of the request ran out, 500 on any other error
+        """
+        timeout = remaining()
+        if timeout is None:
+            return await Dao._attempt(stmt, method, **kwargs)
+        try:
+            with cancel_after(timeout):
+                return await Dao._attempt(stmt, method, **kwargs)
+        except asyncio.TimeoutError as exc:
+            QUERY_TIMEOUTS.labels(dao_method()).inc()
+            raise ApiException(
+                504, ErrorCategory.TIMEOUT,
+                'query cancelled, the request ran out of time') from exc
+
+    @staticmethod
+    async def _attempt(stmt, method: str, **kwargs):
+        db = reader()
+        try:
+            try:
+                return await Dao._run(db, stmt, method, **kwargs)
+            except DISCONNECT_ERRORS as exc:
+                # the others went the same way, as on a restart: replace
+                # every pooled connection, like SQLAlchemy invalidates its
+                # pool on a disconnect
+                await raw_pool(db).expire_connections()
+                # a write may have been applied before the connection went
+                if db is None or in_transaction():
+                    raise
+                replicas.down(db)
+                logger.warning('retrying on a new connection: %r', exc)
+                return await Dao._run(database, stmt, method, **kwargs)
+        except DISCONNECT_ERRORS as exc:
+            raise ApiException(503, ErrorCategory.DB, repr(exc)) from exc
         except Exception as exc:
             raise ApiException(500, ErrorCategory.DB, repr(exc)) from exc
 
-    def load_sample(self) -> NoReturn:
-        def not_primaries(table: Table):
-            return list(
-                col.key
-                for col in filter(lambda x: not x.primary_key, table.c))
-
-        def statement(table: str, columns: Sequence[str], filename: str,
-                      delimiter: str) -> str:
-            return f'''copy {table}({','.join(columns)}) from
-                '/etc/data/{filename}'
-                delimiter {delimiter} CSV;
-                '''
-
-        dlm_map = {'pipe': "'|'", 'tab': "E'\\t'"}
-        tables = {
-            'd_user': users,
-            'd_venue': venues,
-            'd_category': categories,
-            'd_date': dates,
-            'f_event': events,
-            'f_listing': listings,
-            'f_sale': sales,
-        }
-        files = [
-            'allusers_pipe.txt',
-            'venue_pipe.txt',
-            'category_pipe.txt',
-            'date2008_pipe.txt',
-            'allevents_pipe.txt',
-            'listings_pipe.txt',
-            'sales_tab.txt',
-        ]
-        columns = [not_primaries(t) for t in tables.values()]
-        delimiters = [
-            dlm_map[next(
-                filter(lambda i: i in ['pipe', 'tab'], re.split(r'[_.]', s)))]
-            for s in files
+    @classmethod
+    def _prepare(cls, key: Tuple,
+                 build: Callable[[], ClauseElement]) -> Prepared:
+        """statement compiled once per process
+
+        :param key: identifies the statement shape
+        :param build: returns the expression, called on the first use of
+            the key only
+        """
+        prepared = cls._prepared.get(key)
+        if prepared is None:
+            prepared = cls._prepared[key] = Prepared(build())
+        return prepared
+
+    @staticmethod
+    @asynccontextmanager
+    async def _unbounded() -> AsyncIterator[asyncpg.Connection]:
+        """connection of `raw_pool()` in a transaction free of the pool's
+        statement timeout, for DDL and bulk statements"""
+        async with raw_pool().acquire() as conn:
+            async with conn.transaction():
+                await conn.execute('SET LOCAL statement_timeout = 0')
+                yield conn
+
+    @staticmethod
+    def _create_index(idx: Index) -> str:
+        ddl = str(CreateIndex(idx).compile(dialect=postgresql.dialect()))
+        return re.sub(r'^CREATE (UNIQUE )?INDEX', r'\g<0> IF NOT EXISTS', ddl)
+
+    async def _restore(self, indexes: List[Index]) -> NoReturn:
+        """re-enable the rollup trigger and rebuild dropped indexes
+
+        :raise ApiException: 500 unless all of them are back
+        """
+        names = [idx.name for idx in indexes]
+        try:
+            async with self._unbounded() as conn:
+                await conn.execute(
+                    'ALTER TABLE f_sale ENABLE TRIGGER f_sale_rollup')
+                for idx in indexes:
+                    await conn.execute(self._create_index(idx))
+            async with raw_pool().acquire() as conn:
+                found = {
+                    row[0]
+                    for row in await conn.fetch(
+                        "SELECT relname FROM pg_class WHERE relkind IN "
+                        "('i', 'I') AND relname = any($1::text[])", names)
+                }
+                enabled = await conn.fetchval(
+                    "SELECT tgenabled <> 'D' FROM pg_trigger "
+                    "WHERE tgname = 'f_sale_rollup' "
+                    "AND tgrelid = 'f_sale'::regclass")
+        except Exception as exc:
+            raise ApiException(
+                500, ErrorCategory.DB,
+                f'indexes and rollup trigger not restored: {exc!r}') from exc
+        missing = [name for name in names if name not in found]
+        if missing or not enabled:
+            raise ApiException(
+                500, ErrorCategory.DB,
+                f'not restored: indexes {missing}, rollup trigger '
+                f'{"enabled" if enabled else "disabled"}')
+
+    async def _bulk_load(
+        self,
+        load: Callable[[Table], Awaitable[LoadStat]],
+    ) -> List[LoadStat]:
+        """fill every table with `load`
+
+        dimension tables are loaded in parallel, each on its own pooled
+        connection, then fact tables one after another in foreign key
+        order. Secondary indexes and the rollup trigger are dropped for
+        the load and restored afterwards, whether it failed or not; an
+        error of the load is only raised once they are back.
+
+        :param load: loads one table, on connections of `raw_pool()`
+        :return: rows loaded, seconds taken and rows/sec of each table
+        :raise ApiException: 500 if the load failed or the indexes and
+            trigger could not be restored
+        """
+        indexes = [
+            idx for table in (*_DIMENSIONS, *_FACTS) for idx in table.indexes
         ]
-        for tb, col, f, dlm in zip(tables.keys(), columns, files, delimiters):
-            self._exec(statement(tb, col, f, dlm))
+        try:
+            async with self._unbounded() as conn:
+                for idx in indexes:
+                    await conn.execute(f'DROP INDEX IF EXISTS {idx.name}')
+                await conn.execute(
+                    'ALTER TABLE f_sale DISABLE TRIGGER f_sale_rollup')
+            stats = list(await asyncio.gather(*(load(t)
+                                                for t in _DIMENSIONS)))
+            for table in _FACTS:
+                stats.append(await load(table))
+        except ApiException:
+            await self._restore(indexes)
+            raise
+        except Exception as exc:
+            await self._restore(indexes)
+            raise ApiException(500, ErrorCategory.DB, repr(exc)) from exc
+        await self._restore(indexes)
+        for table in (*_DIMENSIONS, *_FACTS):
+            cache.invalidate(table.name)
+        await self.rebuild_daily_sales()
+        await self.refresh_counts()
+        return stats
+
+    async def load_sample(self, path: str = cfg.DATA_PATH) -> List[LoadStat]:
+        """stream the sample files from the app side with
+        `COPY ... FROM STDIN`, see `_bulk_load`
+
+        :param path: directory of the sample files
+        :return: rows loaded, seconds taken and rows/sec of each table
+        """
+        async def copy(table: Table) -> LoadStat:
+            filename = SAMPLE_FILES[table]
+            start = time.perf_counter()
+            async with self._unbounded() as conn:
+                status = await conn.copy_to_table(
+                    table.name,
+                    source=os.path.join(path, filename),
+                    columns=_not_primaries(table),
+                    format='csv',
+                    delimiter=_delimiter(filename),
+                )
+            seconds = time.perf_counter() - start
+            rows = int(status.split()[-1])
+            logger.info('loaded %d rows into %s in %.2fs', rows, table.name,
+                        seconds)
+            return LoadStat(table.name, rows, seconds, rows / seconds)
+
+        return await self._bulk_load(copy)
+
+    @staticmethod
+    async def _skip_foreign_keys(conn: asyncpg.Connection) -> bool:
+        """turn off foreign key checks for the rest of the transaction, for
+        rows consistent by construction
+
+        :return: whether they are off, which takes a superuser or a role
+            granted `session_replication_role`
+        """
+        try:
+            async with conn.transaction():
+                await conn.execute(
+                    'SET LOCAL session_replication_role = replica')
+        except asyncpg.InsufficientPrivilegeError:
+            return False
+        return True
+
+    async def load_synthetic(self, scale: float,
+                             jobs: int = 4) -> List[LoadStat]:
+        """fill the tables, freshly created, with synthetic data at a
+        scale factor of the sample, generated by the database and inserted
+        with their keys, see `synth` and `_bulk_load`
+
+        the rows agree with each other by construction, their foreign keys
+        go unchecked if the role may turn the checks off, which makes the
+        inserts several times faster
+
+        :param scale: 1 for as many rows as the sample, 1000 for 172M sales
+        :param jobs: connections each table is inserted on in parallel
+        :return: rows loaded, seconds taken and rows/sec of each table
+        """
+        n = synth.sizes(scale)
+
+        async def insert(table: Table) -> LoadStat:
+            columns = ', '.join(col.name for col in table.c)
+
+            async def chunk(first: int, last: int) -> Tuple[int, bool]:
+                async with self._unbounded() as conn:
+                    unchecked = await self._skip_foreign_keys(conn)
+                    status = await conn.execute(
+                        f'INSERT INTO {table.name} ({columns}) '
+                        f'SELECT {columns} FROM '
+                        f'({synth.rows(table, n, first, last)}) g')
+                return int(status.split()[-1]), unchecked
+
+            start = time.perf_counter()
+            done = await asyncio.gather(
+                *(chunk(*keys) for keys in synth.chunks(n[table], jobs)))
+            if not all(unchecked for _, unchecked in done):
+                logger.warning(
+                    'foreign keys of %s checked row by row, the role may '
+                    'not set session_replication_role', table.name)
+            rows = sum(count for count, _ in done)
+            await self._exec(synth.reset_sequence(table), 'fetch_val')
+            seconds = time.perf_counter() - start
+            logger.info('generated %d rows into %s in %.2fs', rows,
+                        table.name, seconds)
+            return LoadStat(table.name, rows, seconds, rows / seconds)
+
+        return await self._bulk_load(insert)
+
+    async def _copy_out(self, query: str, output: str,
+                        delimiter: str) -> int:
+        async with self._unbounded() as conn:
+            status = await conn.copy_from_query(query,
+                                                output=output,
+                                                format='csv',
+                                                delimiter=delimiter)
+        return int(status.split()[-1])
+
+    async def generate_sample(self,
+                              path: str,
+                              scale: float,
+                              jobs: int = 4) -> List[LoadStat]:
+        """write synthetic data at a scale factor as sample files, for
+        `load_sample`, streamed out of the database with
+        `COPY ... TO STDOUT`
+
+        each file is written in parts of consecutive keys on `jobs`
+        connections at once, then the parts are joined in key order: the
+        loader numbers the rows in file order
+
+        :param path: directory to write the files into
+        :param scale: see `load_synthetic`
+        :param jobs: connections each file is written on in parallel
+        :return: rows written, seconds taken and rows/sec of each table
+        """
+        n = synth.sizes(scale)
+        stats = []
+        for table, filename in SAMPLE_FILES.items():
+            columns = ', '.join(_not_primaries(table))
+            target = os.path.join(path, filename)
+            keys = synth.chunks(n[table], jobs)
+            parts = [f'{target}.{k}' for k in range(len(keys))]
+            copies = [
+                self._copy_out(
+                    f'SELECT {columns} FROM '
+                    f'({synth.rows(table, n, first, last)}) g', part,
+                    _delimiter(filename))
+                for (first, last), part in zip(keys, parts)
+            ]
+            start = time.perf_counter()
+            try:
+                rows = sum(await asyncio.gather(*copies))
+                await asyncio.get_event_loop().run_in_executor(
+                    None, _concat, parts, target)
+            finally:
+                for part in parts:
+                    if os.path.exists(part):
+                        os.remove(part)
+            seconds = time.perf_counter() - start
+            logger.info('wrote %d rows of %s in %.2fs', rows, table.name,
+                        seconds)
+            stats.append(LoadStat(table.name, rows, seconds, rows / seconds))
+        return stats
+
+    async def refresh_counts(self) -> NoReturn:
+        """refresh planner statistics behind estimated counts and re-cache
+        the exact counts, after a bulk load"""
+        async with self._unbounded() as conn:
+            for table in (users, venues, categories, dates, events, listings,
+                          sales, daily_sales):
+                await conn.execute(f'ANALYZE {table.name}')
+        cache.clear()
+        for fn in (self.count_users, self.count_venues, self.count_categories,
+                   self.count_dates, self.count_events, self.count_listings,
+                   self.count_sales, self.count_daily_sales):
+            await fn()
+
+    async def rebuild_daily_sales(self) -> NoReturn:
+        """recompute the `a_daily_sale` rollup from `f_sale`
+
+        the insert trigger on `f_sale` keeps the rollup current, this is
+        for sales that arrived before the trigger existed, or were updated
+        or deleted afterwards
+        """
+        stmt = select([
+            dates.c.caldate,
+            func.sum(sales.c.qtysold),
+            func.coalesce(func.sum(sales.c.pricepaid), 0),
+            func.coalesce(func.sum(sales.c.commission), 0),
+        ]).select_from(sales.join(
+            dates, sales.c.dateid == dates.c.dateid)).group_by(dates.c.caldate)
+        try:
+            async with database.transaction():
+                await database.execute('SET LOCAL statement_timeout = 0')
+                await database.execute(daily_sales.delete())
+                await database.execute(daily_sales.insert().from_select(
+                    ['caldate', 'qtysold', 'revenue', 'commission'], stmt))
+        except Exception as exc:
+            raise ApiException(500, ErrorCategory.DB, repr(exc)) from exc
+        cache.invalidate(daily_sales.name)
 
-    def _all(self, table: Table, limit: int, offset: int) -> List[RowProxy]:
-        res = self._exec(select([table]).limit(limit).offset(offset))
-        return res.fetchall()
+    @staticmethod
+    def _pk(table: Table) -> Column:
+        return next(iter(table.primary_key.columns))
 
-    def all_user(self, limit: int, offset: int) -> List[RowProxy]:
-        return self._all(users, limit, offset)
+    async def _all(self, table: Table, limit: int,
+                   offset: int) -> List[Mapping]:
+        stmt = select([table]).order_by(self._pk(table))
+        return await self._exec(stmt.limit(limit).offset(offset))
 
-    def all_category(self, limit: int, offset: int) -> List[RowProxy]:
-        return self._all(categories, limit, offset)
+    async def _page(
+        self,
+        table: Table,
+        limit: int,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[Mapping], Optional[str]]:
+        """keyset pagination ordered by primary key
 
-    def _count(self, column: Column) -> int:
-        stmt = select([func.count(column)])
-        res = self._exec(stmt)
-        return res.first()[0]
+        :param table: table to list
+        :param limit: maximum number of rows on the page
+        :param cursor: `next` token of the previous page, `None` to start
+            from the beginning
+        :return: rows on the page and the cursor of the following page,
+            which is `None` once the table is exhausted
+        """
+        pk = self._pk(table)
+        stmt = select([table]).order_by(pk).limit(limit)
+        key = decode_cursor(cursor, pk.type.python_type)
+        if key is not None:
+            stmt = stmt.where(pk > key)
+        rows = await self._exec(stmt)
+        if len(rows) < limit:
+            return rows, None
+        return rows, encode_cursor(rows[-1][pk.name])
 
-    def _lookup(
+    async def _stream(
+        self,
+        table: Table,
+        batch_size: int,
+    ) -> AsyncIterator[List[Mapping]]:
+        """all rows of a table in primary key order, read through a
+        server-side cursor so that only one batch is held in memory
+
+        :param table: table to read
+        :param batch_size: number of rows fetched per round trip
+        :return: async iterator of row batches
+        """
+        stmt = select([table]).order_by(self._pk(table))
+        sql = str(stmt.compile(dialect=postgresql.dialect()))
+        try:
+            async with connection(replicas.pick([table.name])) as conn:
+                raw = conn.raw_connection
+                async with raw.transaction(isolation='repeatable_read',
+                                           readonly=True):
+                    cur = await raw.cursor(sql, timeout=remaining())
+                    while True:
+                        rows = await cur.fetch(batch_size,
+                                               timeout=remaining())
+                        if not rows:
+                            break
+                        yield rows
+        except Exception as exc:
+            raise ApiException(500, ErrorCategory.DB, repr(exc)) from exc
+
+    @read_only(users)
+    async def all_user(self, limit: int, offset: int) -> List[Mapping]:
+        return await self._all(users, limit, offset)
+
+    @read_only(categories)
+    async def all_category(self, limit: int, offset: int) -> List[Mapping]:
+        return await self._all(categories, limit, offset)
+
+    @read_only(users)
+    async def page_user(
+        self,
+        limit: int,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[Mapping], Optional[str]]:
+        return await self._page(users, limit, cursor)
+
+    @read_only(categories)
+    async def page_category(
+        self,
+        limit: int,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[Mapping], Optional[str]]:
+        return await self._page(categories, limit, cursor)
+
+    async def _count(self, column: Column, estimate: bool = False) -> int:
+        """number of rows in the table of a column
+
+        :param column: column counted, usually the primary key
+        :param estimate: read the planner's row estimate, as of the last
+            `ANALYZE` or autovacuum, instead of scanning the table; a
+            table the statistics know nothing of yet is counted
+        :return: row count
+        """
+        if estimate:
+            res = await self._estimate(column.table)
+            if res is not None:
+                return res
+        stmt = self._prepare(('count', column.table.name, column.name),
+                             lambda: select([func.count(column)]))
+        return await self._exec(stmt, 'fetch_val')
+
+    async def _estimate(self, table: Table) -> Optional[int]:
+        """rows of a table as of its last `ANALYZE` or autovacuum, the sum
+        of its leaf partitions if partitioned
+
+        a table never analysed has a reltuples of -1, or before Postgres 14
+        of 0 with no pages although its file has some; so has one analysed
+        empty that got rows since. For those the live tuples tracked by the
+        statistics are taken, once reported
+
+        :return: `None` if some leaf has neither, 0 for no such table
+        """
+        stmt = self._prepare(('estimate', ), lambda: text(
+            '''SELECT CASE WHEN bool_or(e.n IS NULL) THEN NULL
+                        ELSE coalesce(sum(e.n), 0) END
+               FROM (
+                   SELECT CASE
+                            WHEN c.reltuples >= 0 AND (
+                              c.relpages > 0 OR pg_relation_size(c.oid) = 0)
+                            THEN c.reltuples::bigint
+                            ELSE nullif(s.n_live_tup, 0)
+                          END AS n
+                   FROM pg_class c
+                   LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+                   WHERE c.relkind = 'r'
+                   AND (c.oid = to_regclass(:name) OR c.oid IN (
+                       SELECT relid
+                       FROM pg_partition_tree(to_regclass(:name))))
+               ) e'''))
+        return await self._exec(stmt, 'fetch_val', values={'name': table.name})
+
+    async def _lookup(
         self,
         table: Table,
         column: Column,
         key: Any,
-    ) -> Optional[RowProxy]:
-        stmt = select([table]).where(column == key)
-        res = self._exec(stmt).first()
+    ) -> Optional[Mapping]:
+        stmt = self._prepare(
+            ('lookup', table.name, column.name),
+            lambda: select([table]).where(column == bindparam('key')))
+        res = await self._exec(stmt, 'fetch_one', values={'key': key})
         if not res:
             raise ApiException(
                 404,
@@ -96,7 +627,30 @@ class Dao:
             )
         return res
 
-    def _insert_one(self, table: Table, pkid: str, **kwargs) -> int:
+    async def _lookup_many(
+        self,
+        table: Table,
+        column: Column,
+        keys: Sequence[Any],
+    ) -> Lookup:
+        """records of many keys in one query
+
+        :param table: table to read
+        :param column: unique column the keys are of, usually the primary
+            key
+        :param keys: keys to look up
+        :return: records found by key, and the keys of none in the order
+            given
+        """
+        stmt = self._prepare(
+            ('lookup_many', table.name, column.name),
+            lambda: select([table]).where(column == any_(
+                bindparam('keys', type_=postgresql.ARRAY(column.type)))))
+        rows = await self._exec(stmt, values={'keys': list(keys)})
+        found = {row[column.name]: row for row in rows}
+        return found, [key for key in keys if key not in found]
+
+    async def _insert_one(self, table: Table, pkid: str, **kwargs) -> int:
         """insert one record into table and return its primary key
 
         :param table: table object to be inserted
@@ -105,51 +659,328 @@ class Dao:
         :return:
         """
         stmt = table.insert().values(**kwargs).returning(table.columns[pkid])
-        res = self._exec(stmt)
-        return res.first()[0]
+        pk = await self._exec(stmt, 'fetch_val')
+        cache.invalidate(table.name)
+        return pk
+
+    def stream_users(self, batch_size: int) -> AsyncIterator[List[Mapping]]:
+        return self._stream(users, batch_size)
+
+    def stream_venues(self, batch_size: int) -> AsyncIterator[List[Mapping]]:
+        return self._stream(venues, batch_size)
+
+    def stream_categories(
+            self, batch_size: int) -> AsyncIterator[List[Mapping]]:
+        return self._stream(categories, batch_size)
+
+    def stream_dates(self, batch_size: int) -> AsyncIterator[List[Mapping]]:
+        return self._stream(dates, batch_size)
+
+    def stream_events(self, batch_size: int) -> AsyncIterator[List[Mapping]]:
+        return self._stream(events, batch_size)
+
+    def stream_listings(self,
+                        batch_size: int) -> AsyncIterator[List[Mapping]]:
+        return self._stream(listings, batch_size)
+
+    def stream_sales(self, batch_size: int) -> AsyncIterator[List[Mapping]]:
+        return self._stream(sales, batch_size)
 
-    def add_category(self, group: str, name: str, desc: str) -> int:
-        return self._insert_one(categories,
-                                'catid',
-                                catgroup=group,
-                                catname=name,
-                                catdesc=desc)
+    async def _insert_many(
+        self,
+        table: Table,
+        pkid: str,
+        rows: Sequence[Mapping[str, Any]],
+    ) -> Tuple[List[Optional[int]], Dict[int, str]]:
+        """insert records in one transaction with multi-row
+        `INSERT ... RETURNING` statements
+
+        rows are checked against column lengths up front, and a statement
+        failing in the database is retried row by row in savepoints, so
+        that bad rows are reported without aborting the batch
+
+        :param table: table object to be inserted
+        :param pkid: name of the primary key column
+        :param rows: column-value pairs of each record, all with the same
+            keys
+        :return: primary key of each record in input order, `None` if it
+            was not inserted, and the error message of each record not
+            inserted by its index
+        """
+        pkids = [None] * len(rows)
+        errors = {}
+        for i, row in enumerate(rows):
+            for key, value in row.items():
+                length = getattr(table.c[key].type, 'length', None)
+                if length and value is not None and len(value) > length:
+                    errors[i] = f'"{key}" is longer than {length} characters'
+        valid = [i for i in range(len(rows)) if i not in errors]
+        pk = table.columns[pkid]
+
+        async def insert_one(i: int) -> Optional[int]:
+            stmt = table.insert().values(**rows[i]).returning(pk)
+            try:
+                async with database.transaction():
+                    return await self._exec(stmt, 'fetch_val')
+            except ApiException as exc:
+                # a lost connection or the budget running out ends the batch
+                if exc.status_code != 500:
+                    raise
+                errors[i] = exc.message
+                return None
+
+        # asyncpg binds at most 32767 parameters per statement
+        chunk = 32767 // len(table.c)
+        try:
+            async with database.transaction():
+                for start in range(0, len(valid), chunk):
+                    idx = valid[start:start + chunk]
+                    stmt = table.insert().values([rows[i] for i in idx])
+                    try:
+                        async with database.transaction():
+                            res = await self._exec(stmt.returning(pk))
+                        ids = [rec[0] for rec in res]
+                    except ApiException as exc:
+                        if exc.status_code != 500:
+                            raise
+                        ids = [await insert_one(i) for i in idx]
+                    for i, pk_value in zip(idx, ids):
+                        pkids[i] = pk_value
+        except ApiException:
+            raise
+        except Exception as exc:
+            raise ApiException(500, ErrorCategory.DB, repr(exc)) from exc
+        cache.invalidate(table.name)
+        return pkids, errors
+
+    async def add_category(self, group: str, name: str, desc: str) -> int:
+        return await self._insert_one(categories,
+                                      'catid',
+                                      catgroup=group,
+                                      catname=name,
+                                      catdesc=desc)
+
+    async def add_categories(
+        self,
+        cates: Sequence[Mapping[str, Any]],
+    ) -> Tuple[List[Optional[int]], Dict[int, str]]:
+        """insert categories in one transaction
+
+        :param cates: 'catgroup', 'catname' and 'catdesc' of each category
+        :return: see `_insert_many`
+        """
+        return await self._insert_many(categories, 'catid', cates)
+
+    @coalesced(categories)
+    @cached(categories)
+    @read_only(categories)
+    async def lookup_category_id(self, cat_id: int) -> Optional[Mapping]:
+        return await self._lookup(categories, categories.c.catid, cat_id)
+
+    @coalesced(categories)
+    @cached(categories)
+    @read_only(categories)
+    async def lookup_category_name(self, cat_name: str) -> Optional[Mapping]:
+        return await self._lookup(categories, categories.c.catname, cat_name)
+
+    @coalesced(users)
+    @read_only(users)
+    async def lookup_users(self, ids: Tuple[int, ...]) -> Lookup:
+        return await self._lookup_many(users, users.c.userid, ids)
+
+    @coalesced(venues)
+    @read_only(venues)
+    async def lookup_venues(self, ids: Tuple[int, ...]) -> Lookup:
+        return await self._lookup_many(venues, venues.c.venueid, ids)
 
-    def lookup_category_id(self, cat_id: int) -> Optional[RowProxy]:
-        return self._lookup(categories, categories.c.catid, cat_id)
+    @coalesced(categories)
+    @read_only(categories)
+    async def lookup_categories(self, ids: Tuple[int, ...]) -> Lookup:
+        return await self._lookup_many(categories, categories.c.catid, ids)
 
-    def lookup_category_name(self, cat_name: str) -> Optional[RowProxy]:
-        return self._lookup(categories, categories.c.catname, cat_name)
+    @coalesced(events)
+    @read_only(events)
+    async def lookup_events(self, ids: Tuple[int, ...]) -> Lookup:
+        return await self._lookup_many(events, events.c.eventid, ids)
 
-    def count_users(self) -> int:
-        return self._count(users.c.userid)
+    @coalesced(users)
+    @cached(users)
+    @read_only(users)
+    async def count_users(self, estimate: bool = False) -> int:
+        return await self._count(users.c.userid, estimate)
 
-    def count_venues(self) -> int:
-        return self._count(venues.c.venueid)
+    @coalesced(venues)
+    @cached(venues)
+    @read_only(venues)
+    async def count_venues(self, estimate: bool = False) -> int:
+        return await self._count(venues.c.venueid, estimate)
 
-    def count_categories(self) -> int:
-        return self._count(categories.c.catid)
+    @coalesced(categories)
+    @cached(categories)
+    @read_only(categories)
+    async def count_categories(self, estimate: bool = False) -> int:
+        return await self._count(categories.c.catid, estimate)
 
-    def count_dates(self) -> int:
-        return self._count(dates.c.dateid)
+    @coalesced(dates)
+    @cached(dates)
+    @read_only(dates)
+    async def count_dates(self, estimate: bool = False) -> int:
+        return await self._count(dates.c.dateid, estimate)
 
-    def count_events(self) -> int:
-        return self._count(events.c.eventid)
+    @coalesced(events)
+    @cached(events)
+    @read_only(events)
+    async def count_events(self, estimate: bool = False) -> int:
+        return await self._count(events.c.eventid, estimate)
 
-    def count_listings(self) -> int:
-        return self._count(listings.c.listid)
+    @coalesced(listings)
+    @cached(listings)
+    @read_only(listings)
+    async def count_listings(self, estimate: bool = False) -> int:
+        return await self._count(listings.c.listid, estimate)
 
-    def count_sales(self) -> int:
-        return self._count(sales.c.salesid)
+    @coalesced(sales)
+    @cached(sales)
+    @read_only(sales)
+    async def count_sales(self, estimate: bool = False) -> int:
+        return await self._count(sales.c.salesid, estimate)
 
-    def total_sales_amount(self, dt: str) -> int:
+    @coalesced(daily_sales)
+    @cached(daily_sales)
+    @read_only(daily_sales)
+    async def count_daily_sales(self, estimate: bool = False) -> int:
+        return await self._count(daily_sales.c.caldate, estimate)
+
+    @coalesced(daily_sales)
+    @cached(daily_sales)
+    @read_only(daily_sales)
+    async def total_sales_amount(self, dt: str) -> int:
         """total sales on a given calendar date.
 
         :param dt: date string formatted as 'yyyy-mm-dd'
         :return: total sales on that day
         """
-        stmt = select([func.sum(sales.c.qtysold).label('total_sold')
-                       ]).where(dates.c.caldate == dt).select_from(
-                           sales.join(dates, sales.c.dateid == dates.c.dateid))
-        res = self._exec(stmt)
-        return res.first()[0] or 0
+        stmt = self._prepare(
+            ('total_sales_amount', ),
+            lambda: select([daily_sales.c.qtysold]).where(
+                daily_sales.c.caldate == bindparam('dt')))
+        res = await self._exec(stmt,
+                               'fetch_val',
+                               values={'dt': date.fromisoformat(dt)})
+        return res or 0
+
+    @coalesced(daily_sales)
+    @cached(daily_sales)
+    @read_only(daily_sales)
+    async def sales_closed(self, dt: str) -> bool:
+        """whether the total sales of a date are final: the rollup has a
+        row for it and for a later date, so a load reached past it
+
+        :param dt: date string formatted as 'yyyy-mm-dd'
+        """
+        def build():
+            day = bindparam('dt')
+            return select([
+                and_(
+                    exists().where(daily_sales.c.caldate == day),
+                    day < select([func.max(daily_sales.c.caldate)
+                                  ]).as_scalar(),
+                )
+            ])
+
+        stmt = self._prepare(('sales_closed', ), build)
+        res = await self._exec(stmt,
+                               'fetch_val',
+                               values={'dt': date.fromisoformat(dt)})
+        return bool(res)
+
+    @coalesced(sales, daily_sales, dates, events, categories, venues)
+    @read_only(sales, daily_sales, dates, events, categories, venues)
+    async def sales_series(
+        self,
+        start: date,
+        end: date,
+        group_by: str,
+        max_groups: int,
+    ) -> List[Dict[str, Any]]:
+        """sales quantity, revenue and commission between two calendar
+        dates (both inclusive), aggregated by one grouped query
+
+        calendar groupings ('day', 'week', 'month', 'qtr') read the daily
+        rollup, the others ('category', 'venue', 'event') aggregate
+        `f_sale` joined to `f_event` and the dimension table
+
+        :param start: first calendar date
+        :param end: last calendar date
+        :param group_by: one of the groupings above
+        :param max_groups: result-size cap
+        :return: one record per group with keys 'key', 'name', 'qtysold',
+            'revenue' and 'commission'
+        """
+        periods = {
+            'day': (dates.c.caldate, ),
+            'week': (dates.c.year, dates.c.week),
+            'month': (dates.c.year, dates.c.month),
+            'qtr': (dates.c.year, dates.c.qtr),
+        }
+        dimensions = {
+            'category': (categories.c.catid, categories.c.catname),
+            'venue': (venues.c.venueid, venues.c.venuename),
+            'event': (events.c.eventid, events.c.eventname),
+        }
+        if group_by in periods:
+            keys = periods[group_by]
+            src = daily_sales.join(dates,
+                                   daily_sales.c.caldate == dates.c.caldate)
+            stmt = select([
+                *keys,
+                func.sum(daily_sales.c.qtysold).label('qtysold'),
+                func.sum(daily_sales.c.revenue).label('revenue'),
+                func.sum(daily_sales.c.commission).label('commission'),
+            ]).select_from(src).where(
+                daily_sales.c.caldate.between(start, end)).group_by(
+                    *keys).order_by(func.min(dates.c.caldate))
+        elif group_by in dimensions:
+            keys = dimensions[group_by]
+            src = sales.join(dates, sales.c.dateid == dates.c.dateid).join(
+                events, sales.c.eventid == events.c.eventid)
+            if keys[0].table is not events:
+                src = src.join(keys[0].table,
+                               events.c[keys[0].name] == keys[0])
+            stmt = select([
+                *keys,
+                func.sum(sales.c.qtysold).label('qtysold'),
+                func.coalesce(func.sum(sales.c.pricepaid), 0).label('revenue'),
+                func.coalesce(func.sum(sales.c.commission),
+                              0).label('commission'),
+            ]).select_from(src).where(dates.c.caldate.between(
+                start, end)).group_by(*keys).order_by(keys[0])
+        else:
+            raise ApiException(400, ErrorCategory.REQUEST_INVALID,
+                               f'cannot group sales by "{group_by}"')
+
+        rows = await self._exec(stmt.limit(max_groups + 1))
+        if len(rows) > max_groups:
+            raise ApiException(
+                400,
+                ErrorCategory.REQUEST_INVALID,
+                f'more than {max_groups} groups, narrow the date range',
+            )
+
+        def label(row: Mapping) -> Tuple[str, Optional[str]]:
+            if group_by == 'day':
+                return row['caldate'].isoformat(), None
+            if group_by == 'week':
+                return f'{row["year"]}-W{row["week"]:02d}', None
+            if group_by == 'month':
+                return f'{row["year"]}-{row["month"].strip()}', None
+            if group_by == 'qtr':
+                return f'{row["year"]}-Q{row["qtr"].strip()}', None
+            return str(row[keys[0].name]), row[keys[1].name]
+
+        return [
+            dict(zip(('key', 'name'), label(row)),
+                 qtysold=int(row['qtysold']),
+                 revenue=row['revenue'],
+                 commission=row['commission']) for row in rows
+        ]
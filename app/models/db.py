@@ -1,19 +1,21 @@
-import logging.config
+import logging
 from typing import List, NoReturn
 
 from app import cfg
+from app.log import setup_logging
 from app.models.session import engine
-from app.models.tables import (categories, dates, events, listings, sales,
-                               users, venues)
+from app.models.tables import (categories, daily_sales, dates, events,
+                               listings, sales, users, venues)
 
 __all__ = ['DB']
 
-logging.config.dictConfig(cfg.LOGGING)
+setup_logging()
 logger = logging.getLogger('info_logger')
 
 
 class DB:
-    _TABLES = (sales, listings, events, users, venues, categories, dates)
+    _TABLES = (daily_sales, sales, listings, events, users, venues,
+               categories, dates)
 
     @staticmethod
     def all_tables() -> List[str]:
@@ -0,0 +1,79 @@
+"""fixed-shape statements compiled once
+
+`databases` builds and compiles the SQLAlchemy expression of every call,
+although for the hot lookups and counts only the parameters ever change.
+A `Prepared` compiles its expression once, to the `$n` placeholders of
+asyncpg, and is run on the raw driver connection; asyncpg keeps a
+server-side prepared statement per connection for each SQL text, so a
+repeated call is a bind and execute only.
+"""
+from typing import Any, List, Mapping, Optional
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import ClauseElement
+
+__all__ = ['Prepared']
+
+_dialect = postgresql.dialect(paramstyle='pyformat')
+
+# `databases.Database` method names, as used by `Dao._exec`, to asyncpg
+_METHODS = {
+    'fetch_all': 'fetch',
+    'fetch_one': 'fetchrow',
+    'fetch_val': 'fetchval',
+    'execute': 'execute',
+}
+
+
+class Prepared:
+    """a statement compiled to asyncpg SQL with named parameters
+
+    parameters are declared in the expression with `bindparam(name)`, or
+    `:name` in a `text` clause, and bound per call by name.
+    """
+    __slots__ = ('sql', 'names', '_compiled', '_processors')
+
+    def __init__(self, stmt: ClauseElement):
+        compiled = stmt.compile(dialect=_dialect)
+        self.names = tuple(sorted(compiled.params))
+        self.sql = compiled.string % {
+            name: f'${i}'
+            for i, name in enumerate(self.names, start=1)
+        }
+        self._compiled = compiled
+        self._processors = compiled._bind_processors
+
+    def __repr__(self):
+        return f'Prepared({self.sql!r})'
+
+    def args(self, values: Optional[Mapping[str, Any]] = None) -> List[Any]:
+        """positional arguments of a call
+
+        :param values: parameter values by name, the ones left out keep
+            the value given in the expression
+        """
+        params = self._compiled.construct_params(values)
+        return [
+            self._processors[name](params[name])
+            if name in self._processors else params[name]
+            for name in self.names
+        ]
+
+    async def run(self,
+                  conn,
+                  method: str = 'fetch_all',
+                  values: Optional[Mapping[str, Any]] = None):
+        """run on an asyncpg connection
+
+        :param conn: asyncpg connection
+        :param method: 'fetch_all', 'fetch_one', 'fetch_val' or 'execute'
+        :param values: parameter values by name
+        :return: rows as dicts for 'fetch_all' and 'fetch_one'
+        """
+        res = await getattr(conn, _METHODS[method])(self.sql,
+                                                    *self.args(values))
+        if method == 'fetch_all':
+            return [dict(row) for row in res]
+        if method == 'fetch_one':
+            return dict(res) if res is not None else None
+        return res
@@ -0,0 +1,170 @@
+"""read-replica routing of `Dao` reads
+
+the queries of `Dao` methods marked `read_only` run on a replica from
+`SA_REPLICAS`, picked round-robin or by fewest connections checked out;
+writes, and reads inside a transaction, stay on the primary. The replay
+lag of each replica is polled, a replica further behind than
+`SA_REPLICA_MAX_LAG`, or unreachable, is skipped until it catches up.
+Tables written as recently, by any worker as told by their versions in the
+shared cache, are read from the primary, so that clients read their own
+writes whichever worker they reach next.
+"""
+import asyncio
+import itertools
+import logging
+import math
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, Iterable, Optional, Union
+
+from databases import Database
+from sqlalchemy import Table
+
+from app import cfg
+from app.models.cache import LocalCache, SharedCache, cache
+from app.models.session import (checked_out, database, in_transaction,
+                                new_database)
+
+__all__ = ['ReplicaSet', 'replicas', 'read_only', 'reader']
+
+logger = logging.getLogger(cfg.LOGGER)
+
+# seconds a replica is behind, none once it replayed all the WAL it
+# received; a server not in recovery, e.g. a stand-in, has no lag either
+_LAG_SQL = '''SELECT CASE
+                WHEN NOT pg_is_in_recovery()
+                  OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+                THEN 0
+                ELSE extract(epoch FROM
+                             now() - pg_last_xact_replay_timestamp())
+              END'''
+
+_reader: ContextVar[Optional[Database]] = ContextVar('reader', default=None)
+
+
+class ReplicaSet:
+    """the replicas of one worker and their lag
+
+    :param dsns: DSN of each replica
+    :param policy: 'round_robin' or 'least_conn'
+    :param max_lag: seconds a replica may lag behind the primary
+    :param interval: seconds between two lag checks
+    :param versions: cache holding the table versions, bumped to the clock
+        by every write, `cache` by default; with a `LocalCache` a worker
+        only knows of its own writes
+    """
+    def __init__(self,
+                 dsns: Iterable[str],
+                 policy: str = 'round_robin',
+                 max_lag: float = 5.0,
+                 interval: float = 1.0,
+                 versions: Optional[Union[LocalCache, SharedCache]] = None):
+        if policy not in ('round_robin', 'least_conn'):
+            raise ValueError(f'unknown replica policy "{policy}"')
+        self.databases = [
+            new_database(dsn, f'{cfg.SA_APP_NAME}-replica') for dsn in dsns
+        ]
+        self.policy = policy
+        self.max_lag = max_lag
+        self.interval = interval
+        # unknown until checked
+        self.lag: Dict[Database, float] = {
+            db: math.inf
+            for db in self.databases
+        }
+        self._versions = cache if versions is None else versions
+        self._turn = itertools.count()
+        self._monitor: Optional[asyncio.Future] = None
+
+    async def connect(self):
+        """connect the replicas and poll their lag from now on"""
+        if self.databases:
+            await self.check()
+            self._monitor = asyncio.ensure_future(self._poll())
+
+    async def disconnect(self):
+        if self._monitor:
+            self._monitor.cancel()
+            self._monitor = None
+        for db in self.databases:
+            if db.is_connected:
+                await db.disconnect()
+
+    async def check(self):
+        """refresh the lag of every replica, connecting the ones that are
+        not yet"""
+        await asyncio.gather(*(self._check(db) for db in self.databases))
+
+    async def _check(self, db: Database):
+        try:
+            if not db.is_connected:
+                await db.connect()
+            lag = await asyncio.wait_for(db.fetch_val(_LAG_SQL),
+                                         max(self.interval, 1))
+            self.lag[db] = float(lag or 0)
+        except Exception as exc:  # pylint: disable=broad-except
+            if self.lag[db] < math.inf:
+                logger.warning('replica %s unavailable: %r', db.url.hostname,
+                               exc)
+            self.lag[db] = math.inf
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check()
+
+    def down(self, db: Database):
+        """skip a replica which lost its connection until the next check"""
+        if db in self.lag:
+            self.lag[db] = math.inf
+
+    def recently_written(self, tables: Iterable[str]) -> bool:
+        """whether a table was written by any worker within `max_lag`, so
+        that a replica may still miss the write"""
+        # versions are bumped to the clock in nanoseconds
+        since = time.time_ns() - self.max_lag * 1e9
+        return any(self._versions.version(table) > since for table in tables)
+
+    def pick(self, tables: Iterable[str]) -> Database:
+        """database to read tables from"""
+        if not self.databases or in_transaction():
+            return database
+        if self.recently_written(tables):
+            return database
+        live = [db for db in self.databases if self.lag[db] <= self.max_lag]
+        if not live:
+            return database
+        if self.policy == 'least_conn':
+            return min(live, key=checked_out)
+        return live[next(self._turn) % len(live)]
+
+
+replicas = ReplicaSet(cfg.SA_REPLICAS, cfg.SA_REPLICA_POLICY,
+                      cfg.SA_REPLICA_MAX_LAG, cfg.SA_REPLICA_CHECK_INTERVAL)
+
+
+def read_only(*tables: Table):
+    """run the queries of a `Dao` coroutine method on a replica
+
+    :param tables: tables the method reads
+    """
+    names = tuple(t.name for t in tables)
+
+    def decorator(fn):
+        @wraps(fn)
+        async def helper(*args, **kwargs):
+            token = _reader.set(replicas.pick(names))
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                _reader.reset(token)
+
+        return helper
+
+    return decorator
+
+
+def reader() -> Optional[Database]:
+    """database of the current `read_only` call, `None` outside of one"""
+    return _reader.get()
@@ -0,0 +1,261 @@
+"""synthetic TICKIT data at any scale
+
+rows are generated by Postgres itself, as one `SELECT` over
+`generate_series` per table, so that nothing is built row by row in
+Python: `Dao.load_synthetic` inserts them in parallel chunks,
+`Dao.generate_sample` streams them out as sample files the loader reads.
+
+every value is a hash of the row's key, which makes a run reproducible
+and lets a row compute the attributes of the rows it references instead
+of joining them: a sale draws its listing, and from the listing's key
+alone derives the listing's event, seller, price and date, and from the
+event's key the event's date. A listing is dated before its event, a
+sale between its listing and the event, and sells no more tickets than
+listed.
+
+the calendar is the sample's, the 365 days from 2008-01-01, and so are
+the 11 categories; the other tables grow with the scale factor.
+"""
+from datetime import date
+from typing import Dict, List, Tuple
+
+from sqlalchemy import Sequence, Table
+
+from app.models.tables import (categories, dates, dateid_seq, events,
+                               listings, sales, users, venues)
+
+__all__ = ['chunks', 'reset_sequence', 'rows', 'sizes']
+
+# rows of the TICKIT sample
+_SAMPLE = {
+    users: 49990,
+    venues: 202,
+    categories: 11,
+    dates: 365,
+    events: 8798,
+    listings: 192497,
+    sales: 172456,
+}
+_FIXED = (categories, dates)
+_FIRST_DATE = date(2008, 1, 1)
+_FIRST_DATEID = dateid_seq.start
+
+_FIRSTNAMES = ('James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer',
+               'Michael', 'Linda', 'William', 'Elizabeth', 'David', 'Barbara',
+               'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah',
+               'Charles', 'Karen')
+_LASTNAMES = ('Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia',
+              'Miller', 'Davis', 'Rodriguez', 'Martinez', 'Hernandez',
+              'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor',
+              'Moore', 'Jackson', 'Martin')
+_CITIES = (('New York City', 'NY'), ('Los Angeles', 'CA'), ('Chicago', 'IL'),
+           ('Houston', 'TX'), ('Phoenix', 'AZ'), ('Philadelphia', 'PA'),
+           ('San Antonio', 'TX'), ('San Diego', 'CA'), ('Dallas', 'TX'),
+           ('San Jose', 'CA'), ('Austin', 'TX'), ('Seattle', 'WA'),
+           ('Denver', 'CO'), ('Boston', 'MA'), ('Las Vegas', 'NV'),
+           ('Miami', 'FL'), ('Atlanta', 'GA'), ('Portland', 'OR'),
+           ('Nashville', 'TN'), ('Washington', 'DC'))
+_CATEGORIES = (
+    ('Sports', 'MLB', 'Major League Baseball'),
+    ('Sports', 'NHL', 'National Hockey League'),
+    ('Sports', 'NFL', 'National Football League'),
+    ('Sports', 'NBA', 'National Basketball Association'),
+    ('Sports', 'MLS', 'Major League Soccer'),
+    ('Shows', 'Musicals', 'Musical theatre'),
+    ('Shows', 'Plays', 'All non-musical theatre'),
+    ('Shows', 'Opera', 'All opera and light opera'),
+    ('Concerts', 'Pop', 'All rock and pop music concerts'),
+    ('Concerts', 'Jazz', 'All jazz singers and bands'),
+    ('Concerts', 'Classical', 'All symphony, concerto, and choir concerts'),
+)
+_LIKES = ('likesports', 'liketheatre', 'likeconcerts', 'likejazz',
+          'likeclassical', 'likeopera', 'likerock', 'likevegas',
+          'likebroadway', 'likemusicals')
+# sale of a listing at most that many days before the event
+_LEAD_DAYS = 30
+
+
+def sizes(scale: float) -> Dict[Table, int]:
+    """rows of each table at a scale factor of the TICKIT sample"""
+    return {
+        table: n if table in _FIXED else max(round(n * scale), 1)
+        for table, n in _SAMPLE.items()
+    }
+
+
+def chunks(n: int, parts: int) -> List[Tuple[int, int]]:
+    """split keys 1 to n into ranges of first and last key"""
+    step = max(-(-n // max(parts, 1)), 1)
+    return [(first, min(first + step - 1, n))
+            for first in range(1, n + 1, step)]
+
+
+def _hash(key: str, salt: int, n) -> str:
+    """SQL of a uniform integer from 0 to n - 1 drawn from a key"""
+    return (f'((hashint8extended(({key})::bigint, {salt}) '
+            f'& 9223372036854775807) % ({n}))')
+
+
+def _text_array(values) -> str:
+    items = ', '.join("'{}'".format(v.replace("'", "''")) for v in values)
+    return f'ARRAY[{items}]'
+
+
+def _pick(values, key: str, salt: int) -> str:
+    return f'({_text_array(values)})[1 + {_hash(key, salt, len(values))}]'
+
+
+def _listing(key: str, n: Dict[Table, int]) -> str:
+    """laterals `li`, `ev` and `lo` of the listing with key `key`: its
+    event, seller, tickets and price, the day of its event and its own day,
+    as offsets from the first date"""
+    return f'''
+        LATERAL (SELECT 1 + {_hash(key, 21, n[events])} AS eventid,
+                        1 + {_hash(key, 22, n[users])} AS sellerid,
+                        1 + {_hash(key, 23, 20)} AS numtickets,
+                        ((1000 + {_hash(key, 24, 99000)}) / 100.0
+                         )::numeric(8, 2) AS priceperticket) li,
+        LATERAL (SELECT {_event_day('li.eventid', n)} AS ev_off) ev,
+        LATERAL (SELECT greatest(ev.ev_off - {_hash(key, 25, _LEAD_DAYS)},
+                                 0) AS list_off) lo'''
+
+
+def _event_day(key: str, n: Dict[Table, int]) -> str:
+    return _hash(key, 11, n[dates])
+
+
+def _time(day: str, key: str, salt: int) -> str:
+    return (f"timestamp '{_FIRST_DATE}' + ({day}) * interval '1 day' "
+            f"+ {_hash(key, salt, 86400)} * interval '1 second'")
+
+
+def _users(n: Dict[Table, int], first: int, last: int) -> str:
+    likes = ',\n'.join(
+        f'(ARRAY[true, false, NULL]::boolean[])[1 + {_hash("i", 10 + k, 3)}]'
+        f' AS {name}' for k, name in enumerate(_LIKES))
+    return f'''
+        SELECT i AS userid, to_hex(i) AS username,
+               fn.firstname, ln.lastname,
+               {_pick([c for c, _ in _CITIES], 'ck.k', 0)} AS city,
+               {_pick([s for _, s in _CITIES], 'ck.k', 0)} AS state,
+               lower(fn.firstname || '.' || ln.lastname || i)
+                   || '@example.com' AS email,
+               format('(%s) %s-%s', 200 + {_hash('i', 4, 800)},
+                      lpad({_hash('i', 5, 1000)}::text, 3, '0'),
+                      lpad({_hash('i', 6, 10000)}::text, 4, '0')) AS phone,
+               {likes}
+        FROM generate_series({first}, {last}) i,
+        LATERAL (SELECT {_pick(_FIRSTNAMES, 'i', 1)} AS firstname) fn,
+        LATERAL (SELECT {_pick(_LASTNAMES, 'i', 2)} AS lastname) ln,
+        LATERAL (SELECT {_hash('i', 3, len(_CITIES))} AS k) ck'''
+
+
+def _venues(_: Dict[Table, int], first: int, last: int) -> str:
+    return f'''
+        SELECT i AS venueid, 'Venue ' || i AS venuename,
+               {_pick([c for c, _ in _CITIES], 'ck.k', 0)} AS venuecity,
+               {_pick([s for _, s in _CITIES], 'ck.k', 0)} AS venuestate,
+               1000 * (1 + {_hash('i', 41, 70)}) AS venueseats
+        FROM generate_series({first}, {last}) i,
+        LATERAL (SELECT {_hash('i', 3, len(_CITIES))} AS k) ck'''
+
+
+def _categories(_: Dict[Table, int], first: int, last: int) -> str:
+    values = ',\n'.join("({}, '{}', '{}', '{}')".format(i, *row)
+                        for i, row in enumerate(_CATEGORIES, 1))
+    return f'''
+        SELECT * FROM (VALUES {values}
+        ) c (catid, catgroup, catname, catdesc)
+        WHERE catid BETWEEN {first} AND {last}'''
+
+
+def _dates(_: Dict[Table, int], first: int, last: int) -> str:
+    return f'''
+        SELECT {_FIRST_DATEID - 1} + i AS dateid, d AS caldate,
+               upper(left(to_char(d, 'Dy'), 2)) AS day,
+               extract(week FROM d)::smallint AS week,
+               upper(to_char(d, 'MON')) AS month,
+               extract(quarter FROM d)::text AS qtr,
+               extract(year FROM d)::smallint AS year,
+               to_char(d, 'MM-DD') IN ('01-01', '07-04', '11-27', '12-25')
+                   AS holiday
+        FROM generate_series({first}, {last}) i,
+        LATERAL (SELECT date '{_FIRST_DATE}' + (i - 1)::int AS d) c'''
+
+
+def _events(n: Dict[Table, int], first: int, last: int) -> str:
+    hours = f"(12 + {_hash('i', 14, 10)}) * interval '1 hour'"
+    return f'''
+        SELECT i AS eventid, 1 + {_hash('i', 12, n[venues])} AS venueid,
+               1 + {_hash('i', 13, n[categories])} AS catid,
+               {_FIRST_DATEID} + ev.ev_off AS dateid,
+               'Event ' || i AS eventname,
+               timestamp '{_FIRST_DATE}' + ev.ev_off * interval '1 day'
+                   + {hours} AS starttime
+        FROM generate_series({first}, {last}) i,
+        LATERAL (SELECT {_event_day('i', n)} AS ev_off) ev'''
+
+
+def _listings(n: Dict[Table, int], first: int, last: int) -> str:
+    return f'''
+        SELECT i AS listid, li.sellerid, li.eventid,
+               {_FIRST_DATEID} + lo.list_off AS dateid, li.numtickets,
+               li.priceperticket,
+               li.numtickets * li.priceperticket AS totalprice,
+               {_time('lo.list_off', 'i', 26)} AS listtime
+        FROM generate_series({first}, {last}) i,
+        {_listing('i', n)}'''
+
+
+def _sales(n: Dict[Table, int], first: int, last: int) -> str:
+    return f'''
+        SELECT i AS salesid, sl.listid, li.sellerid,
+               1 + {_hash('i', 31, n[users])} AS buyerid, li.eventid,
+               {_FIRST_DATEID} + so.sale_off AS dateid, q.qtysold,
+               q.qtysold * li.priceperticket AS pricepaid,
+               round(q.qtysold * li.priceperticket * 0.15, 2) AS commission,
+               {_time('so.sale_off', 'i', 34)} AS saletime
+        FROM generate_series({first}, {last}) i,
+        LATERAL (SELECT 1 + {_hash('i', 30, n[listings])} AS listid) sl,
+        {_listing('sl.listid', n)},
+        LATERAL (SELECT lo.list_off + {_hash('i', 32,
+                                             'ev.ev_off - lo.list_off + 1')}
+                 AS sale_off) so,
+        LATERAL (SELECT 1 + {_hash('i', 33, 'least(li.numtickets, 8)')}
+                 AS qtysold) q'''
+
+
+_ROWS = {
+    users: _users,
+    venues: _venues,
+    categories: _categories,
+    dates: _dates,
+    events: _events,
+    listings: _listings,
+    sales: _sales,
+}
+
+
+def rows(table: Table, n: Dict[Table, int], first: int, last: int) -> str:
+    """SQL of the rows of a table with keys `first` to `last`, columns
+    named after the table's, primary key first
+
+    :param table: one of the TICKIT tables
+    :param n: rows of each table, see `sizes`
+    :param first: first key, from 1
+    :param last: last key, at most `n[table]`
+    """
+    return _ROWS[table](n, int(first), int(last))
+
+
+def reset_sequence(table: Table) -> str:
+    """SQL moving the key sequence of a table past its rows, after they
+    were inserted with their keys"""
+    pk = next(iter(table.primary_key.columns))
+    if isinstance(pk.default, Sequence):
+        seq = f"'{pk.default.name}'"
+    else:
+        seq = f"pg_get_serial_sequence('{table.name}', '{pk.name}')"
+    return (f'SELECT setval({seq}, '
+            f'(SELECT coalesce(max({pk.name}), 0) + 1 FROM {table.name}), '
+            f'false)')
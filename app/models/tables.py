@@ -1,13 +1,24 @@
 from datetime import datetime
 
-from sqlalchemy import (CHAR, DECIMAL, TIMESTAMP, VARCHAR, Boolean, Column,
-                        Date, ForeignKey, Integer, MetaData, Sequence,
-                        SmallInteger, Table)
+from sqlalchemy import (CHAR, DDL, DECIMAL, TIMESTAMP, VARCHAR, BigInteger,
+                        Boolean, Column, Date, ForeignKey, Integer, MetaData,
+                        Sequence, SmallInteger, Table, event)
+
+from app import cfg
 
 metadata = MetaData()
 
 dateid_seq = Sequence('dateid_seq', start=1827, increment=1)
 
+# optional range partitioning of the fact tables `f_listing` and `f_sale` by
+# `dateid`. The partition key must be part of the primary key, and a
+# partitioned `f_listing` cannot be referenced by `listid` alone, so that
+# `f_sale.listid` has no foreign key then
+partitioned = cfg.SA_PARTITION_FACTS
+partition_by = {
+    'postgresql_partition_by': 'RANGE (dateid)'
+} if partitioned else {}
+
 users = Table(
     'd_user',
     metadata,
@@ -46,7 +57,7 @@ categories = Table(
     metadata,
     Column('catid', Integer, primary_key=True),
     Column('catgroup', VARCHAR(10)),
-    Column('catname', VARCHAR(10)),
+    Column('catname', VARCHAR(10), index=True),
     Column('catdesc', VARCHAR(50)),
 )
 
@@ -58,7 +69,7 @@ dates = Table(
            dateid_seq,
            server_default=dateid_seq.next_value(),
            primary_key=True),
-    Column('caldate', Date, nullable=False),
+    Column('caldate', Date, nullable=False, index=True),
     Column('day', CHAR(3), nullable=False),
     Column('week', SmallInteger, nullable=False),
     Column('month', CHAR(5), nullable=False),
@@ -75,16 +86,19 @@ events = Table(
         'venueid',
         Integer,
         ForeignKey('d_venue.venueid', onupdate='CASCADE', ondelete='CASCADE'),
+        index=True,
     ),
     Column(
         'catid',
         Integer,
         ForeignKey('d_category.catid', onupdate='CASCADE', ondelete='CASCADE'),
+        index=True,
     ),
     Column(
         'dateid',
         Integer,
         ForeignKey('d_date.dateid', onupdate='CASCADE', ondelete='CASCADE'),
+        index=True,
     ),
     Column('eventname', VARCHAR(200)),
     Column('starttime', TIMESTAMP, default=datetime.now),
@@ -93,32 +107,41 @@ events = Table(
 listings = Table(
     'f_listing',
     metadata,
-    Column('listid', Integer, primary_key=True),
+    Column('listid', Integer, primary_key=True, autoincrement=True),
     Column('sellerid', Integer, nullable=False),
     Column(
         'eventid',
         Integer,
         ForeignKey('f_event.eventid', onupdate='CASCADE', ondelete='CASCADE'),
+        index=True,
     ),
     Column(
         'dateid',
         Integer,
         ForeignKey('d_date.dateid', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=partitioned,
+        index=True,
     ),
     Column('numtickets', SmallInteger, nullable=False),
     Column('priceperticket', DECIMAL(8, 2)),
     Column('totalprice', DECIMAL(8, 2)),
     Column('listtime', TIMESTAMP),
+    **partition_by,
 )
 
 sales = Table(
     'f_sale',
     metadata,
-    Column('salesid', Integer, primary_key=True),
+    Column('salesid', Integer, primary_key=True, autoincrement=True),
     Column(
         'listid',
         Integer,
-        ForeignKey('f_listing.listid', onupdate='CASCADE', ondelete='CASCADE'),
+        *([] if partitioned else [
+            ForeignKey('f_listing.listid',
+                       onupdate='CASCADE',
+                       ondelete='CASCADE')
+        ]),
+        index=True,
     ),
     Column('sellerid', Integer, nullable=False),
     Column('buyerid', Integer, nullable=False),
@@ -126,14 +149,82 @@ sales = Table(
         'eventid',
         Integer,
         ForeignKey('f_event.eventid', onupdate='CASCADE', ondelete='CASCADE'),
+        index=True,
     ),
     Column(
         'dateid',
         Integer,
         ForeignKey('d_date.dateid', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=partitioned,
+        index=True,
     ),
     Column('qtysold', SmallInteger, nullable=False),
     Column('pricepaid', DECIMAL(8, 2)),
     Column('commission', DECIMAL(8, 2)),
     Column('saletime', TIMESTAMP),
+    **partition_by,
+)
+
+if partitioned:
+    for fact in (listings, sales):
+        for n in range(cfg.SA_PARTITIONS):
+            low = dateid_seq.start + n * cfg.SA_PARTITION_SPAN
+            event.listen(
+                fact,
+                'after_create',
+                DDL(f'CREATE TABLE {fact.name}_p{n} PARTITION OF {fact.name} '
+                    f'FOR VALUES FROM ({low}) TO '
+                    f'({low + cfg.SA_PARTITION_SPAN})'),
+            )
+        event.listen(
+            fact,
+            'after_create',
+            DDL(f'CREATE TABLE {fact.name}_default PARTITION OF {fact.name} '
+                'DEFAULT'),
+        )
+
+# daily rollup of `f_sale`, kept up to date by a statement-level trigger on
+# `f_sale` inserts so that daily totals are a primary key lookup
+daily_sales = Table(
+    'a_daily_sale',
+    metadata,
+    Column('caldate', Date, primary_key=True),
+    Column('qtysold', BigInteger, nullable=False),
+    Column('revenue', DECIMAL(14, 2), nullable=False),
+    Column('commission', DECIMAL(14, 2), nullable=False),
+)
+
+event.listen(
+    daily_sales,
+    'after_create',
+    DDL('''
+        CREATE OR REPLACE FUNCTION a_daily_sale_ins() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO a_daily_sale (caldate, qtysold, revenue, commission)
+            SELECT d.caldate, sum(n.qtysold), coalesce(sum(n.pricepaid), 0),
+                   coalesce(sum(n.commission), 0)
+            FROM new_rows n JOIN d_date d ON d.dateid = n.dateid
+            GROUP BY d.caldate
+            ON CONFLICT (caldate) DO UPDATE SET
+                qtysold = a_daily_sale.qtysold + excluded.qtysold,
+                revenue = a_daily_sale.revenue + excluded.revenue,
+                commission = a_daily_sale.commission + excluded.commission;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        '''),
+)
+event.listen(
+    daily_sales,
+    'after_create',
+    DDL('''
+        CREATE TRIGGER f_sale_rollup AFTER INSERT ON f_sale
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE PROCEDURE a_daily_sale_ins()
+        '''),
+)
+event.listen(
+    daily_sales,
+    'before_drop',
+    DDL('DROP TRIGGER IF EXISTS f_sale_rollup ON f_sale'),
 )
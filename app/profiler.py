@@ -0,0 +1,62 @@
+"""sampling profiler of a live worker
+
+a background thread records the Python stack of the event loop thread at
+a fixed interval, while the loop keeps serving requests. The samples are
+returned as folded stacks, one `frame;frame;...;frame count` line per
+distinct stack from root to leaf, which `flamegraph.pl`, speedscope and
+most flamegraph viewers read as is.
+"""
+import collections
+import sys
+import threading
+import time
+from typing import Counter, Optional
+
+__all__ = ['Sampler']
+
+
+class Sampler(threading.Thread):
+    """samples the stack of one thread until stopped
+
+    :param thread_id: `threading.get_ident()` of the profiled thread
+    :param interval: seconds between two samples
+    """
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        super().__init__(name='sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.stacks: Counter[str] = collections.Counter()
+        self._stopped = threading.Event()
+
+    @staticmethod
+    def _label(frame) -> str:
+        module = frame.f_globals.get('__name__', '?')
+        return f'{module}:{frame.f_code.co_name}'
+
+    def _sample(self):
+        # pylint: disable=protected-access
+        frame = sys._current_frames().get(self.thread_id)
+        labels = []
+        while frame is not None:
+            labels.append(self._label(frame))
+            frame = frame.f_back
+        if labels:
+            self.stacks[';'.join(reversed(labels))] += 1
+            self.samples += 1
+
+    def run(self):
+        deadline = time.perf_counter()
+        while not self._stopped.is_set():
+            self._sample()
+            deadline += self.interval
+            self._stopped.wait(max(deadline - time.perf_counter(), 0))
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stopped.set()
+        self.join(timeout)
+
+    def folded(self) -> str:
+        """samples as folded stacks, most frequent first"""
+        return ''.join(f'{stack} {count}\n'
+                       for stack, count in self.stacks.most_common())
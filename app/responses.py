@@ -0,0 +1,84 @@
+"""JSON of database rows, straight to bytes
+
+an endpoint returning a `Response` skips FastAPI's validation of its
+result against the `response_model`, and the `jsonable_encoder` walk
+after it, which for a page of rows costs more than the query. Rows read
+by the `Dao` already have the types of their columns, so `RowsResponse`
+serializes them with orjson as they are; the `response_model` of the
+endpoint is left to document the shape.
+
+read endpoints also send an `ETag` made of the versions of the tables they
+read, and answer a matching `If-None-Match` with 304 before querying.
+"""
+import time
+from decimal import Decimal
+from typing import Any, Dict, Mapping
+
+import orjson
+from sqlalchemy import Table
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app import cfg
+from app.models.cache import cache
+from app.models.replica import replicas
+
+__all__ = ['RowsResponse', 'dumps', 'not_modified', 'validators']
+
+
+def _default(value: Any) -> Any:
+    """types orjson leaves to the caller, called again on what it returns"""
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(content: Any) -> bytes:
+    """JSON of rows, or of lists and dicts holding them"""
+    return orjson.dumps(content, default=_default)
+
+
+class RowsResponse(Response):
+    media_type = 'application/json'
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def validators(*tables: Table, immutable: bool = False) -> Dict[str, str]:
+    """caching headers of a response read from some tables
+
+    the versions must be read before the query, so that a write while it
+    runs makes the `ETag` stale rather than the body. Within
+    `SA_REPLICA_MAX_LAG` of a write a replica may still answer with the
+    rows before it, no `ETag` is sent then.
+
+    :param tables: tables the response is read from
+    :param immutable: the response never changes, e.g. sales of a past
+        date, and may be kept by clients for `HTTP_IMMUTABLE_MAX_AGE`
+    """
+    versions = [cache.version(table.name) for table in tables]
+    if replicas.databases and (time.time_ns() - max(versions) <
+                               cfg.SA_REPLICA_MAX_LAG * 1e9):
+        return {'Cache-Control': 'no-cache'}
+    if immutable:
+        control = f'public, max-age={cfg.HTTP_IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        control = f'public, max-age={cfg.HTTP_MAX_AGE}'
+    return {
+        'ETag': '"{}"'.format('-'.join(f'{v:x}' for v in versions)),
+        'Cache-Control': control,
+    }
+
+
+def not_modified(request: Request, headers: Dict[str, str]) -> bool:
+    """whether the client holds the current version already"""
+    etag = headers.get('ETag')
+    match = request.headers.get('if-none-match')
+    if etag is None or match is None:
+        return False
+    # weak comparison, as for GET
+    tags = {tag.strip().replace('W/', '', 1) for tag in match.split(',')}
+    return etag in tags or '*' in tags
@@ -1,28 +1,111 @@
-from typing import List
+import json
+from typing import List, Optional
 
-from fastapi import APIRouter
+import pydantic
+from fastapi import APIRouter, Query, Request, Response
 
+from app import cfg
 from app.models.dao import Dao
-from app.schema.category import CategoryResponse, NewCategoryRequest
-from app.schema.common_response import PkidResponse
+from app.models.tables import categories
+from app.responses import RowsResponse, not_modified, validators
+from app.schema.api_exception import ApiException, ErrorCategory
+from app.schema.category import (CategoryPage, CategoryResponse,
+                                 NewCategoryRequest)
+from app.schema.common_response import (BatchError, BatchPkidResponse,
+                                        PkidResponse)
 
 _dao = Dao()
 router = APIRouter()
 
 
-@router.get('', response_model=List[CategoryResponse])
-async def all_cate(limit: int, offset: int):
-    res = _dao.all_category(limit, offset)
+def _parse_batch(body: bytes, ndjson: bool) -> List[NewCategoryRequest]:
+    """parse a batch body, validation errors are returned in place of the
+    records so that they can be reported per row"""
+    if ndjson:
+        items = [ln for ln in body.splitlines() if ln.strip()]
+        parse = NewCategoryRequest.parse_raw
+    else:
+        try:
+            items = json.loads(body)
+        except ValueError as err:
+            raise ApiException(400, ErrorCategory.REQUEST_INVALID,
+                               f'malformed body: {err}') from err
+        if not isinstance(items, list):
+            raise ApiException(400, ErrorCategory.REQUEST_INVALID,
+                               'body must be a JSON array')
+        parse = NewCategoryRequest.parse_obj
+    if len(items) > cfg.BATCH_MAX_SIZE:
+        raise ApiException(400, ErrorCategory.REQUEST_INVALID,
+                           f'at most {cfg.BATCH_MAX_SIZE} records per batch')
+    res = []
+    for item in items:
+        try:
+            res.append(parse(item))
+        except pydantic.ValidationError as err:
+            res.append(err)
     return res
 
 
+@router.get('', response_model=List[CategoryResponse])
+async def all_cate(request: Request, limit: int, offset: int):
+    headers = validators(categories)
+    if not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    res = await _dao.all_category(limit, offset)
+    return RowsResponse(res, headers=headers)
+
+
+@router.get('/page', response_model=CategoryPage)
+async def page_cate(
+    request: Request,
+    limit: int = Query(..., gt=0),
+    cursor: Optional[str] = None,
+):
+    headers = validators(categories)
+    if not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    items, nxt = await _dao.page_category(limit, cursor)
+    return RowsResponse({'items': items, 'next': nxt}, headers=headers)
+
+
 @router.post('', response_model=PkidResponse)
 async def new_cate(req: NewCategoryRequest):
-    pkid = _dao.add_category(req.catgroup, req.catname, req.catdesc)
+    pkid = await _dao.add_category(req.catgroup, req.catname, req.catdesc)
     return PkidResponse(pkid=pkid)
 
 
+@router.post('/batch', response_model=BatchPkidResponse)
+async def new_cates(request: Request):
+    """insert a JSON array, or an NDJSON stream with content type
+    `application/x-ndjson`, of `NewCategoryRequest` in one transaction"""
+    ndjson = request.headers.get('content-type',
+                                 '').startswith('application/x-ndjson')
+    parsed = _parse_batch(await request.body(), ndjson)
+    errors = {
+        i: str(req)
+        for i, req in enumerate(parsed) if isinstance(req, Exception)
+    }
+    valid = [i for i in range(len(parsed)) if i not in errors]
+    ids, db_errors = await _dao.add_categories(
+        [parsed[i].dict() for i in valid])
+    pkids = [None] * len(parsed)
+    for i, pkid in zip(valid, ids):
+        pkids[i] = pkid
+    errors.update((valid[j], msg) for j, msg in db_errors.items())
+    return BatchPkidResponse(
+        pkids=pkids,
+        errors=[
+            BatchError(index=i, message=msg)
+            for i, msg in sorted(errors.items())
+        ],
+    )
+
+
 @router.get('/{pkid}', response_model=CategoryResponse)
-async def lookup_cate(pkid: int):
-    cate = _dao.lookup_category_id(pkid)
+async def lookup_cate(request: Request, response: Response, pkid: int):
+    headers = validators(categories)
+    if not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    cate = await _dao.lookup_category_id(pkid)
+    response.headers.update(headers)
     return cate
@@ -1,13 +1,28 @@
+import asyncio
+import os
+import threading
 from functools import wraps
+from typing import Optional
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 
+from app import cfg
+from app.models.cache import cache
 from app.models.dao import Dao
 from app.models.db import DB
-from app.schema.common_response import MsgResponse, NumResponse
+from app.models.session import pool_stats
+from app.profiler import Sampler
+from app.schema.api_exception import ApiException, ErrorCategory
+from app.schema.common_response import (CacheStatsResponse, LoadResponse,
+                                        MsgResponse, NumResponse,
+                                        PoolStatsResponse)
+from app.schema.count import CountMode
 
 _db = DB()
 _dao = Dao()
+_sampler: Optional[Sampler] = None
 router = APIRouter()
 
 
@@ -28,24 +43,38 @@ def try_catch(fn):
 @try_catch
 @router.post('/init', response_model=MsgResponse)
 async def init_db():
-    _db.drop_all()
-    _db.create_all()
+    # DDL stays on the sync engine, keep it off the event loop
+    await run_in_threadpool(_db.drop_all)
+    await run_in_threadpool(_db.create_all)
+    cache.clear()
     return MsgResponse(message='success')
 
 
 @try_catch
-@router.post('/load', response_model=MsgResponse)
+@router.post('/load', response_model=LoadResponse)
 async def load_txt():
-    _dao.load_sample()
+    stats = await _dao.load_sample()
+    return LoadResponse(message='success',
+                        tables=[stat._asdict() for stat in stats])
+
+
+@router.post('/rollup', response_model=MsgResponse)
+async def rebuild_rollup():
+    await _dao.rebuild_daily_sales()
     return MsgResponse(message='success')
 
 
 @router.get('/count/{table}', response_model=NumResponse)
-async def record_count(table: str):
+async def record_count(table: str, mode: CountMode = CountMode.EXACT):
     dc_func = {
         'user': _dao.count_users,
+        'venue': _dao.count_venues,
+        'category': _dao.count_categories,
+        'date': _dao.count_dates,
+        'event': _dao.count_events,
         'listing': _dao.count_listings,
-        'category': _dao.count_categories
+        'sale': _dao.count_sales,
+        'daily_sale': _dao.count_daily_sales,
     }
     try:
         func = dc_func[table]
@@ -54,4 +83,38 @@ async def record_count(table: str):
             status_code=400,
             detail=f'can only count {dc_func.keys()}',
         ) from e
-    return NumResponse(result=func())
+    return NumResponse(result=await func(mode == CountMode.ESTIMATE))
+
+
+@router.get('/cache', response_model=CacheStatsResponse)
+async def cache_stats():
+    return CacheStatsResponse(**cache.stats())
+
+
+@router.get('/pool', response_model=PoolStatsResponse)
+async def connection_pool_stats():
+    return PoolStatsResponse(**pool_stats())
+
+
+@router.get('/profile', response_class=PlainTextResponse)
+async def profile(
+        seconds: int = Query(10, ge=1, le=cfg.PROFILER_MAX_SECONDS),
+        interval_ms: float = Query(5, ge=1, le=1000),
+):
+    global _sampler  # pylint: disable=global-statement
+    if not cfg.PROFILER_ENABLED:
+        raise ApiException(404, ErrorCategory.NOT_FOUND,
+                           'the profiler is off, see PROFILER_ENABLED')
+    if _sampler is not None:
+        raise ApiException(409, ErrorCategory.REQUEST_INVALID,
+                           'this worker is being profiled already')
+    # the event loop runs in this thread
+    _sampler = Sampler(threading.get_ident(), interval_ms / 1000)
+    _sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        sampler, _sampler = _sampler, None
+        sampler.stop()
+    return PlainTextResponse(sampler.folded(),
+                             headers={'X-Worker-Pid': str(os.getpid())})
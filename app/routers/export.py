@@ -0,0 +1,76 @@
+import csv
+import io
+from typing import AsyncIterator, List, Mapping, Sequence
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from app import cfg
+from app.models.dao import Dao
+from app.models.tables import (categories, dates, events, listings, sales,
+                               users, venues)
+from app.responses import dumps
+from app.schema.export import ExportFormat
+
+_dao = Dao()
+router = APIRouter()
+
+_TABLES = {
+    'user': (users, _dao.stream_users),
+    'venue': (venues, _dao.stream_venues),
+    'category': (categories, _dao.stream_categories),
+    'date': (dates, _dao.stream_dates),
+    'event': (events, _dao.stream_events),
+    'listing': (listings, _dao.stream_listings),
+    'sale': (sales, _dao.stream_sales),
+}
+
+
+async def _ndjson(batches: AsyncIterator[List[Mapping]],
+                  _: Sequence[str]) -> AsyncIterator[bytes]:
+    async for rows in batches:
+        yield b''.join(dumps(dict(row.items())) + b'\n' for row in rows)
+
+
+async def _csv(batches: AsyncIterator[List[Mapping]],
+               columns: Sequence[str]) -> AsyncIterator[str]:
+    """header row of `columns`, even of an empty table, then the rows"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    yield buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    async for rows in batches:
+        writer.writerows(row.values() for row in rows)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+
+_ENCODERS = {
+    ExportFormat.NDJSON: ('application/x-ndjson', _ndjson),
+    ExportFormat.CSV: ('text/csv', _csv),
+}
+
+
+@router.get('/{table}')
+async def export_table(
+    table: str,
+    fmt: ExportFormat = Query(ExportFormat.NDJSON, alias='format'),
+):
+    try:
+        tbl, func = _TABLES[table]
+    except KeyError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f'can only export {list(_TABLES.keys())}',
+        ) from e
+    media_type, encode = _ENCODERS[fmt]
+    return StreamingResponse(
+        encode(func(cfg.EXPORT_BATCH_SIZE), [col.name for col in tbl.c]),
+        media_type=media_type,
+        headers={
+            'Content-Disposition': f'attachment; filename={table}.{fmt.value}'
+        },
+    )
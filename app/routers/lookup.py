@@ -0,0 +1,85 @@
+from typing import (Awaitable, Callable, Dict, List, Mapping, Sequence, Tuple,
+                    Union)
+
+from fastapi import APIRouter, Body, HTTPException, Request, Response
+from sqlalchemy import Table
+
+from app import cfg
+from app.models.dao import Dao, Lookup
+from app.models.tables import categories, events, users, venues
+from app.responses import RowsResponse, not_modified, validators
+from app.schema.api_exception import ApiException, ErrorCategory
+from app.schema.lookup import LookupRequest, LookupResponse
+
+_dao = Dao()
+router = APIRouter()
+
+_TABLES = {
+    'user': (users, _dao.lookup_users),
+    'venue': (venues, _dao.lookup_venues),
+    'category': (categories, _dao.lookup_categories),
+    'event': (events, _dao.lookup_events),
+}
+
+
+def _table(name: str) -> Tuple[Table, Callable[..., Awaitable[Lookup]]]:
+    try:
+        return _TABLES[name]
+    except KeyError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f'can only look up {list(_TABLES.keys())}',
+        ) from e
+
+
+# keys are Postgres integers
+_MAX_ID = 2**31 - 1
+
+
+def _ids(ids: Sequence[int]) -> Tuple[int, ...]:
+    """distinct ids in the order given"""
+    res = tuple(dict.fromkeys(ids))
+    out = [i for i in res if not 1 <= i <= _MAX_ID]
+    if out:
+        raise ApiException(400, ErrorCategory.REQUEST_INVALID,
+                           f'ids must be between 1 and {_MAX_ID}: {out}')
+    if len(res) > cfg.LOOKUP_MAX_IDS:
+        raise ApiException(400, ErrorCategory.REQUEST_INVALID,
+                           f'at most {cfg.LOOKUP_MAX_IDS} ids per lookup')
+    return res
+
+
+def _body(found: Dict[int, Mapping], missing: List[int]) -> dict:
+    return {
+        'items': {str(pkid): row
+                  for pkid, row in found.items()},
+        'missing': missing,
+    }
+
+
+@router.get('/{table}', response_model=LookupResponse)
+async def lookup_ids(request: Request, table: str, ids: str):
+    """records of comma-separated `ids`, e.g. `?ids=1,2,3`, in one query"""
+    tbl, lookup = _table(table)
+    try:
+        parsed = _ids([int(i) for i in ids.split(',') if i.strip()])
+    except ValueError as err:
+        raise ApiException(400, ErrorCategory.REQUEST_INVALID,
+                           f'ids must be comma-separated integers: {err}'
+                           ) from err
+    headers = validators(tbl)
+    if not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    found, missing = await lookup(parsed)
+    return RowsResponse(_body(found, missing), headers=headers)
+
+
+@router.post('/{table}', response_model=LookupResponse)
+async def lookup_ids_body(table: str,
+                          body: Union[List[int], LookupRequest] = Body(...)):
+    """records of ids too many for a URL, a JSON array of them or an object
+    such as `{"ids": [1, 2, 3]}`"""
+    _, lookup = _table(table)
+    ids = body.ids if isinstance(body, LookupRequest) else body
+    found, missing = await lookup(_ids(ids))
+    return RowsResponse(_body(found, missing))
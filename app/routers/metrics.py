@@ -0,0 +1,14 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from app.metrics import CONTENT_TYPE_LATEST, exposition
+
+router = APIRouter()
+
+
+@router.get('/metrics', include_in_schema=False)
+async def metrics():
+    # CONTENT_TYPE_LATEST carries its charset, which a media_type would get
+    # twice
+    return Response(exposition(),
+                    headers={'Content-Type': CONTENT_TYPE_LATEST})
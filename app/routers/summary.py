@@ -1,16 +1,20 @@
-from datetime import datetime
+from datetime import date, datetime
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 
+from app import cfg
 from app.models.dao import Dao
+from app.models.tables import daily_sales
+from app.responses import RowsResponse, not_modified, validators
 from app.schema.common_response import NumResponse
+from app.schema.summary import SalesGroupBy, SalesSeriesResponse
 
 _dao = Dao()
 router = APIRouter()
 
 
 @router.get('/sales', response_model=NumResponse)
-async def total_sales(date: str):
+async def total_sales(request: Request, response: Response, date: str):
     fmt = '%Y-%m-%d'
     try:
         dt = datetime.strptime(date, fmt)
@@ -21,5 +25,30 @@ async def total_sales(date: str):
             detail='parameter "date" accept only "yyyy-mm-dd" format',
         ) from err
     else:
-        sales = _dao.total_sales_amount(dt=dt_str)
+        # sales of a date the rollup is past do not change short of a
+        # reload; the others, e.g. a 0 before the first load, are only
+        # kept for HTTP_MAX_AGE and revalidated by their ETag
+        closed = (dt.date() < datetime.today().date()
+                  and await _dao.sales_closed(dt=dt_str))
+        headers = validators(daily_sales, immutable=closed)
+        if not_modified(request, headers):
+            return Response(status_code=304, headers=headers)
+        sales = await _dao.total_sales_amount(dt=dt_str)
+        response.headers.update(headers)
         return NumResponse(result=sales)
+
+
+@router.get('/sales/range', response_model=SalesSeriesResponse)
+async def sales_series(
+    start: date,
+    end: date,
+    group_by: SalesGroupBy = SalesGroupBy.DAY,
+):
+    if start > end:
+        raise HTTPException(
+            status_code=400,
+            detail='parameter "start" must not be after "end"',
+        )
+    res = await _dao.sales_series(start, end, group_by.value,
+                                  cfg.SUMMARY_MAX_GROUPS)
+    return RowsResponse({'group_by': group_by.value, 'result': res})
@@ -5,6 +5,9 @@ class ErrorCategory(Enum):
     NOT_FOUND = 'record-not-found'
     DB = 'db-error'
     REQUEST_INVALID = 'invalid-request'
+    RATE_LIMITED = 'rate-limited'
+    OVERLOADED = 'overloaded'
+    TIMEOUT = 'timeout'
     OTHER = 'unexpected-error'
 
 
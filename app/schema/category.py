@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 
 import pydantic
 
@@ -12,5 +12,7 @@ class NewCategoryRequest(pydantic.BaseModel):
 class CategoryResponse(NewCategoryRequest):
     catid: int
 
-    class Config:
-        orm_mode = True
+
+class CategoryPage(pydantic.BaseModel):
+    items: List[CategoryResponse]
+    next: Optional[str]
@@ -1,3 +1,5 @@
+from typing import List, Optional
+
 import pydantic
 
 
@@ -11,3 +13,49 @@ class NumResponse(pydantic.BaseModel):
 
 class MsgResponse(pydantic.BaseModel):
     message: str
+
+
+class TableLoad(pydantic.BaseModel):
+    table: str
+    rows: int
+    seconds: float
+    rows_per_sec: float
+
+
+class LoadResponse(MsgResponse):
+    tables: List[TableLoad]
+
+
+class BatchError(pydantic.BaseModel):
+    index: int
+    message: str
+
+
+class BatchPkidResponse(pydantic.BaseModel):
+    pkids: List[Optional[int]]
+    errors: List[BatchError]
+
+
+class CacheStatsResponse(pydantic.BaseModel):
+    hits: int
+    misses: int
+    size: int
+
+
+class PoolStats(pydantic.BaseModel):
+    size: int
+    checked_out: int
+    overflow: int
+    max_size: int
+
+
+class AsyncPoolStats(PoolStats):
+    waiting: int
+    acquisitions: int
+    wait_seconds: float
+    max_wait_seconds: float
+
+
+class PoolStatsResponse(pydantic.BaseModel):
+    database: AsyncPoolStats
+    engine: PoolStats
@@ -0,0 +1,6 @@
+from enum import Enum
+
+
+class CountMode(str, Enum):
+    EXACT = 'exact'
+    ESTIMATE = 'estimate'
@@ -0,0 +1,13 @@
+from typing import Any, Dict, List
+
+import pydantic
+
+
+class LookupRequest(pydantic.BaseModel):
+    ids: List[int]
+
+
+class LookupResponse(pydantic.BaseModel):
+    # records by id, JSON object keys are strings
+    items: Dict[str, Dict[str, Any]]
+    missing: List[int]
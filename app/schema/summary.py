@@ -0,0 +1,27 @@
+from enum import Enum
+from typing import List, Optional
+
+import pydantic
+
+
+class SalesGroupBy(str, Enum):
+    DAY = 'day'
+    WEEK = 'week'
+    MONTH = 'month'
+    QTR = 'qtr'
+    CATEGORY = 'category'
+    VENUE = 'venue'
+    EVENT = 'event'
+
+
+class SalesGroup(pydantic.BaseModel):
+    key: str
+    name: Optional[str]
+    qtysold: int
+    revenue: float
+    commission: float
+
+
+class SalesSeriesResponse(pydantic.BaseModel):
+    group_by: SalesGroupBy
+    result: List[SalesGroup]
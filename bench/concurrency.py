@@ -0,0 +1,62 @@
+"""requests/sec of one worker at increasing client concurrency
+
+with a blocking DB driver the throughput stays flat whatever the
+concurrency, since queries are serialized on the event loop; with the
+async pool it should grow until Postgres (or the pool) saturates.
+
+    python run.py --port=8000 &
+    python -m bench.concurrency --url \\
+        'http://localhost:8000/api/v1/summary/sales?date=2008-01-05'
+"""
+import argparse
+import asyncio
+import time
+from typing import List, Tuple
+
+import aiohttp
+
+parser = argparse.ArgumentParser(description='Concurrency Benchmark')
+parser.add_argument('--url', required=True)
+parser.add_argument('--requests', type=int, default=200)
+parser.add_argument('--levels', default='1,2,4,8,16,32')
+
+
+async def _worker(session: aiohttp.ClientSession, url: str, n: int,
+                  latencies: List[float]):
+    for _ in range(n):
+        start = time.perf_counter()
+        async with session.get(url) as resp:
+            await resp.read()
+            resp.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_level(url: str, concurrency: int,
+                    total: int) -> Tuple[float, float]:
+    """fire `total` requests from `concurrency` clients
+
+    :return: requests per second, mean latency in milliseconds
+    """
+    latencies = []
+    per_worker = max(total // concurrency, 1)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(_worker(session, url, per_worker, latencies)
+                               for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, 1000 * sum(latencies) / len(latencies)
+
+
+async def main(url: str, levels: List[int], total: int):
+    print(f'{"concurrency":>12}{"req/s":>12}{"mean ms":>12}')
+    for level in levels:
+        rps, mean = await run_level(url, level, total)
+        print(f'{level:>12}{rps:>12.1f}{mean:>12.2f}')
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    asyncio.run(
+        main(args.url, [int(i) for i in args.levels.split(',')],
+             args.requests))
@@ -0,0 +1,296 @@
+"""latency percentiles and throughput of every route, against a baseline
+
+starts the app on a local port (or drives the one at `--url`), seeds the
+configured database with the sample data if it is empty and `--seed` is
+given, then fires `--requests` requests at each route from
+`--concurrency` clients. p50/p95/p99 latency, requests per second and
+errors of each route are written to `--out` as JSON. The run fails if a
+route's p95 grew or its throughput fell by more than `--threshold` of
+those in `--baseline`, the committed bench/baseline.json unless given.
+
+    python -m bench.load --seed --writes
+    python -m bench.load --writes --baseline '' --out bench/baseline.json
+
+a baseline only compares with runs on the same machine and data, record
+one of your own before changing the code.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+from urllib.parse import quote
+
+import aiohttp
+
+from app import cfg
+
+parser = argparse.ArgumentParser(description='Load Test')
+parser.add_argument('--url', help='app to drive, started on --port if unset')
+parser.add_argument('--port', type=int, default=8765)
+parser.add_argument('--concurrency', type=int, default=16)
+parser.add_argument('--requests', type=int, default=1000)
+parser.add_argument('--warmup', type=int, default=20)
+parser.add_argument('--routes', help='comma-separated names, all if unset')
+parser.add_argument('--writes',
+                    action='store_true',
+                    help='add POST routes, which insert categories "load<n>"')
+parser.add_argument('--seed', action='store_true')
+parser.add_argument('--out', default='bench/load.json')
+parser.add_argument('--baseline',
+                    default='bench/baseline.json',
+                    help='results to compare with, none if empty')
+parser.add_argument('--threshold', type=float, default=0.2)
+
+_API = cfg.REST_URL_PREFIX
+_GROUPINGS = ('day', 'week', 'month', 'category')
+_TABLES = ('user', 'venue', 'category', 'event', 'listing', 'sale')
+_FORMATS = ('ndjson', 'csv')
+
+
+class Route(NamedTuple):
+    name: str
+    method: str
+    # path and JSON body of the i-th request
+    path: Callable[[int], str]
+    body: Optional[Callable[[int], Any]] = None
+    write: bool = False
+    # pages the i-th request walks, following the `next` cursor
+    pages: int = 1
+    # fewer requests than `--requests` for the slow routes
+    max_requests: Optional[int] = None
+
+
+def _category(i: int) -> dict:
+    return {
+        'catgroup': 'load',
+        'catname': f'load{i}',
+        'catdesc': 'bench.load',
+    }
+
+
+def _export(table: str, max_requests: Optional[int] = None) -> Route:
+    return Route(f'export_{table}',
+                 'GET',
+                 lambda i: f'{_API}/export/{table}'
+                 f'?format={_FORMATS[i % len(_FORMATS)]}',
+                 max_requests=max_requests)
+
+
+ROUTES = [
+    Route('category_list', 'GET',
+          lambda i: f'{_API}/category?limit=100&offset={i % 10}'),
+    Route('category_page',
+          'GET',
+          lambda i: f'{_API}/category/page?limit=3',
+          pages=4),
+    Route('category_lookup', 'GET', lambda i: f'{_API}/category/{i % 11 + 1}'),
+    Route('lookup_batch', 'GET',
+          lambda i: f'{_API}/lookup/user?ids=' + ','.join(
+              str((i * 20 + k) % 49990 + 1) for k in range(20))),
+    Route('lookup_post', 'POST',
+          lambda i: f'{_API}/lookup/{_TABLES[i % 4]}',
+          lambda i: [(i * 200 + k) % 49990 + 1 for k in range(200)]),
+    Route('summary_sales', 'GET',
+          lambda i: f'{_API}/summary/sales?date=2008-01-{i % 28 + 1:02d}'),
+    Route('summary_sales_range', 'GET',
+          lambda i: f'{_API}/summary/sales/range?start=2008-01-01'
+          f'&end=2008-03-31&group_by={_GROUPINGS[i % len(_GROUPINGS)]}'),
+    Route('count', 'GET',
+          lambda i: f'{_API}/config/count/{_TABLES[i % len(_TABLES)]}'),
+    Route('count_estimate', 'GET',
+          lambda i: f'{_API}/config/count/sale?mode=estimate'),
+    Route('cache_stats', 'GET', lambda i: f'{_API}/config/cache'),
+    Route('pool_stats', 'GET', lambda i: f'{_API}/config/pool'),
+    Route('export', 'GET', lambda i: f'{_API}/export/category'),
+    _export('venue'),
+    _export('event', max_requests=200),
+    _export('user', max_requests=20),
+    _export('sale', max_requests=4),
+    Route('metrics', 'GET', lambda i: '/metrics'),
+    # last, the categories they insert would slow down the reads above
+    Route('category_new',
+          'POST',
+          lambda i: f'{_API}/category',
+          _category,
+          write=True),
+    Route('category_batch',
+          'POST',
+          lambda i: f'{_API}/category/batch',
+          lambda i: [_category(i * 50 + k) for k in range(50)],
+          write=True),
+]
+
+
+def _percentile(ordered: List[float], pct: float) -> float:
+    """nearest-rank percentile of sorted values"""
+    return ordered[max(math.ceil(pct / 100 * len(ordered)) - 1, 0)]
+
+
+async def _request(session: aiohttp.ClientSession, url: str, route: Route,
+                   i: int) -> bool:
+    body = route.body(i) if route.body else None
+    path = route.path(i)
+    for _ in range(route.pages):
+        async with session.request(route.method, url + path,
+                                   json=body) as resp:
+            data = await resp.read()
+            if resp.status >= 400:
+                return False
+        cursor = json.loads(data)['next'] if route.pages > 1 else None
+        if cursor is None:
+            break
+        path = f'{route.path(i)}&cursor={quote(cursor)}'
+    return True
+
+
+async def run_route(url: str, route: Route, concurrency: int, total: int,
+                    warmup: int) -> Dict[str, float]:
+    """fire `total` requests at a route from `concurrency` clients
+
+    :return: requests per second, latency percentiles in milliseconds and
+        the number of failed requests
+    """
+    counter = itertools.count()
+    latencies = []
+    errors = 0
+
+    async def client(session: aiohttp.ClientSession):
+        nonlocal errors
+        while True:
+            i = next(counter)
+            if i >= total:
+                return
+            start = time.perf_counter()
+            try:
+                ok = await _request(session, url, route, i)
+            except aiohttp.ClientError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        for i in range(warmup):
+            await _request(session, url, route, total + i)
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    ordered = sorted(1000 * s for s in latencies)
+    return {
+        'rps': round(len(ordered) / elapsed, 1),
+        'p50_ms': round(_percentile(ordered, 50), 3),
+        'p95_ms': round(_percentile(ordered, 95), 3),
+        'p99_ms': round(_percentile(ordered, 99), 3),
+        'errors': errors,
+    }
+
+
+async def seed(url: str):
+    """load the sample data unless the sales table has rows already"""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f'{url}{_API}/config/count/sale') as resp:
+            if resp.status == 200 and (await resp.json())['result'] > 0:
+                return
+        for step in ('init', 'load'):
+            async with session.post(f'{url}{_API}/config/{step}') as resp:
+                resp.raise_for_status()
+
+
+def start_app(port: int) -> subprocess.Popen:
+    proc = subprocess.Popen([sys.executable, 'run.py', f'--port={port}'],
+                            stdout=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}/metrics'
+
+    async def ready():
+        async with aiohttp.ClientSession() as session:
+            for _ in range(100):
+                if proc.poll() is not None:
+                    raise RuntimeError('app exited')
+                try:
+                    async with session.get(url) as resp:
+                        if resp.status == 200:
+                            return
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.1)
+            raise RuntimeError('app did not start')
+
+    try:
+        asyncio.run(ready())
+    except BaseException:
+        proc.terminate()
+        raise
+    return proc
+
+
+def regressions(results: Dict[str, Dict], baseline: Dict[str, Dict],
+                threshold: float) -> List[str]:
+    """routes slower than in the baseline by more than `threshold`"""
+    res = []
+    for name, now in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if now['p95_ms'] > base['p95_ms'] * (1 + threshold):
+            res.append(f'{name}: p95 {base["p95_ms"]:.2f} -> '
+                       f'{now["p95_ms"]:.2f} ms')
+        if now['rps'] < base['rps'] * (1 - threshold):
+            res.append(f'{name}: {base["rps"]:.0f} -> {now["rps"]:.0f} req/s')
+    return res
+
+
+def main(args) -> int:
+    routes = [r for r in ROUTES if args.writes or not r.write]
+    if args.routes:
+        names = args.routes.split(',')
+        routes = [r for r in routes if r.name in names]
+    proc = None if args.url else start_app(args.port)
+    url = args.url or f'http://127.0.0.1:{args.port}'
+    try:
+        if args.seed:
+            asyncio.run(seed(url))
+        results = {}
+        print(f'{"route":<20}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}'
+              f'{"p99 ms":>10}{"errors":>8}')
+        for route in routes:
+            total = min(args.requests, route.max_requests or args.requests)
+            stat = asyncio.run(
+                run_route(url, route, args.concurrency, total, args.warmup))
+            results[route.name] = stat
+            print(f'{route.name:<20}{stat["rps"]:>10.1f}'
+                  f'{stat["p50_ms"]:>10.2f}{stat["p95_ms"]:>10.2f}'
+                  f'{stat["p99_ms"]:>10.2f}{stat["errors"]:>8}')
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    with open(args.out, 'w') as f:
+        json.dump(
+            {
+                'concurrency': args.concurrency,
+                'requests': args.requests,
+                'python': platform.python_version(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'routes': results,
+            },
+            f,
+            indent=2)
+    failed = [f'{name}: {stat["errors"]} errors'
+              for name, stat in results.items() if stat['errors']]
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['routes']
+        failed += regressions(results, baseline, args.threshold)
+    for msg in failed:
+        print(f'FAIL {msg}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,108 @@
+"""per-call overhead of building and compiling the Dao hot queries on
+every call, against statements compiled once
+
+the compile figures are CPU only, with `--db` each variant also runs its
+query on the configured database, which must hold the sample data.
+
+    python -m bench.prepared --calls 20000
+    python -m bench.prepared --calls 2000 --db
+"""
+import argparse
+import asyncio
+import time
+from datetime import date
+from typing import Callable
+
+from sqlalchemy.dialects.postgresql import pypostgresql
+from sqlalchemy.sql import bindparam, select
+
+from app.models.prepared import Prepared
+from app.models.session import database
+from app.models.tables import categories, daily_sales
+
+parser = argparse.ArgumentParser(description='Prepared Statement Benchmark')
+parser.add_argument('--calls', type=int, default=20000)
+parser.add_argument('--db', action='store_true')
+
+_dialect = pypostgresql.dialect(paramstyle='pyformat')
+
+
+def _lookup(key: int):
+    return select([categories]).where(categories.c.catid == key)
+
+
+def _total(dt: date):
+    return select([daily_sales.c.qtysold]).where(daily_sales.c.caldate == dt)
+
+
+_prepared = {
+    'lookup': (
+        Prepared(_lookup(bindparam('key'))),
+        'fetch_one',
+        lambda i: {'key': i % 10 + 1},
+    ),
+    'total': (
+        Prepared(_total(bindparam('dt'))),
+        'fetch_val',
+        lambda i: {'dt': date(2008, 1, i % 28 + 1)},
+    ),
+}
+_built = {
+    'lookup': (lambda i: _lookup(i % 10 + 1), 'fetch_one'),
+    'total': (lambda i: _total(date(2008, 1, i % 28 + 1)), 'fetch_val'),
+}
+
+
+def _per_call(fn: Callable[[int], object], calls: int) -> float:
+    """mean microseconds per call"""
+    start = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    return 1e6 * (time.perf_counter() - start) / calls
+
+
+async def _per_query(run, calls: int) -> float:
+    await run(0)  # warm up, prepares the statement on the connection
+    start = time.perf_counter()
+    for i in range(calls):
+        await run(i)
+    return 1e6 * (time.perf_counter() - start) / calls
+
+
+async def _db(calls: int):
+    await database.connect()
+    try:
+        async with database.connection() as conn:
+            for name, (prepared, method, values) in _prepared.items():
+                build, _ = _built[name]
+
+                async def built(i):
+                    return await getattr(conn, method)(build(i))
+
+                async def compiled(i):
+                    return await prepared.run(conn.raw_connection, method,
+                                              values(i))
+
+                before = await _per_query(built, calls)
+                after = await _per_query(compiled, calls)
+                print(f'{name:>8} query   built {before:8.1f}  '
+                      f'prepared {after:8.1f}')
+    finally:
+        await database.disconnect()
+
+
+def main(calls: int, db: bool):
+    print('microseconds per call')
+    for name, (prepared, _, values) in _prepared.items():
+        build, _ = _built[name]
+        before = _per_call(lambda i: build(i).compile(dialect=_dialect),
+                           calls)
+        after = _per_call(lambda i: prepared.args(values(i)), calls)
+        print(f'{name:>8} compile built {before:8.1f}  prepared {after:8.1f}')
+    if db:
+        asyncio.get_event_loop().run_until_complete(_db(calls))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args.calls, args.db)
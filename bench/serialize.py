@@ -0,0 +1,72 @@
+"""rows per second serialized into the body of `GET /api/v1/category`,
+validated by FastAPI against the `response_model` and encoded by
+`JSONResponse` as before, against `RowsResponse`
+
+the rows are read from `d_category` of the configured database and
+repeated up to `--rows`.
+
+    python -m bench.serialize --rows 10000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from typing import Callable, List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from sqlalchemy.sql import select
+
+from app.models.session import database
+from app.models.tables import categories
+from app.responses import RowsResponse
+from app.schema.category import CategoryResponse
+
+parser = argparse.ArgumentParser(description='Serialization Benchmark')
+parser.add_argument('--rows', type=int, default=10000)
+parser.add_argument('--rounds', type=int, default=5)
+
+_field = create_response_field('Response_all_cate', List[CategoryResponse])
+
+
+async def _rows(n: int) -> list:
+    await database.connect()
+    try:
+        rows = await database.fetch_all(select([categories]))
+    finally:
+        await database.disconnect()
+    return list(itertools.islice(itertools.cycle(rows), n))
+
+
+async def _validated(rows: list) -> bytes:
+    content = await serialize_response(field=_field, response_content=rows)
+    return JSONResponse(content).body
+
+
+async def _fast(rows: list) -> bytes:
+    return RowsResponse(rows).body
+
+
+async def _best(fn: Callable, rows: list, rounds: int) -> float:
+    """seconds of the fastest round"""
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await fn(rows)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+async def _main(n: int, rounds: int):
+    rows = await _rows(n)
+    assert json.loads(await _validated(rows)) == json.loads(await _fast(rows))
+    for name, fn in (('validated', _validated), ('rows', _fast)):
+        seconds = await _best(fn, rows, rounds)
+        print(f'{name:>10} {len(rows) / seconds:12,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(_main(args.rows, args.rounds))
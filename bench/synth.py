@@ -0,0 +1,60 @@
+"""synthetic TICKIT data at a scale factor of the sample, for benchmarks
+at production volume
+
+with `--out` the data is written as sample files into a directory, which
+`POST /api/v1/config/load` reads with `DATA_PATH` pointed at it. Without,
+the tables of the configured database are dropped, created and filled
+directly, which is several times faster.
+
+    python -m bench.synth --scale 100 --out /data/tickit100
+    python -m bench.synth --scale 100 --jobs 8
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from app.models.dao import Dao
+from app.models.db import DB
+from app.models.session import database
+
+parser = argparse.ArgumentParser(description='Synthetic Data')
+parser.add_argument('--scale',
+                    type=float,
+                    default=1,
+                    help='rows as a multiple of the sample, 1000 for 172M '
+                    'sales')
+parser.add_argument('--out', help='directory of sample files to write')
+parser.add_argument('--jobs',
+                    type=int,
+                    default=4,
+                    help='connections each table is generated on')
+
+
+async def main(args):
+    await database.connect()
+    try:
+        if args.out:
+            os.makedirs(args.out, exist_ok=True)
+            stats = await Dao().generate_sample(os.path.abspath(args.out),
+                                                args.scale, args.jobs)
+        else:
+            stats = await Dao().load_synthetic(args.scale, args.jobs)
+    finally:
+        await database.disconnect()
+    return stats
+
+
+if __name__ == '__main__':
+    arguments = parser.parse_args()
+    if not arguments.out:
+        DB.drop_all()
+        DB.create_all()
+    start = time.perf_counter()
+    results = asyncio.run(main(arguments))
+    print(f'{"table":<14}{"rows":>14}{"seconds":>10}{"rows/s":>12}')
+    for stat in results:
+        print(f'{stat.table:<14}{stat.rows:>14}{stat.seconds:>10.2f}'
+              f'{stat.rows_per_sec:>12.0f}')
+    print(f'{"total":<14}{sum(s.rows for s in results):>14}'
+          f'{time.perf_counter() - start:>10.2f}')
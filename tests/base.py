@@ -0,0 +1,38 @@
+import asyncio
+import unittest
+
+from sqlalchemy.exc import OperationalError
+
+from app.models.session import engine
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """skipped unless the test database can be reached"""
+    @classmethod
+    def setUpClass(cls) -> None:
+        try:
+            engine.connect().close()
+        except OperationalError as err:
+            raise unittest.SkipTest(f'no test database: {err!r}')
+
+
+class AppTestCase(DatabaseTestCase):
+    """runs the app with `TestClient`, which serves it on the current event
+    loop, on a loop of its own for the class
+
+    subclasses may query the database and skip after calling
+    `super().setUpClass()`, the loop is closed anyway
+    """
+    loop = None
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cls.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(cls.loop)
+        cls.addClassCleanup(cls._close_loop)
+
+    @classmethod
+    def _close_loop(cls):
+        asyncio.set_event_loop(None)
+        cls.loop.close()
@@ -0,0 +1,165 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+from fastapi import FastAPI
+from prometheus_client import REGISTRY
+from starlette.testclient import TestClient
+
+from app import cfg
+from app.admission import AdmissionMiddleware, Limiter, TokenBuckets
+
+
+def shed(route: str, reason: str) -> float:
+    return REGISTRY.get_sample_value('http_requests_shed_total', {
+        'route': route,
+        'reason': reason
+    }) or 0
+
+
+class TestTokenBuckets(unittest.TestCase):
+    def test_take(self):
+        buckets = TokenBuckets(rate=2, burst=3, size=10)
+        with mock.patch('time.monotonic', return_value=100.0):
+            self.assertEqual([0, 0, 0], [buckets.take('a') for _ in range(3)])
+            self.assertAlmostEqual(0.5, buckets.take('a'))
+            # clients have their own buckets
+            self.assertEqual(0, buckets.take('b'))
+        with mock.patch('time.monotonic', return_value=100.5):
+            self.assertEqual(0, buckets.take('a'))
+            self.assertGreater(buckets.take('a'), 0)
+
+    def test_size(self):
+        buckets = TokenBuckets(rate=1, burst=1, size=2)
+        with mock.patch('time.monotonic', return_value=100.0):
+            for client in 'abc':
+                buckets.take(client)
+            # 'a' was forgotten and starts over
+            self.assertEqual(0, buckets.take('a'))
+            self.assertGreater(buckets.take('c'), 0)
+
+
+class TestLimiter(unittest.TestCase):
+    def test_fifo(self):
+        async def main():
+            limiter = Limiter(1)
+            order = []
+
+            async def request(name: str):
+                self.assertTrue(await limiter.acquire(1))
+                order.append(name)
+                await asyncio.sleep(0.01)
+                limiter.release(0.01)
+
+            await asyncio.gather(*(request(str(i)) for i in range(4)))
+            return order, limiter
+
+        order, limiter = asyncio.run(main())
+        self.assertEqual(['0', '1', '2', '3'], order)
+        self.assertEqual((0, 0), (limiter.active, limiter.waiting))
+        self.assertGreater(limiter.service_time, 0)
+
+    def test_timeout(self):
+        async def main():
+            limiter = Limiter(1)
+            await limiter.acquire(1)
+            admitted = await limiter.acquire(0.01)
+            state = limiter.active, limiter.waiting
+            limiter.release()
+            return admitted, state, limiter.active
+
+        self.assertEqual((False, (1, 0), 0), asyncio.run(main()))
+
+    def test_cancel(self):
+        async def main():
+            limiter = Limiter(1)
+            await limiter.acquire(1)
+            waiter = asyncio.ensure_future(limiter.acquire(1))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            # handed the slot before the cancellation is delivered
+            limiter.release()
+            await asyncio.gather(waiter, return_exceptions=True)
+            return limiter.active, limiter.waiting
+
+        self.assertEqual((0, 0), asyncio.run(main()))
+
+    def test_expected_wait(self):
+        limiter = Limiter(2)
+        limiter.service_time = 0.5
+        self.assertEqual(0, limiter.expected_wait())
+        limiter.active = 2
+        self.assertEqual(0.25, limiter.expected_wait())
+
+
+class TestAdmissionMiddleware(unittest.TestCase):
+    def client(self, **settings) -> TestClient:
+        for name, value in settings.items():
+            patcher = mock.patch.object(cfg, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        app = FastAPI()
+        app.add_middleware(AdmissionMiddleware)
+        self.release = threading.Event()
+
+        @app.get('/slow')
+        def slow():
+            self.release.wait(5)
+            return {}
+
+        @app.get('/items/{pkid}')
+        async def item(pkid: int):
+            return {'pkid': pkid}
+
+        return TestClient(app)
+
+    def test_rate_limit(self):
+        client = self.client(RATE_LIMIT_RPS=0.001,
+                             RATE_LIMIT_BURST=2,
+                             RATE_LIMIT_CLIENT_HEADER='x-real-ip')
+        before = shed('/items/{pkid}', 'rate_limit')
+        statuses = [
+            client.get('/items/1', headers={
+                'x-real-ip': '10.0.0.1'
+            }).status_code for _ in range(3)
+        ]
+        self.assertEqual([200, 200, 429], statuses)
+        resp = client.get('/items/2', headers={'x-real-ip': '10.0.0.1'})
+        self.assertEqual('rate-limited', resp.json()['category'])
+        self.assertGreater(int(resp.headers['retry-after']), 1)
+        self.assertEqual(
+            200,
+            client.get('/items/1', headers={
+                'x-real-ip': '10.0.0.2'
+            }).status_code)
+        self.assertEqual(before + 2, shed('/items/{pkid}', 'rate_limit'))
+        # unmatched routes are left to the router
+        self.assertEqual(404, client.get('/nowhere').status_code)
+
+    def test_overload(self):
+        client = self.client(RATE_LIMIT_RPS=0,
+                             ADMISSION_CONCURRENCY=1,
+                             ADMISSION_LIMITS={},
+                             ADMISSION_MAX_WAIT=0.2)
+        before = shed('/slow', 'queue_timeout')
+        first = threading.Thread(target=client.get, args=('/slow', ))
+        first.start()
+        time.sleep(0.1)
+        try:
+            resp = client.get('/slow')
+            # other routes have their own limits
+            self.assertEqual(200, client.get('/items/1').status_code)
+        finally:
+            self.release.set()
+            first.join()
+        self.assertEqual(503, resp.status_code)
+        self.assertEqual('overloaded', resp.json()['category'])
+        self.assertIn('retry-after', resp.headers)
+        self.assertEqual(before + 1, shed('/slow', 'queue_timeout'))
+        self.assertEqual(200, client.get('/slow').status_code)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
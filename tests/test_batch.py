@@ -0,0 +1,125 @@
+import json
+import unittest
+from unittest import mock
+
+from starlette.testclient import TestClient
+
+from app import cfg
+from app.main import app
+from app.models.session import engine
+from app.models.tables import categories
+from tests.base import AppTestCase
+
+URL = f'{cfg.REST_URL_PREFIX}/category/batch'
+
+
+def category(name: str) -> dict:
+    return {'catgroup': 'Batch', 'catname': name, 'catdesc': f'{name} desc'}
+
+
+class TestBatch(AppTestCase):
+    def setUp(self) -> None:
+        self.addCleanup(engine.execute,
+                        "DELETE FROM d_category WHERE catgroup = 'Batch'")
+
+    @staticmethod
+    def stored(pkids) -> list:
+        rows = engine.execute(categories.select().where(
+            categories.c.catid.in_(pkids)).order_by(categories.c.catid))
+        return [dict(row) for row in rows]
+
+    def check(self, resp, cates):
+        self.assertEqual(200, resp.status_code)
+        body = resp.json()
+        self.assertEqual([], body['errors'])
+        pkids = body['pkids']
+        self.assertEqual(len(cates), len(pkids))
+        self.assertEqual(pkids, sorted(pkids))
+        self.assertEqual([dict(cate, catid=pkid)
+                          for cate, pkid in zip(cates, pkids)],
+                         self.stored(pkids))
+
+    def test_json(self):
+        cates = [category(f'json{i}') for i in range(3)]
+        with TestClient(app) as client:
+            self.check(client.post(URL, json=cates), cates)
+
+    def test_ndjson(self):
+        cates = [category(f'ndjson{i}') for i in range(3)]
+        body = '\n'.join(json.dumps(cate) for cate in cates)
+        with TestClient(app) as client:
+            self.check(
+                client.post(URL,
+                            data=f'{body}\n\n',
+                            headers={'Content-Type': 'application/x-ndjson'}),
+                cates)
+
+    def test_invalid_rows(self):
+        """bad records are reported by index, the others inserted"""
+        cates = [
+            category('ok0'),
+            {'catgroup': ['not', 'a', 'string']},
+            category('ok2'),
+            category('much too long a name'),
+            category('ok4'),
+        ]
+        with TestClient(app) as client:
+            resp = client.post(URL, json=cates)
+        self.assertEqual(200, resp.status_code)
+        body = resp.json()
+        self.assertEqual([1, 3], [err['index'] for err in body['errors']])
+        self.assertIn('catgroup', body['errors'][0]['message'])
+        self.assertIn('"catname" is longer than 10',
+                      body['errors'][1]['message'])
+        pkids = body['pkids']
+        self.assertIsNone(pkids[1])
+        self.assertIsNone(pkids[3])
+        self.assertEqual(['ok0', 'ok2', 'ok4'], [
+            row['catname']
+            for row in self.stored([pkids[i] for i in (0, 2, 4)])
+        ])
+
+    def test_constraint_violation(self):
+        """a row the database rejects fails its chunk, which is retried row
+        by row in savepoints"""
+        cates = [category('sp0'), category('sp\u00001'), category('sp2')]
+        with TestClient(app) as client:
+            resp = client.post(URL, json=cates)
+        self.assertEqual(200, resp.status_code)
+        body = resp.json()
+        self.assertEqual([1], [err['index'] for err in body['errors']])
+        self.assertIn('CharacterNotInRepertoireError',
+                      body['errors'][0]['message'])
+        pkids = body['pkids']
+        self.assertIsNone(pkids[1])
+        self.assertEqual(['sp0', 'sp2'], [
+            row['catname'] for row in self.stored([pkids[0], pkids[2]])
+        ])
+
+    def test_too_many(self):
+        with TestClient(app) as client, \
+                mock.patch.object(cfg, 'BATCH_MAX_SIZE', 2):
+            resp = client.post(URL, json=[category(f'max{i}')
+                                          for i in range(3)])
+            self.assertEqual(400, resp.status_code)
+            self.assertIn('at most 2', resp.json()['message'])
+            body = '\n'.join(
+                json.dumps(category(f'max{i}')) for i in range(3))
+            resp = client.post(
+                URL,
+                data=body,
+                headers={'Content-Type': 'application/x-ndjson'})
+            self.assertEqual(400, resp.status_code)
+        self.assertEqual(
+            0,
+            engine.execute("SELECT count(*) FROM d_category "
+                           "WHERE catgroup = 'Batch'").scalar())
+
+    def test_malformed(self):
+        with TestClient(app) as client:
+            for data in ('[{"catname": ', '{"catname": "x"}'):
+                self.assertEqual(400, client.post(URL, data=data).status_code)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
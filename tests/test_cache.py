@@ -0,0 +1,259 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from prometheus_client import REGISTRY
+
+from app import cfg
+from app.models import cache as cache_module
+from app.models.cache import LocalCache, SharedCache, cached
+from app.models.tables import categories, users
+
+
+def errors(operation: str) -> float:
+    return REGISTRY.get_sample_value('cache_errors_total',
+                                     {'operation': operation}) or 0
+
+
+class TestLocalCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = LocalCache(max_size=2, ttl=60)
+        cache.set(((), 'a'), 1)
+        cache.set(((), 'b'), 2)
+        self.assertEqual((True, 1), cache.get(((), 'a')))
+        cache.set(((), 'c'), 3)
+        self.assertEqual((False, None), cache.get(((), 'b')))
+        self.assertEqual((True, 1), cache.get(((), 'a')))
+        self.assertEqual({'hits': 2, 'misses': 1, 'size': 2}, cache.stats())
+
+    def test_ttl(self):
+        cache = LocalCache(max_size=2, ttl=60)
+        cache.set(((), 'a'), 1)
+        with mock.patch.object(time, 'monotonic',
+                               return_value=time.monotonic() + 61):
+            self.assertEqual((False, None), cache.get(((), 'a')))
+        self.assertEqual(0, cache.stats()['size'])
+
+    def test_invalidate(self):
+        cache = LocalCache(max_size=4, ttl=60)
+        cache.set((('d_user', ), 'a'), 1)
+        cache.set((('d_category', 'd_user'), 'b'), 2)
+        cache.set((('d_venue', ), 'c'), 3)
+        cache.invalidate('d_user')
+        self.assertEqual(1, cache.stats()['size'])
+        self.assertTrue(cache.get((('d_venue', ), 'c'))[0])
+
+    def test_version(self):
+        cache = LocalCache(max_size=2, ttl=60)
+        version = cache.version('d_user')
+        self.assertEqual(version, cache.version('d_user'))
+        cache.invalidate('d_venue')
+        self.assertEqual(version, cache.version('d_user'))
+        cache.invalidate('d_user')
+        self.assertGreater(cache.version('d_user'), version)
+        version = cache.version('d_user')
+        # writes of other processes go unnoticed, only for a TTL
+        with mock.patch.object(time, 'monotonic',
+                               return_value=time.monotonic() + 61):
+            self.assertGreater(cache.version('d_user'), version)
+
+
+class TestSharedCache(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'cache.sqlite')
+
+    def test_across_workers(self):
+        worker_a = SharedCache(self.path, max_size=4, ttl=60)
+        worker_b = SharedCache(self.path, max_size=4, ttl=60)
+        worker_a.set((('d_user', ), 'a'), {'userid': 1})
+        worker_a.set((('d_venue', ), 'b'), 2)
+        self.assertEqual((True, {'userid': 1}),
+                         worker_b.get((('d_user', ), 'a')))
+        worker_b.invalidate('d_user')
+        self.assertEqual((False, None), worker_a.get((('d_user', ), 'a')))
+        self.assertEqual((True, 2), worker_a.get((('d_venue', ), 'b')))
+        worker_a.clear()
+        self.assertEqual(0, worker_b.stats()['size'])
+
+    def test_version_across_workers(self):
+        worker_a = SharedCache(self.path, max_size=4, ttl=60)
+        worker_b = SharedCache(self.path, max_size=4, ttl=60)
+        version = worker_a.version('d_user')
+        self.assertEqual(version, worker_b.version('d_user'))
+        worker_b.invalidate('d_user')
+        self.assertGreater(worker_a.version('d_user'), version)
+        version = worker_a.version('d_user')
+        worker_b.clear()
+        self.assertGreater(worker_a.version('d_user'), version)
+
+    def test_eviction(self):
+        cache = SharedCache(self.path, max_size=2, ttl=60)
+        for i in range(4):
+            cache.set(((), i), i)
+        self.assertEqual(2, cache.stats()['size'])
+        self.assertTrue(cache.get(((), 3))[0])
+        with mock.patch.object(time, 'time', return_value=time.time() + 61):
+            self.assertFalse(cache.get(((), 3))[0])
+
+    def test_sampled_eviction(self):
+        cache = SharedCache(self.path, max_size=32, ttl=60)
+        for i in range(33):
+            cache.set(((), i), i)
+        # evicted every second write only
+        self.assertEqual(33, cache.stats()['size'])
+        cache.set(((), 33), 33)
+        self.assertEqual(32, cache.stats()['size'])
+
+    def test_locked(self):
+        """another worker holding the write lock neither blocks nor fails
+        a write"""
+        cache = SharedCache(self.path, max_size=4, ttl=60)
+        cache.set(((), 'a'), 1)
+        other = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(other.close)
+        other.execute('BEGIN IMMEDIATE')
+        before = errors('set')
+        start = time.perf_counter()
+        cache.set(((), 'b'), 2)
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual(before + 1, errors('set'))
+        # readers go on in WAL mode
+        self.assertEqual((True, 1), cache.get(((), 'a')))
+        other.execute('ROLLBACK')
+        self.assertEqual((False, None), cache.get(((), 'b')))
+
+    def test_error_is_miss(self):
+        cache = SharedCache(self.path, max_size=4, ttl=60)
+        cache.set(((), 'a'), 1)
+        other = sqlite3.connect(self.path, isolation_level=None)
+        other.execute('DROP TABLE entry')
+        other.close()
+        before = errors('get')
+        self.assertEqual((False, None), cache.get(((), 'a')))
+        self.assertEqual(before + 1, errors('get'))
+
+    def test_errors_not_raised(self):
+        """a broken cache file must not fail a request, e.g. a write that
+        committed in Postgres already"""
+        cache = SharedCache(self.path, max_size=4, ttl=60)
+        cache.set((('d_user', ), 'a'), 1)
+        other = sqlite3.connect(self.path, isolation_level=None)
+        other.execute('DROP TABLE version')
+        other.execute('DROP TABLE entry')
+        other.close()
+        before = {
+            op: errors(op)
+            for op in ('version', 'invalidate', 'clear', 'stats')
+        }
+        start = time.time_ns()
+        self.assertGreaterEqual(cache.version('d_user'), start)
+        cache.invalidate('d_user')
+        self.assertEqual(0, cache.stats()['size'])
+        self.assertEqual({op: n + 1
+                          for op, n in before.items()},
+                         {op: errors(op)
+                          for op in before})
+
+    def test_invalidated_before_write(self):
+        """an invalidation by another worker waits for a write checked
+        against the versions, and then drops it"""
+        cache = SharedCache(self.path, max_size=4, ttl=60)
+        other = SharedCache(self.path, max_size=4, ttl=60)
+        key = (('d_user', ), 'a')
+        version = cache.version('d_user')
+        invalidating = threading.Thread(target=other.invalidate,
+                                        args=('d_user', ))
+
+        def fresh():
+            ok = cache.version('d_user') == version
+            # the other worker writes right after the check
+            invalidating.start()
+            invalidating.join(0.1)
+            return ok
+
+        cache.set(key, 1, fresh)
+        invalidating.join()
+        self.assertGreater(cache.version('d_user'), version)
+        self.assertEqual((False, None), cache.get(key))
+
+
+class TestCached(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(cache_module, 'cache',
+                                    LocalCache(max_size=8, ttl=60))
+        self.cache = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached(self):
+        calls = []
+
+        class Fake:
+            @cached(categories)
+            async def lookup(self, key):
+                calls.append(key)
+                return key * 2
+
+            @cached(users)
+            async def count(self):
+                calls.append(None)
+                return len(calls)
+
+        fake = Fake()
+        self.assertEqual(4, asyncio.run(fake.lookup(2)))
+        self.assertEqual(4, asyncio.run(fake.lookup(2)))
+        self.assertEqual(6, asyncio.run(fake.lookup(3)))
+        self.assertEqual([2, 3], calls)
+
+        asyncio.run(fake.count())
+        self.cache.invalidate('d_category')
+        asyncio.run(fake.lookup(2))
+        asyncio.run(fake.count())
+        self.assertEqual([2, 3, None, 2], calls)
+
+
+    def test_written_meanwhile(self):
+        """a value read while its table was written may predate the write"""
+        class Fake:
+            @cached(categories)
+            async def lookup(self, key):
+                cache_module.cache.invalidate('d_category')
+                return key
+
+        asyncio.run(Fake().lookup(1))
+        self.assertEqual(0, self.cache.stats()['size'])
+
+    def test_replica_lag(self):
+        """another worker reading a lagging replica right after a write
+        must not cache what it read"""
+        primary, replica = {'x': 1}, {'x': 1}
+
+        class Worker:
+            @cached(categories)
+            async def lookup(self, key):
+                return replica[key]
+
+        worker = Worker()
+        with mock.patch.object(cfg, 'SA_REPLICAS', ['postgresql://r/db']):
+            # a write by the first worker
+            primary['x'] = 2
+            self.cache.invalidate('d_category')
+            self.assertEqual(1, asyncio.run(worker.lookup('x')))
+            replica.update(primary)
+            self.assertEqual(2, asyncio.run(worker.lookup('x')))
+            # once the replicas must have caught up values are cached again
+            later = time.time_ns() + int(cfg.SA_REPLICA_MAX_LAG * 1e9) + 1
+            with mock.patch.object(time, 'time_ns', return_value=later):
+                asyncio.run(worker.lookup('x'))
+            replica['x'] = 3
+            self.assertEqual(2, asyncio.run(worker.lookup('x')))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
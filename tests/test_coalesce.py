@@ -0,0 +1,115 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from prometheus_client import REGISTRY
+
+from app.metrics import dao_method, label_methods
+from app.models import coalesce as coalesce_module
+from app.models.cache import LocalCache
+from app.models.coalesce import coalesced
+from app.models.tables import sales
+
+
+def coalesced_calls(method):
+    return REGISTRY.get_sample_value('db_query_coalesced_total',
+                                     {'method': method}) or 0
+
+
+@label_methods
+class Fake:
+    def __init__(self):
+        self.calls = 0
+        self.release = None
+
+    @coalesced(sales)
+    async def total(self, dt):
+        self.calls += 1
+        await self.release.wait()
+        if dt is None:
+            raise ValueError(dt)
+        return dt, dao_method()
+
+
+class TestCoalesced(unittest.TestCase):
+    def setUp(self):
+        self.cache = LocalCache(max_size=8, ttl=60)
+        patcher = mock.patch.object(coalesce_module, 'cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fake = Fake()
+
+    def run_calls(self, *calls, between=None):
+        async def run():
+            self.fake.release = asyncio.Event()
+            tasks = [asyncio.ensure_future(call()) for call in calls]
+            await asyncio.sleep(0)
+            if between is not None:
+                tasks.extend(between(tasks) or ())
+                await asyncio.sleep(0)
+            self.fake.release.set()
+            return await asyncio.gather(*tasks, return_exceptions=True)
+
+        return asyncio.run(run())
+
+    def test_shared(self):
+        before = coalesced_calls('total')
+        res = self.run_calls(*[lambda: self.fake.total('2008-01-05')] * 5,
+                             lambda: self.fake.total('2008-01-06'))
+        self.assertEqual(2, self.fake.calls)
+        self.assertEqual([('2008-01-05', 'total')] * 5 +
+                         [('2008-01-06', 'total')], res)
+        self.assertEqual(before + 4, coalesced_calls('total'))
+        self.assertEqual({}, coalesce_module._flights)
+
+    def test_error_shared(self):
+        res = self.run_calls(*[lambda: self.fake.total(None)] * 3)
+        self.assertEqual(1, self.fake.calls)
+        self.assertTrue(all(isinstance(err, ValueError) for err in res))
+
+    def test_caller_cancelled(self):
+        def cancel(tasks):
+            tasks[0].cancel()
+
+        res = self.run_calls(*[lambda: self.fake.total('2008-01-05')] * 2,
+                             between=cancel)
+        self.assertIsInstance(res[0], asyncio.CancelledError)
+        self.assertEqual(('2008-01-05', 'total'), res[1])
+        self.assertEqual({}, coalesce_module._waiters)
+
+    def test_all_cancelled(self):
+        """the flight is cancelled with its last caller, a later call runs
+        its own"""
+        async def run():
+            self.fake.release = asyncio.Event()
+            tasks = [
+                asyncio.ensure_future(self.fake.total('2008-01-05'))
+                for _ in range(2)
+            ]
+            await asyncio.sleep(0)
+            flight, = coalesce_module._flights.values()
+            tasks[0].cancel()
+            await asyncio.sleep(0)
+            self.assertFalse(flight.done())
+            tasks[1].cancel()
+            await asyncio.wait([flight], timeout=1)
+            self.assertTrue(flight.cancelled())
+            self.assertEqual({}, coalesce_module._flights)
+            self.fake.release.set()
+            return await self.fake.total('2008-01-05')
+
+        self.assertEqual(('2008-01-05', 'total'), asyncio.run(run()))
+        self.assertEqual(2, self.fake.calls)
+        self.assertEqual({}, coalesce_module._waiters)
+
+    def test_after_write(self):
+        def write(_):
+            self.cache.invalidate(sales.name)
+            return [asyncio.ensure_future(self.fake.total('2008-01-05'))]
+
+        self.run_calls(lambda: self.fake.total('2008-01-05'), between=write)
+        self.assertEqual(2, self.fake.calls)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,109 @@
+import asyncio
+import unittest
+
+from sqlalchemy import Column, Integer, MetaData, Table
+
+from app.models.dao import Dao
+from app.models.session import database, engine
+from app.models.tables import categories, sales, venues
+from tests.base import DatabaseTestCase
+
+metadata = MetaData()
+scratch = Table('t_count_scratch', metadata,
+                Column('id', Integer, primary_key=True))
+partitioned = Table('t_count_parted', metadata,
+                    Column('id', Integer, primary_key=True))
+
+
+def run(fn, *args):
+    """await a `Dao` call on a connected pool"""
+    async def helper():
+        await database.connect()
+        try:
+            return await fn(*args)
+        finally:
+            await database.disconnect()
+
+    return asyncio.run(helper())
+
+
+def execute(*statements: str):
+    with engine.connect() as conn:
+        for sql in statements:
+            conn.execute(sql)
+
+
+class TestCount(DatabaseTestCase):
+    dao = None
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cls.dao = Dao()
+
+    def tearDown(self) -> None:
+        execute(f'DROP TABLE IF EXISTS {scratch.name}',
+                f'DROP TABLE IF EXISTS {partitioned.name}')
+
+    def count(self, table: Table, estimate: bool) -> int:
+        column = next(iter(table.primary_key.columns))
+        return run(self.dao._count, column, estimate)
+
+    def test_modes(self):
+        """estimates agree with exact counts on freshly analysed tables"""
+        execute(f'ANALYZE {categories.name}', f'ANALYZE {venues.name}',
+                f'ANALYZE {sales.name}')
+        for table in (categories, venues):
+            with self.subTest(table=table.name):
+                self.assertEqual(self.count(table, False),
+                                 self.count(table, True))
+        exact = self.count(sales, False)
+        self.assertGreater(exact, 0)
+        # sampled by ANALYZE
+        self.assertAlmostEqual(1, self.count(sales, True) / exact, delta=0.1)
+
+    def test_never_analysed(self):
+        """the live tuples of a table the planner has no statistics of, or
+        an exact count"""
+        execute(f'CREATE TABLE {scratch.name} (id serial PRIMARY KEY)',
+                f'INSERT INTO {scratch.name} SELECT FROM '
+                'generate_series(1, 100)')
+        self.assertEqual(100, self.count(scratch, True))
+        execute(f'ANALYZE {scratch.name}',
+                f'INSERT INTO {scratch.name} SELECT FROM '
+                'generate_series(1, 10)')
+        # as of the last ANALYZE
+        self.assertEqual(100, self.count(scratch, True))
+        self.assertEqual(110, self.count(scratch, False))
+
+    def test_analysed_empty(self):
+        """rows added to a table analysed empty are not overlooked"""
+        execute(f'CREATE TABLE {scratch.name} (id serial PRIMARY KEY)',
+                f'ANALYZE {scratch.name}')
+        self.assertEqual(0, self.count(scratch, True))
+        execute(f'INSERT INTO {scratch.name} SELECT FROM '
+                'generate_series(1, 50)')
+        self.assertEqual(50, self.count(scratch, True))
+
+    def test_partitioned(self):
+        """a partitioned table, as with SA_PARTITION_FACTS, is the sum of
+        its leaf partitions"""
+        name = partitioned.name
+        execute(
+            f'CREATE TABLE {name} (id int PRIMARY KEY) '
+            'PARTITION BY RANGE (id)',
+            f'CREATE TABLE {name}_p0 PARTITION OF {name} '
+            'FOR VALUES FROM (0) TO (100)',
+            f'CREATE TABLE {name}_default PARTITION OF {name} DEFAULT',
+            f'INSERT INTO {name} SELECT generate_series(1, 250)',
+            f'ANALYZE {name}')
+        self.assertEqual(250, self.count(partitioned, True))
+        self.assertEqual(250, self.count(partitioned, False))
+
+    def test_no_table(self):
+        missing = Table('t_count_missing', MetaData(), Column('id', Integer))
+        self.assertEqual(0, run(self.dao._estimate, missing))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,33 @@
+import unittest
+
+from app.models.cursor import decode_cursor, encode_cursor
+from app.schema.api_exception import ApiException
+
+
+class TestCursor(unittest.TestCase):
+    def test_round_trip(self):
+        for key in (1, 49990):
+            self.assertEqual(key, decode_cursor(encode_cursor(key)))
+        self.assertEqual('abc', decode_cursor(encode_cursor('abc'), str))
+
+    def test_first_page(self):
+        self.assertIsNone(decode_cursor(None))
+        self.assertIsNone(decode_cursor(''))
+
+    def test_invalid(self):
+        for token in ('zzz', 'bm90IGpzb24', 'WzFd'):
+            with self.assertRaises(ApiException) as ctx:
+                decode_cursor(token)
+            self.assertEqual(400, ctx.exception.status_code)
+
+    def test_key_type(self):
+        """a tampered cursor of a key that is no integer"""
+        for key in ('abc', [1, 2], {'a': 1}, 1.5, True, None):
+            with self.assertRaises(ApiException) as ctx:
+                decode_cursor(encode_cursor(key))
+            self.assertEqual(400, ctx.exception.status_code)
+            self.assertEqual('invalid-request', ctx.exception.category)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,193 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from prometheus_client import REGISTRY
+
+from app import cfg
+from app.deadline import DeadlineMiddleware, budget, cancel_after, remaining
+from app.metrics import label_methods
+from app.models.coalesce import coalesced
+from app.models.dao import Dao
+from app.models.session import database, engine
+from app.models.tables import sales
+from app.schema.api_exception import ApiException
+from tests.base import DatabaseTestCase
+
+
+def abandoned(route: str) -> float:
+    return REGISTRY.get_sample_value('http_requests_abandoned_total',
+                                     {'route': route}) or 0
+
+
+class _App:
+    routes = []
+
+
+async def handle(app, disconnect_after: float) -> list:
+    """run `app` behind the middleware for a client that disconnects after
+    `disconnect_after` seconds
+
+    :return: messages sent
+    """
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.sleep(disconnect_after)
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'http',
+        'method': 'GET',
+        'path': '/slow',
+        'headers': [],
+        'app': _App(),
+    }
+    await DeadlineMiddleware(app)(scope, receive, send)
+    return sent
+
+
+def serve(app, disconnect_after: float):
+    """`handle` on a new event loop
+
+    :return: messages sent and seconds taken
+    """
+    start = time.perf_counter()
+    sent = asyncio.run(handle(app, disconnect_after))
+    return sent, time.perf_counter() - start
+
+
+@label_methods
+class _Sleeper:
+    @coalesced(sales)
+    async def sleep(self, seconds: float):
+        return await Dao._exec(f'SELECT pg_sleep({seconds})', 'fetch_val')
+
+
+class TestBudget(unittest.TestCase):
+    def test_remaining(self):
+        self.assertIsNone(remaining())
+        with mock.patch('time.monotonic', return_value=100.0):
+            with budget(10):
+                self.assertEqual(10, remaining())
+                # an inner budget never extends the outer one
+                with budget(20):
+                    self.assertEqual(10, remaining())
+                with budget(2):
+                    self.assertEqual(2, remaining())
+                with budget(0):
+                    self.assertEqual(10, remaining())
+            with budget(0):
+                self.assertIsNone(remaining())
+
+    def test_cancel_after(self):
+        async def main():
+            with self.assertRaises(asyncio.TimeoutError):
+                with cancel_after(0.01):
+                    await asyncio.sleep(1)
+            with cancel_after(1):
+                await asyncio.sleep(0)
+            # the task is still usable
+            await asyncio.sleep(0.02)
+
+        asyncio.run(main())
+
+
+class TestDeadlineMiddleware(unittest.TestCase):
+    def test_disconnect(self):
+        async def app(scope, receive, send):
+            await asyncio.sleep(5)
+
+        before = abandoned('unmatched')
+        sent, seconds = serve(app, disconnect_after=0.05)
+        self.assertEqual([], sent)
+        self.assertLess(seconds, 1)
+        self.assertEqual(before + 1, abandoned('unmatched'))
+
+    def test_complete(self):
+        async def app(scope, receive, send):
+            self.assertEqual('http.request', (await receive())['type'])
+            await send({'type': 'http.response.start', 'status': 200})
+            await send({'type': 'http.response.body', 'body': b'ok'})
+            # the server reports a disconnect once the response went out
+            self.assertEqual('http.disconnect', (await receive())['type'])
+            await asyncio.sleep(0.05)
+
+        before = abandoned('unmatched')
+        sent, _ = serve(app, disconnect_after=0)
+        self.assertEqual(2, len(sent))
+        self.assertEqual(before, abandoned('unmatched'))
+
+
+class TestQueryCancel(DatabaseTestCase):
+    @staticmethod
+    def sleeping() -> int:
+        with engine.connect() as conn:
+            return conn.execute(
+                "SELECT count(*) FROM pg_stat_activity "
+                "WHERE application_name = %s AND state = 'active' "
+                "AND query LIKE 'SELECT pg_sleep%%'", cfg.SA_APP_NAME).scalar()
+
+    def test_budget(self):
+        """the query is cancelled on the server and the connection reused"""
+        async def main():
+            await database.connect()
+            try:
+                start = time.perf_counter()
+                with self.assertRaises(ApiException) as ctx:
+                    with budget(0.1):
+                        await Dao._exec('SELECT pg_sleep(5)', 'fetch_val')
+                seconds = time.perf_counter() - start
+                await asyncio.sleep(0.1)
+                busy = self.sleeping()
+                return ctx.exception, seconds, busy, await Dao._exec(
+                    'SELECT 1', 'fetch_val')
+            finally:
+                await database.disconnect()
+
+        exc, seconds, busy, res = asyncio.run(main())
+        self.assertEqual((504, 'timeout'), (exc.status_code, exc.category))
+        self.assertLess(seconds, 1)
+        self.assertEqual(0, busy)
+        self.assertEqual(1, res)
+
+    def test_coalesced_disconnect(self):
+        """a shared query is cancelled once all its callers went away"""
+        sleeper = _Sleeper()
+
+        async def app(scope, receive, send):
+            await sleeper.sleep(5)
+
+        async def main():
+            await database.connect()
+            try:
+                first = asyncio.ensure_future(handle(app, 0.1))
+                second = asyncio.ensure_future(handle(app, 0.5))
+                await first
+                await asyncio.sleep(0.1)
+                # the other caller is still waiting for it
+                shared = self.sleeping()
+                await second
+                await asyncio.sleep(0.1)
+                return shared, self.sleeping(), await Dao._exec(
+                    'SELECT 1', 'fetch_val')
+            finally:
+                await database.disconnect()
+
+        start = time.perf_counter()
+        shared, busy, res = asyncio.run(main())
+        self.assertLess(time.perf_counter() - start, 2)
+        self.assertEqual(1, shared)
+        self.assertEqual(0, busy)
+        self.assertEqual(1, res)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,86 @@
+import csv
+import io
+import json
+import unittest
+from unittest import mock
+
+from starlette.testclient import TestClient
+
+from app import cfg
+from app.main import app
+from app.models.session import engine
+from app.models.tables import categories, venues
+from app.routers import export
+from tests.base import AppTestCase
+
+URL = f'{cfg.REST_URL_PREFIX}/export'
+
+
+async def _empty(_):
+    return
+    yield  # pylint: disable=unreachable
+
+
+class TestExport(AppTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        with engine.connect() as conn:
+            cls.rows = [
+                dict(row) for row in conn.execute(
+                    categories.select().order_by(categories.c.catid))
+            ]
+        if not cls.rows:
+            raise unittest.SkipTest('no categories loaded')
+        cls.columns = [col.name for col in categories.c]
+
+    def test_csv(self):
+        """header row in column order, then every row in key order"""
+        # batches smaller than the table
+        with mock.patch.object(cfg, 'EXPORT_BATCH_SIZE', 4), \
+                TestClient(app) as client:
+            resp = client.get(f'{URL}/category?format=csv')
+        self.assertEqual(200, resp.status_code)
+        self.assertTrue(resp.headers['content-type'].startswith('text/csv'))
+        self.assertEqual('attachment; filename=category.csv',
+                         resp.headers['content-disposition'])
+        lines = list(csv.reader(io.StringIO(resp.text)))
+        self.assertEqual(self.columns, lines[0])
+        self.assertEqual(
+            [[str(row[col]) for col in self.columns] for row in self.rows],
+            lines[1:])
+
+    def test_ndjson(self):
+        with mock.patch.object(cfg, 'EXPORT_BATCH_SIZE', 4), \
+                TestClient(app) as client:
+            resp = client.get(f'{URL}/category')
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual('application/x-ndjson',
+                         resp.headers['content-type'])
+        records = [json.loads(line) for line in resp.text.splitlines()]
+        self.assertEqual(self.rows, records)
+        self.assertEqual(self.columns, list(records[0]))
+
+    def test_empty(self):
+        with mock.patch.dict(export._TABLES, {'venue': (venues, _empty)}), \
+                TestClient(app) as client:
+            resp = client.get(f'{URL}/venue?format=csv')
+            self.assertEqual(200, resp.status_code)
+            self.assertEqual([[col.name for col in venues.c]],
+                             list(csv.reader(io.StringIO(resp.text))))
+            resp = client.get(f'{URL}/venue?format=ndjson')
+            self.assertEqual(200, resp.status_code)
+            self.assertEqual('', resp.text)
+
+    def test_invalid(self):
+        with TestClient(app) as client:
+            resp = client.get(f'{URL}/nowhere')
+            self.assertEqual(400, resp.status_code)
+            self.assertIn('can only export', resp.text)
+            self.assertEqual(
+                400,
+                client.get(f'{URL}/category?format=xml').status_code)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,77 @@
+import asyncio
+import unittest
+
+import aiohttp
+from aiohttp import web
+
+from bench.load import ROUTES, Route, _percentile, _request, regressions
+
+
+class TestLoad(unittest.TestCase):
+    def test_percentile(self):
+        ordered = [float(i) for i in range(1, 101)]
+        self.assertEqual(50, _percentile(ordered, 50))
+        self.assertEqual(95, _percentile(ordered, 95))
+        self.assertEqual(100, _percentile(ordered, 99.5))
+        self.assertEqual(7, _percentile([7.0], 99))
+
+    def test_regressions(self):
+        baseline = {
+            'a': {'rps': 100, 'p95_ms': 10},
+            'b': {'rps': 100, 'p95_ms': 10},
+            'c': {'rps': 100, 'p95_ms': 10},
+        }
+        results = {
+            'a': {'rps': 90, 'p95_ms': 11.5},
+            'b': {'rps': 70, 'p95_ms': 13},
+            'c': {'rps': 100, 'p95_ms': 10},
+            'new': {'rps': 1, 'p95_ms': 1000},
+        }
+        self.assertEqual(
+            ['b: p95 10.00 -> 13.00 ms', 'b: 100 -> 70 req/s'],
+            regressions(results, baseline, threshold=0.2))
+
+    def test_routes(self):
+        names = [route.name for route in ROUTES]
+        self.assertEqual(len(names), len(set(names)))
+        for route in ROUTES:
+            self.assertTrue(route.path(0).startswith('/'))
+        self.assertTrue({'category_batch', 'lookup_post', 'export_sale'} <=
+                        set(names))
+
+    def test_pages(self):
+        """a paged route follows `next` until the last page or `pages`"""
+        seen = []
+
+        async def page(request: web.Request) -> web.Response:
+            cursor = request.query.get('cursor')
+            seen.append(cursor)
+            nxt = {None: 'a=', 'a=': 'b+', 'b+': None}[cursor]
+            return web.json_response({'items': [], 'next': nxt})
+
+        async def walk(pages: int) -> bool:
+            app = web.Application()
+            app.router.add_get('/page', page)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            try:
+                async with aiohttp.ClientSession() as session:
+                    return await _request(
+                        session, f'http://127.0.0.1:{port}',
+                        Route('page', 'GET', lambda i: '/page?limit=1',
+                              pages=pages), 0)
+            finally:
+                await runner.cleanup()
+
+        self.assertTrue(asyncio.run(walk(5)))
+        self.assertEqual([None, 'a=', 'b+'], seen)
+        seen.clear()
+        self.assertTrue(asyncio.run(walk(2)))
+        self.assertEqual([None, 'a='], seen)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
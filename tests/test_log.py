@@ -0,0 +1,100 @@
+import json
+import logging
+import queue
+import unittest
+from unittest import mock
+
+from fastapi import FastAPI
+from prometheus_client import REGISTRY
+from starlette.testclient import TestClient
+
+from app.log import (JsonFormatter, RateLimitFilter, RequestContextMiddleware,
+                     _QueueHandler)
+
+
+def record(msg='%s: %s', args=('NOT_FOUND', 'no such category'), **extra):
+    rec = logging.LogRecord('info_logger', logging.INFO, __file__, 1, msg,
+                            args, None)
+    vars(rec).update(extra)
+    return rec
+
+
+def counted(name, logger):
+    return REGISTRY.get_sample_value(f'{name}_total', {'logger': logger}) or 0
+
+
+class TestJsonFormatter(unittest.TestCase):
+    def test_format(self):
+        doc = json.loads(JsonFormatter().format(record(category='NOT_FOUND')))
+        self.assertEqual('NOT_FOUND: no such category', doc['message'])
+        self.assertEqual('INFO', doc['level'])
+        self.assertEqual('info_logger', doc['logger'])
+        self.assertEqual('NOT_FOUND', doc['category'])
+        self.assertNotIn('request_id', doc)
+
+
+class TestRateLimitFilter(unittest.TestCase):
+    def test_burst(self):
+        limiter = RateLimitFilter(burst=2, period=60)
+        before = counted('log_records_suppressed', 'info_logger')
+        passed = [limiter.filter(record(category='DB')) for _ in range(5)]
+        self.assertEqual([True, True, False, False, False], passed)
+        # another category has its own window
+        self.assertTrue(limiter.filter(record(category='NOT_FOUND')))
+        self.assertEqual(before + 3,
+                         counted('log_records_suppressed', 'info_logger'))
+
+    def test_suppressed_reported(self):
+        limiter = RateLimitFilter(burst=1, period=60)
+        for _ in range(4):
+            limiter.filter(record(category='DB'))
+        with mock.patch('time.monotonic', return_value=1e12):
+            rec = record(category='DB')
+            self.assertTrue(limiter.filter(rec))
+        self.assertEqual(3, rec.suppressed)
+
+
+class TestQueueHandler(unittest.TestCase):
+    def test_drop_when_full(self):
+        handler = _QueueHandler(queue.Queue(2), 'info_logger')
+        before = counted('log_records_dropped', 'info_logger')
+        for _ in range(5):
+            handler.handle(record())
+        self.assertEqual(2, handler.queue.qsize())
+        self.assertEqual(before + 3,
+                         counted('log_records_dropped', 'info_logger'))
+        rec = handler.queue.get_nowait()
+        self.assertEqual('NOT_FOUND: no such category', rec.msg)
+        self.assertEqual('info_logger', rec.route)
+
+
+class TestRequestContext(unittest.TestCase):
+    def setUp(self) -> None:
+        app = FastAPI()
+        app.add_middleware(RequestContextMiddleware)
+        self.records = []
+
+        @app.get('/ping')
+        async def ping():
+            rec = record()
+            JsonFormatter().format(rec)
+            self.records.append(rec)
+            return {}
+
+        self.client = TestClient(app)
+
+    def test_request_id(self):
+        res = self.client.get('/ping', headers={'X-Request-ID': 'abc'})
+        self.assertEqual('abc', res.headers['x-request-id'])
+        self.assertEqual('abc', self.records[-1].request_id)
+        self.assertGreaterEqual(self.records[-1].elapsed_ms, 0)
+
+    def test_new_id(self):
+        first = self.client.get('/ping').headers['x-request-id']
+        second = self.client.get('/ping').headers['x-request-id']
+        self.assertEqual(32, len(first))
+        self.assertNotEqual(first, second)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
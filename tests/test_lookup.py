@@ -0,0 +1,102 @@
+import unittest
+from unittest import mock
+
+from prometheus_client import REGISTRY
+from starlette.testclient import TestClient
+
+from app import cfg
+from app.main import app
+from app.models.session import engine
+from tests.base import AppTestCase
+
+URL = f'{cfg.REST_URL_PREFIX}/lookup'
+# ids of no record
+NONE = (2**31 - 1, 2**31 - 2, 2**31 - 3)
+
+
+def queries(method: str) -> float:
+    return REGISTRY.get_sample_value('db_query_duration_seconds_count',
+                                     {'method': method}) or 0
+
+
+class TestLookup(AppTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        with engine.connect() as conn:
+            cls.catids = [
+                row[0] for row in conn.execute(
+                    'SELECT catid FROM d_category ORDER BY 1 LIMIT 2')
+            ]
+        if len(cls.catids) < 2:
+            raise unittest.SkipTest('no categories loaded')
+
+    def test_get(self):
+        a, b = self.catids
+        with TestClient(app) as client:
+            before = queries('lookup_categories')
+            resp = client.get(f'{URL}/category?ids={a},{b},{NONE[0]},{a}')
+            self.assertEqual(before + 1, queries('lookup_categories'))
+            self.assertEqual(200, resp.status_code)
+            body = resp.json()
+            self.assertEqual({str(a), str(b)}, set(body['items']))
+            self.assertEqual(a, body['items'][str(a)]['catid'])
+            self.assertEqual([NONE[0]], body['missing'])
+            etag = resp.headers['etag']
+            resp = client.get(f'{URL}/category?ids={a}',
+                              headers={'If-None-Match': etag})
+            self.assertEqual(304, resp.status_code)
+
+    def test_post(self):
+        a, _ = self.catids
+        with TestClient(app) as client:
+            resp = client.post(f'{URL}/category', json=[NONE[1], a])
+            self.assertEqual(200, resp.status_code)
+            self.assertEqual([str(a)], list(resp.json()['items']))
+            self.assertEqual([NONE[1]], resp.json()['missing'])
+            for table in ('user', 'venue', 'event'):
+                resp = client.post(f'{URL}/{table}', json=[NONE[0]])
+                self.assertEqual({
+                    'items': {},
+                    'missing': [NONE[0]]
+                }, resp.json())
+
+    def test_post_object(self):
+        a, b = self.catids
+        with TestClient(app) as client:
+            resp = client.post(f'{URL}/category',
+                               json={'ids': [a, NONE[2], b]})
+            self.assertEqual(200, resp.status_code)
+            self.assertEqual({str(a), str(b)}, set(resp.json()['items']))
+            self.assertEqual([NONE[2]], resp.json()['missing'])
+            self.assertEqual(
+                400,
+                client.post(f'{URL}/category', json={
+                    'keys': [a]
+                }).status_code)
+
+    def test_invalid(self):
+        with TestClient(app) as client:
+            self.assertEqual(400,
+                             client.get(f'{URL}/listing?ids=1').status_code)
+            self.assertEqual(400,
+                             client.get(f'{URL}/user?ids=1,x').status_code)
+            # beyond the Postgres integer keys
+            for ids in ('99999999999', '1,0', '-1', str(2**31)):
+                with self.subTest(ids=ids):
+                    resp = client.get(f'{URL}/user?ids={ids}')
+                    self.assertEqual(400, resp.status_code)
+                    self.assertEqual('invalid-request',
+                                     resp.json()['category'])
+                    resp = client.post(
+                        f'{URL}/user',
+                        json=[int(i) for i in ids.split(',')])
+                    self.assertEqual(400, resp.status_code)
+            with mock.patch.object(cfg, 'LOOKUP_MAX_IDS', 2):
+                self.assertEqual(
+                    400,
+                    client.post(f'{URL}/user', json=[1, 2, 3]).status_code)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from fastapi import FastAPI
+from prometheus_client import REGISTRY
+from starlette.testclient import TestClient
+
+from app.metrics import (CONTENT_TYPE_LATEST, MetricsMiddleware, dao_method,
+                         label_methods)
+from app.routers import metrics
+
+
+def requests(**labels):
+    return REGISTRY.get_sample_value('http_request_duration_seconds_count',
+                                     labels) or 0
+
+
+class TestMetricsMiddleware(unittest.TestCase):
+    def setUp(self) -> None:
+        app = FastAPI()
+        app.add_middleware(MetricsMiddleware)
+
+        @app.get('/items/{pkid}')
+        async def item(pkid: int):
+            return {'pkid': pkid}
+
+        self.client = TestClient(app)
+
+    def test_route_template(self):
+        labels = {'method': 'GET', 'route': '/items/{pkid}', 'status': '200'}
+        before = requests(**labels)
+        for pkid in (1, 2, 3):
+            self.client.get(f'/items/{pkid}')
+        self.assertEqual(before + 3, requests(**labels))
+
+    def test_status(self):
+        invalid = {'method': 'GET', 'route': '/items/{pkid}', 'status': '422'}
+        unmatched = {'method': 'GET', 'route': 'unmatched', 'status': '404'}
+        before = requests(**invalid), requests(**unmatched)
+        self.client.get('/items/abc')
+        self.client.get('/nowhere')
+        self.assertEqual((before[0] + 1, before[1] + 1),
+                         (requests(**invalid), requests(**unmatched)))
+
+
+class TestEndpoint(unittest.TestCase):
+    def test_content_type(self):
+        app = FastAPI()
+        app.include_router(metrics.router)
+        resp = TestClient(app).get('/metrics')
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(CONTENT_TYPE_LATEST, resp.headers['content-type'])
+        self.assertEqual(1, resp.headers['content-type'].count('charset'))
+
+
+class TestLabelMethods(unittest.TestCase):
+    def test_label(self):
+        @label_methods
+        class Foo:
+            async def outer(self):
+                inner = await self.inner()
+                return dao_method(), inner
+
+            async def inner(self):
+                return dao_method()
+
+            async def _private(self):
+                return dao_method()
+
+        foo = Foo()
+        self.assertEqual(('outer', 'inner'), asyncio.run(foo.outer()))
+        self.assertEqual('other', asyncio.run(foo._private()))
+        self.assertEqual('other', dao_method())
+
+
+# one worker process observing a query of `lookup_category_id`
+WORKER = '''
+from app.metrics import QUERY_LATENCY
+QUERY_LATENCY.labels('lookup_category_id').observe(0.01)
+'''
+SCRAPE = '''
+from app.metrics import exposition
+print(exposition().decode())
+'''
+
+
+class TestMultiprocess(unittest.TestCase):
+    def test_merged_across_workers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, prometheus_multiproc_dir=tmp)
+            for _ in range(2):
+                subprocess.run([sys.executable, '-c', WORKER],
+                               env=env,
+                               check=True)
+            out = subprocess.run([sys.executable, '-c', SCRAPE],
+                                 env=env,
+                                 check=True,
+                                 stdout=subprocess.PIPE).stdout.decode()
+        self.assertIn(
+            'db_query_duration_seconds_count{method="lookup_category_id"} 2.0',
+            out)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
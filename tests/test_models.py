@@ -1,7 +1,38 @@
+import asyncio
+import os
+import tempfile
 import unittest
-from functools import reduce
+from datetime import date
 
-from postgres.models.dao import Dao
+import asyncpg
+from sqlalchemy.sql import func, select
+
+from app import cfg
+from app.models.dao import SAMPLE_FILES, Dao
+from app.models.db import DB
+from app.models.session import database, engine
+from app.models.tables import daily_sales, dates, sales
+from app.schema.api_exception import ApiException
+
+DSN = (f'postgresql://{cfg.SA_USR}:{cfg.SA_PWD}'
+       f'@{cfg.SA_HOST}:{cfg.SA_PORT}/{cfg.SA_DB}')
+
+
+def run(fn, *args):
+    """await a `Dao` call on a connected pool"""
+    async def helper():
+        await database.connect()
+        try:
+            return await fn(*args)
+        finally:
+            await database.disconnect()
+
+    return asyncio.run(helper())
+
+
+def lines(filename: str) -> int:
+    with open(os.path.join(cfg.DATA_PATH, filename), 'rb') as f:
+        return sum(1 for ln in f if ln.strip())
 
 
 class TestModel(unittest.TestCase):
@@ -9,66 +40,127 @@ class TestModel(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls) -> None:
-        cls.dao = Dao(echo=True)
-
-    @classmethod
-    def tearDownClass(cls) -> None:
-        del cls.dao
-
-    def setUp(self):
-        self.dao.reset_engine()
+        async def probe():
+            conn = await asyncpg.connect(DSN, timeout=5)
+            await conn.close()
 
-    def tearDown(self):
-        self.dao.reset_engine()
+        try:
+            asyncio.run(probe())
+        except (OSError, asyncpg.PostgresError) as err:
+            raise unittest.SkipTest(f'no test database: {err!r}')
+        cls.dao = Dao()
 
     def test_create_drop(self):
         """test creating & dropping tables
 
         methods:
-          * dao.create_all
-          * dao.drop_all
-          * dao.all_tables
+          * DB.create_all
+          * DB.drop_all
+          * DB.all_tables
 
         """
-        exp = {
-            'sales', 'listing', 'event', 'users', 'venue', 'category', 'date'
-        }
-        tables = self.dao.all_tables()
-        if exp == set(tables):
+        exp = {t.name for t in DB._TABLES}
+        if exp <= set(DB.all_tables()):
             return
-        else:
-            self.dao.drop_all()
-            self.dao.create_all()
-            self.assertEqual(exp, set(self.dao.all_tables()))
+        DB.drop_all()
+        DB.create_all()
+        self.assertLessEqual(exp, set(DB.all_tables()))
 
     def test_load(self):
-        """test load sample & count
+        """test load sample & count, as many rows as the sample files have
 
         methods:
           * dao.load_sample
           * dao.count_<table_name>
 
         """
-        mappings = [(self.dao.count_users, 49990), (self.dao.count_venues, 202),
-                    (self.dao.count_categories, 11), (self.dao.count_dates, 365),
-                    (self.dao.count_events, 8798),
-                    (self.dao.count_listings, 192497),
-                    (self.dao.count_sales, 172456)]
-
-        if reduce(lambda x, y: x and y, (f() == exp for f, exp in mappings)):
+        if not os.path.isfile(os.path.join(cfg.DATA_PATH, 'sales_tab.txt')):
+            self.skipTest(f'no sample data in {cfg.DATA_PATH}')
+        mappings = [
+            (self.dao.count_users, 'allusers_pipe.txt'),
+            (self.dao.count_venues, 'venue_pipe.txt'),
+            (self.dao.count_categories, 'category_pipe.txt'),
+            (self.dao.count_dates, 'date2008_pipe.txt'),
+            (self.dao.count_events, 'allevents_pipe.txt'),
+            (self.dao.count_listings, 'listings_pipe.txt'),
+            (self.dao.count_sales, 'sales_tab.txt'),
+        ]
+        if all(run(f) == lines(fn) for f, fn in mappings):
             return
-        else:
-            self.dao.drop_all()
-            self.dao.create_all()
-            self.dao.load_sample()
-
-            for f, exp in mappings:
-                self.assertEqual(f(), exp)
+        DB.drop_all()
+        DB.create_all()
+        run(self.dao.load_sample)
+        for f, fn in mappings:
+            self.assertEqual(lines(fn), run(f))
 
     def test_total_sales(self):
+        """the daily rollup agrees with the sales of the day"""
         dt = '2008-01-05'
-        exp = 210
-        self.assertEqual(exp, self.dao.total_sales_amount(dt))
+        src = sales.join(dates, sales.c.dateid == dates.c.dateid)
+        stmt = select([func.coalesce(func.sum(sales.c.qtysold), 0)
+                       ]).select_from(src).where(
+                           dates.c.caldate == date.fromisoformat(dt))
+        exp = run(database.fetch_val, stmt)
+        self.assertEqual(exp, run(self.dao.total_sales_amount, dt))
+
+
+def restored() -> tuple:
+    """indexes of the tables missing and whether the rollup trigger is
+    enabled"""
+    names = [idx.name for t in SAMPLE_FILES for idx in t.indexes]
+    with engine.connect() as conn:
+        found = {
+            row[0]
+            for row in conn.execute(
+                "SELECT relname FROM pg_class WHERE relkind IN ('i', 'I')")
+        }
+        enabled = conn.execute(
+            "SELECT tgenabled <> 'D' FROM pg_trigger "
+            "WHERE tgname = 'f_sale_rollup'").scalar()
+    return [name for name in names if name not in found], enabled
+
+
+class TestBulkLoad(unittest.TestCase):
+    dao = None
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        TestModel.setUpClass()
+        cls.dao = Dao()
+
+    def test_failed_load(self):
+        """a load that fails still restores indexes and trigger"""
+        before = run(self.dao.count_users)
+        with self.assertRaises(ApiException) as ctx:
+            run(self.dao.load_sample, '/nonexistent')
+        self.assertEqual(500, ctx.exception.status_code)
+        self.assertEqual(([], True), restored())
+        self.assertEqual(before, run(self.dao.count_users))
+
+    def test_load_fixture(self):
+        """a small fixture loads with its row counts, a rollup agreeing
+        with the sales and every index back"""
+        if not os.path.isfile(os.path.join(cfg.DATA_PATH, 'sales_tab.txt')):
+            self.skipTest(f'no sample data in {cfg.DATA_PATH} to restore')
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        stats = run(self.dao.generate_sample, tmp.name, 0.001)
+        # put the sample back for the other tests, cleanups run last first
+        self.addCleanup(run, self.dao.load_sample)
+        self.addCleanup(DB.create_all)
+        self.addCleanup(DB.drop_all)
+        DB.drop_all()
+        DB.create_all()
+        loaded = run(self.dao.load_sample, tmp.name)
+        self.assertEqual([(s.table, s.rows) for s in stats],
+                         [(s.table, s.rows) for s in loaded])
+        self.assertEqual(dict((s.table, s.rows) for s in stats)['f_sale'],
+                         run(self.dao.count_sales))
+        self.assertEqual(([], True), restored())
+        total = select([func.sum(sales.c.qtysold)])
+        rollup = select([func.sum(daily_sales.c.qtysold)])
+        self.assertEqual(run(database.fetch_val, total),
+                         run(database.fetch_val, rollup))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,56 @@
+"""the service keeps answering while its database connections are killed
+
+backends of the async pool are terminated between bursts of requests, as
+a Postgres restart or failover would; reads must be retried on fresh
+connections instead of failing with 500s.
+"""
+import collections
+import unittest
+
+from starlette.testclient import TestClient
+
+from app import cfg
+from app.main import app
+from app.models.db import DB
+from app.models.session import engine
+from tests.base import AppTestCase
+
+URL = f'{cfg.REST_URL_PREFIX}/category?limit=5&offset=0'
+
+
+class TestPoolChaos(AppTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        DB.create_all()
+
+    @staticmethod
+    def kill_backends() -> int:
+        """terminate the connections of the async pool
+
+        :return: number of backends terminated
+        """
+        with engine.connect() as conn:
+            return conn.execute(
+                'SELECT count(pg_terminate_backend(pid)) '
+                'FROM pg_stat_activity '
+                'WHERE application_name = %s AND pid <> pg_backend_pid()',
+                cfg.SA_APP_NAME).scalar()
+
+    def test_recovers_from_killed_backends(self):
+        statuses = collections.Counter()
+        with TestClient(app) as client:
+            for _ in range(5):
+                self.assertEqual(200, client.get(URL).status_code)
+            for _ in range(5):
+                self.assertGreater(self.kill_backends(), 0)
+                for _ in range(20):
+                    statuses[client.get(URL).status_code] += 1
+            stats = client.get(f'{cfg.REST_URL_PREFIX}/config/pool').json()
+        self.assertEqual({200: 100}, dict(statuses))
+        self.assertGreater(stats['database']['size'], 0)
+        self.assertEqual(0, stats['database']['checked_out'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,38 @@
+import unittest
+
+from sqlalchemy.sql import bindparam, select, text
+
+from app.models.prepared import Prepared
+from app.models.tables import categories
+
+
+class TestPrepared(unittest.TestCase):
+    def test_placeholders(self):
+        stmt = Prepared(
+            select([categories]).where(
+                categories.c.catname == bindparam('name')).limit(
+                    bindparam('limit')))
+        self.assertEqual(('limit', 'name'), stmt.names)
+        self.assertIn('d_category.catname = $2', stmt.sql)
+        self.assertIn('LIMIT $1', stmt.sql)
+        self.assertNotIn('%', stmt.sql)
+        self.assertEqual([10, 'Opera'],
+                         stmt.args({
+                             'name': 'Opera',
+                             'limit': 10
+                         }))
+
+    def test_repeated_parameter(self):
+        stmt = Prepared(text('SELECT :a WHERE :a > :b'))
+        self.assertEqual('SELECT $1 WHERE $1 > $2', stmt.sql)
+        self.assertEqual([2, 1], stmt.args({'a': 2, 'b': 1}))
+
+    def test_default_value(self):
+        stmt = Prepared(
+            select([categories]).where(categories.c.catid == 5).where(
+                categories.c.catname == bindparam('name')))
+        self.assertEqual([5, 'Opera'], stmt.args({'name': 'Opera'}))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
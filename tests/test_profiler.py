@@ -0,0 +1,52 @@
+import threading
+import time
+import unittest
+
+from app.profiler import Sampler
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class TestSampler(unittest.TestCase):
+    def test_folded_stacks(self):
+        sampler = Sampler(threading.get_ident(), 0.001)
+        sampler.start()
+        busy(0.2)
+        sampler.stop()
+        self.assertGreater(sampler.samples, 10)
+        lines = sampler.folded().splitlines()
+        self.assertEqual(sampler.samples,
+                         sum(int(line.rsplit(' ', 1)[1]) for line in lines))
+        stack = lines[0].rsplit(' ', 1)[0].split(';')
+        self.assertEqual(f'{__name__}:busy', stack[-1])
+        self.assertIn(f'{__name__}:test_folded_stacks', stack)
+
+    def test_other_thread(self):
+        started, done = threading.Event(), threading.Event()
+
+        def run():
+            started.set()
+            while not done.is_set():
+                busy(0.001)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        started.wait()
+        sampler = Sampler(thread.ident, 0.001)
+        sampler.start()
+        time.sleep(0.2)
+        # the sampler stops before the thread leaves `run`
+        sampler.stop()
+        done.set()
+        thread.join()
+        self.assertGreater(sampler.samples, 0)
+        self.assertTrue(
+            all('threading:run' in stack for stack in sampler.stacks))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,201 @@
+"""plan regression suite: no `Dao` read query may scan a table in full
+unless it has to
+
+queries are captured at `Dao._exec` and explained with sequential scans
+disabled, so that the plans depend less on the table sizes in the test
+database. A full scan is then a `Seq Scan`, or an index scan without an
+index condition, wherever it is in the plan: feeding a hash or the inner
+side of a merge join reads the table whole all the same. Only scans fed
+straight into a `LIMIT`, e.g. keyset pagination, which stop early, and
+scans of small dimension tables are let through; the system catalogs read
+by estimated counts are not checked. Exact counts and sales series by a
+dimension read whole tables by definition, the suite pins down which:
+even a week of sales refers to events and venues all over the calendar,
+joined by hash to all of them.
+"""
+import asyncio
+import json
+import re
+import unittest
+from datetime import date
+from unittest import mock
+
+import asyncpg
+from sqlalchemy.dialects.postgresql import pypostgresql
+
+from app import cfg
+from app.models import cache as cache_module
+from app.models.cache import LocalCache
+from app.models.dao import Dao
+from app.models.db import DB
+from app.models.prepared import Prepared
+from app.models.tables import metadata
+from app.schema.api_exception import ApiException
+
+# dimension tables of up to that many estimated rows may be scanned in full
+DIMENSIONS = ('d_', )
+SMALL = 1000
+
+
+def compile_stmt(stmt, values=None):
+    """SQL and arguments the way `databases` sends them to asyncpg"""
+    if isinstance(stmt, Prepared):
+        return stmt.sql, stmt.args(values)
+    dialect = pypostgresql.dialect(paramstyle='pyformat')
+    compiled = stmt.compile(dialect=dialect)
+    params = sorted(compiled.params.items())
+    mapping = {key: f'${i}' for i, (key, _) in enumerate(params, start=1)}
+    return compiled.string % mapping, [val for _, val in params]
+
+
+def table(relation: str) -> str:
+    """table of a relation, the partitioned table of a partition"""
+    return re.sub(r'_(p\d+|default)$', '', relation)
+
+
+def full_scans(plan, limited=False):
+    """tables of the application scanned in full in a JSON plan tree, but
+    small dimension tables and scans fed straight into a `LIMIT`, which
+    stop early"""
+    name = table(plan.get('Relation Name', ''))
+    if name in metadata.tables and not limited and (
+            plan['Node Type'] == 'Seq Scan' or
+        (plan['Node Type'] in ('Index Scan', 'Index Only Scan')
+         and 'Index Cond' not in plan)):
+        if not (name.startswith(DIMENSIONS) and plan['Plan Rows'] <= SMALL):
+            yield name
+    limited = plan['Node Type'] == 'Limit' or (
+        limited and plan['Node Type'] in ('Append', 'Merge Append'))
+    for child in plan.get('Plans', []):
+        yield from full_scans(child, limited)
+
+
+async def capture_queries():
+    """the query of each `Dao` read, and the tables it may scan in full"""
+    dao = Dao()
+    week = (date(2008, 1, 1), date(2008, 1, 7))
+    year = (date(2008, 1, 1), date(2008, 12, 31))
+    calls = [
+        ((), lambda: dao.all_user(10, 100)),
+        ((), lambda: dao.all_category(10, 0)),
+        ((), lambda: dao.page_user(10, 'eyJrIjoxMDB9')),
+        ((), lambda: dao.page_category(10)),
+        ((), lambda: dao.lookup_category_id(1)),
+        ((), lambda: dao.lookup_category_name('Opera')),
+        ((), lambda: dao.lookup_users((1, 2, 3))),
+        ((), lambda: dao.lookup_events((1, 2, 3))),
+        ((), lambda: dao.total_sales_amount('2008-01-05')),
+        ((), lambda: dao.sales_closed('2008-01-05')),
+    ]
+    for fn, name in ((dao.count_users, 'd_user'),
+                     (dao.count_venues, 'd_venue'),
+                     (dao.count_categories, 'd_category'),
+                     (dao.count_dates, 'd_date'),
+                     (dao.count_events, 'f_event'),
+                     (dao.count_listings, 'f_listing'),
+                     (dao.count_sales, 'f_sale'),
+                     (dao.count_daily_sales, 'a_daily_sale')):
+        calls.append(((), lambda f=fn: f(estimate=True)))
+        calls.append(((name, ), fn))
+    for group_by in ('day', 'week', 'month', 'qtr'):
+        for first, last in (week, year):
+            calls.append(((), lambda g=group_by, f=first, l=last: dao.
+                          sales_series(f, l, g, cfg.SUMMARY_MAX_GROUPS)))
+    for group_by, dimension in (('category', 'd_category'),
+                                ('venue', 'd_venue'), ('event', 'f_event')):
+        calls.append((('f_event', dimension),
+                      lambda g=group_by: dao.sales_series(
+                          *week, g, cfg.SUMMARY_MAX_GROUPS)))
+        calls.append((('f_event', dimension, 'f_sale'),
+                      lambda g=group_by: dao.sales_series(
+                          *year, g, cfg.SUMMARY_MAX_GROUPS)))
+
+    stmts = []
+    expected = ()
+
+    async def fake_exec(stmt, method='fetch_all', values=None, **_):
+        stmts.append((expected, stmt, values))
+        # an estimated count of None falls back on the exact one
+        return {'fetch_all': [], 'fetch_val': 0}.get(method)
+
+    with mock.patch.object(Dao, '_exec', staticmethod(fake_exec)), \
+            mock.patch.object(cache_module, 'cache', LocalCache(64, 60)):
+        for expected, call in calls:
+            try:
+                await call()
+            except ApiException:
+                pass
+    return stmts
+
+
+class TestQueryPlans(unittest.TestCase):
+    conn = None
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        async def connect():
+            return await asyncpg.connect(host=cfg.SA_HOST,
+                                         port=cfg.SA_PORT,
+                                         user=cfg.SA_USR,
+                                         password=cfg.SA_PWD,
+                                         database=cfg.SA_DB,
+                                         timeout=5)
+
+        cls.loop = asyncio.new_event_loop()
+        try:
+            cls.conn = cls.loop.run_until_complete(connect())
+        except (OSError, asyncpg.PostgresError) as err:
+            cls.loop.close()
+            raise unittest.SkipTest(f'no test database: {err!r}')
+        DB.create_all()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.loop.run_until_complete(cls.conn.close())
+        cls.loop.close()
+
+    def explain(self, sql, args):
+        async def run():
+            async with self.conn.transaction():
+                await self.conn.execute('SET LOCAL enable_seqscan = off')
+                return await self.conn.fetchval(
+                    f'EXPLAIN (FORMAT JSON) {sql}', *args)
+
+        return json.loads(self.loop.run_until_complete(run()))[0]['Plan']
+
+    def test_full_scans(self):
+        stmts = self.loop.run_until_complete(capture_queries())
+        self.assertTrue(stmts)
+        for expected, stmt, values in stmts:
+            sql, args = compile_stmt(stmt, values)
+            with self.subTest(sql=sql):
+                self.assertLessEqual(
+                    set(full_scans(self.explain(sql, args))), set(expected))
+
+    def test_full_scans_found(self):
+        """full scans under a hash or a merge join count"""
+        scan = {'Node Type': 'Seq Scan', 'Relation Name': 'f_sale_p3',
+                'Plan Rows': 10}
+        small = {'Node Type': 'Seq Scan', 'Relation Name': 'd_date',
+                 'Plan Rows': 365}
+        large = dict(small, **{'Relation Name': 'd_user', 'Plan Rows': 5e4})
+        plan = {
+            'Node Type': 'Hash Join',
+            'Plans': [{
+                'Node Type': 'Merge Join',
+                'Plans': [small, large]
+            }, {
+                'Node Type': 'Hash',
+                'Plans': [scan]
+            }],
+        }
+        self.assertEqual(['d_user', 'f_sale'], list(full_scans(plan)))
+        self.assertEqual([],
+                         list(full_scans({'Node Type': 'Limit',
+                                          'Plans': [scan]})))
+        catalog = dict(scan, **{'Relation Name': 'pg_class'})
+        self.assertEqual([], list(full_scans(catalog)))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,164 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import asyncpg
+from sqlalchemy.sql import text
+
+from app import cfg
+from app.models import replica as replica_module
+from app.models.cache import LocalCache, SharedCache
+from app.models.dao import Dao
+from app.models.replica import ReplicaSet, read_only, reader
+from app.models.session import database
+from app.models.tables import categories, users
+
+DSN = (f'postgresql://{cfg.SA_USR}:{cfg.SA_PWD}'
+       f'@{cfg.SA_HOST}:{cfg.SA_PORT}/{cfg.SA_DB}')
+
+
+class TestReplicaSet(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cache = LocalCache(max_size=8, ttl=60)
+        self.replicas = ReplicaSet(['postgresql://a/db', 'postgresql://b/db'],
+                                   max_lag=5,
+                                   versions=self.cache)
+        # tables of unknown version count as written now
+        with mock.patch('time.time_ns', return_value=0):
+            for table in ('d_user', 'd_category'):
+                self.cache.version(table)
+        self.a, self.b = self.replicas.databases
+
+    def test_round_robin(self):
+        self.replicas.lag.update({self.a: 0, self.b: 1})
+        picked = [self.replicas.pick(['d_user']) for _ in range(4)]
+        self.assertEqual([self.a, self.b, self.a, self.b], picked)
+
+    def test_lag_threshold(self):
+        self.replicas.lag.update({self.a: 10, self.b: 1})
+        self.assertEqual({self.b},
+                         {self.replicas.pick(['d_user'])
+                          for _ in range(4)})
+        self.replicas.lag[self.b] = 6
+        self.assertIs(database, self.replicas.pick(['d_user']))
+
+    def test_unchecked(self):
+        self.assertIs(database, self.replicas.pick(['d_user']))
+
+    def test_least_conn(self):
+        replicas = ReplicaSet(['postgresql://a/db', 'postgresql://b/db'],
+                              policy='least_conn',
+                              versions=self.cache)
+        a, b = replicas.databases
+        replicas.lag.update({a: 0, b: 0})
+        in_use = {a: 3, b: 1}
+        with mock.patch.object(replica_module, 'checked_out', in_use.get):
+            self.assertIs(b, replicas.pick(['d_user']))
+            in_use[b] = 4
+            self.assertIs(a, replicas.pick(['d_user']))
+
+    def test_read_your_writes(self):
+        self.replicas.lag.update({self.a: 0, self.b: 0})
+        self.cache.invalidate('d_category')
+        self.assertIs(database, self.replicas.pick(['d_category']))
+        self.assertIs(database, self.replicas.pick(['d_user', 'd_category']))
+        self.assertIsNot(database, self.replicas.pick(['d_user']))
+        with mock.patch('time.time_ns', return_value=time.time_ns() + 6e9):
+            self.assertIsNot(database, self.replicas.pick(['d_category']))
+
+    def test_written_by_other_worker(self):
+        """a write of one worker sends the reads of another to the
+        primary"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cache.sqlite')
+            shared = [SharedCache(path, max_size=8, ttl=60) for _ in range(2)]
+            writer, other = [
+                ReplicaSet(['postgresql://a/db'], max_lag=5, versions=c)
+                for c in shared
+            ]
+            for replica_set in (writer, other):
+                replica_set.lag[replica_set.databases[0]] = 0
+            with mock.patch('time.time_ns', return_value=0):
+                for table in ('d_user', 'd_category'):
+                    shared[0].version(table)
+            self.assertIsNot(database, other.pick(['d_category']))
+            shared[0].invalidate('d_category')
+            self.assertIs(database, writer.pick(['d_category']))
+            self.assertIs(database, other.pick(['d_category']))
+            self.assertIsNot(database, other.pick(['d_user']))
+            with mock.patch('time.time_ns',
+                            return_value=time.time_ns() + 6e9):
+                self.assertIsNot(database, other.pick(['d_category']))
+
+    def test_read_only(self):
+        self.replicas.lag.update({self.a: 0, self.b: 0})
+
+        @read_only(users)
+        async def read():
+            return reader()
+
+        with mock.patch.object(replica_module, 'replicas', self.replicas):
+            self.assertIs(self.a, asyncio.run(read()))
+            self.assertIs(self.b, asyncio.run(read()))
+        self.assertIsNone(reader())
+
+
+class TestReplicaRouting(unittest.TestCase):
+    """the test database stands in for both the primary and a replica,
+    told apart by the application_name of their connections"""
+    @classmethod
+    def setUpClass(cls) -> None:
+        async def probe():
+            conn = await asyncpg.connect(DSN, timeout=5)
+            await conn.close()
+
+        try:
+            asyncio.run(probe())
+        except (OSError, asyncpg.PostgresError) as err:
+            raise unittest.SkipTest(f'no test database: {err!r}')
+
+    @staticmethod
+    @read_only(categories)
+    async def app_name():
+        stmt = text("SELECT current_setting('application_name')")
+        return await Dao._exec(stmt, 'fetch_val')
+
+    def route(self, replicas, *actions):
+        async def run():
+            await database.connect()
+            await replicas.connect()
+            try:
+                names = []
+                for action in actions:
+                    action()
+                    names.append(await self.app_name())
+                return names
+            finally:
+                await replicas.disconnect()
+                await database.disconnect()
+
+        with mock.patch.object(replica_module, 'replicas', replicas):
+            return asyncio.run(run())
+
+    def test_reads_on_replica(self):
+        versions = LocalCache(max_size=8, ttl=60)
+        with mock.patch('time.time_ns', return_value=0):
+            versions.version(categories.name)
+        replicas = ReplicaSet([DSN], interval=0.1, versions=versions)
+        names = self.route(replicas, lambda: None,
+                           lambda: versions.invalidate(categories.name))
+        self.assertEqual([f'{cfg.SA_APP_NAME}-replica', cfg.SA_APP_NAME],
+                         names)
+        self.assertEqual(0, replicas.lag[replicas.databases[0]])
+
+    def test_unreachable_replica(self):
+        replicas = ReplicaSet([f'postgresql://{cfg.SA_USR}@127.0.0.1:1/x'],
+                              interval=0.1)
+        self.assertEqual([cfg.SA_APP_NAME], self.route(replicas, lambda: None))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
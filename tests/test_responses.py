@@ -0,0 +1,90 @@
+import json
+import unittest
+from datetime import date, datetime
+from decimal import Decimal
+from types import MappingProxyType
+from unittest import mock
+
+from starlette.requests import Request
+
+from app import responses
+from app.models.cache import LocalCache
+from app.models.replica import ReplicaSet
+from app.models.tables import categories, daily_sales
+from app.responses import RowsResponse, dumps, not_modified, validators
+
+
+class TestRowsResponse(unittest.TestCase):
+    def test_dumps(self):
+        row = MappingProxyType({
+            'salesid': 1,
+            'pricepaid': Decimal('20.25'),
+            'caldate': date(2008, 1, 1),
+            'saletime': datetime(2008, 1, 1, 2, 3, 4),
+            'holiday': None,
+        })
+        self.assertEqual(
+            {
+                'salesid': 1,
+                'pricepaid': 20.25,
+                'caldate': '2008-01-01',
+                'saletime': '2008-01-01T02:03:04',
+                'holiday': None,
+            }, json.loads(dumps(row)))
+
+    def test_unknown_type(self):
+        with self.assertRaises(TypeError):
+            dumps({'key': object()})
+
+    def test_response(self):
+        res = RowsResponse({'items': [MappingProxyType({'catid': 1})]})
+        self.assertEqual(b'{"items":[{"catid":1}]}', res.body)
+        self.assertEqual('application/json', res.media_type)
+
+
+def request(**headers):
+    return Request({
+        'type': 'http',
+        'headers': [(k.replace('_', '-').encode(), v.encode())
+                    for k, v in headers.items()],
+    })
+
+
+class TestConditional(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(responses, 'cache',
+                                    LocalCache(max_size=8, ttl=60))
+        self.cache = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_etag(self):
+        headers = validators(categories)
+        self.assertEqual('public, max-age=1', headers['Cache-Control'])
+        self.assertEqual(headers, validators(categories))
+        self.assertFalse(not_modified(request(), headers))
+        self.assertTrue(
+            not_modified(request(if_none_match=headers['ETag']), headers))
+        self.assertTrue(
+            not_modified(request(if_none_match=f'"x", W/{headers["ETag"]}'),
+                         headers))
+        self.cache.invalidate(categories.name)
+        self.assertFalse(
+            not_modified(request(if_none_match=headers['ETag']),
+                         validators(categories)))
+
+    def test_immutable(self):
+        headers = validators(daily_sales, immutable=True)
+        self.assertIn('immutable', headers['Cache-Control'])
+
+    def test_replica_lag(self):
+        replica_set = ReplicaSet(['postgresql://a/db'], max_lag=5)
+        with mock.patch.object(responses, 'replicas', replica_set):
+            self.cache.invalidate(categories.name)
+            headers = validators(categories)
+            self.assertNotIn('ETag', headers)
+            self.assertFalse(not_modified(request(if_none_match='*'),
+                                          headers))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
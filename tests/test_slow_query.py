@@ -0,0 +1,34 @@
+import unittest
+
+from sqlalchemy.sql import bindparam, select
+
+from app.models.dao import _log_slow
+from app.models.prepared import Prepared
+from app.models.tables import categories
+
+
+class TestSlowQueryLog(unittest.TestCase):
+    def test_expression(self):
+        stmt = select([categories]).where(categories.c.catid == 7)
+        with self.assertLogs('slow_query_logger') as logs:
+            _log_slow('lookup_category_id', stmt, None, 0.75, 1)
+        record, = logs.output
+        self.assertIn('750.0ms lookup_category_id rows=1 SELECT', record)
+        self.assertIn('WHERE d_category.catid = %(catid_1)s', record)
+        self.assertIn("params={'catid_1': 7}", record)
+
+    def test_prepared(self):
+        stmt = Prepared(
+            select([categories]).where(
+                categories.c.catname == bindparam('key')))
+        with self.assertLogs('slow_query_logger') as logs:
+            _log_slow('lookup_category_name', stmt, {'key': 'x' * 100}, 2,
+                      0)
+        record, = logs.output
+        self.assertIn('WHERE d_category.catname = $1', record)
+        # long values are shortened
+        self.assertIn("params=['xxxxxxxxxxxx...xxxxxxxxxxxxx']", record)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,223 @@
+import unittest
+from datetime import date, timedelta
+from unittest import mock
+
+from sqlalchemy.sql import func, select
+from starlette.testclient import TestClient
+
+from app import cfg
+from app.main import app
+from app.models.session import engine
+from app.models.tables import daily_sales, dates, sales
+from tests.base import AppTestCase
+
+URL = f'{cfg.REST_URL_PREFIX}/summary/sales/range'
+TOTAL_URL = f'{cfg.REST_URL_PREFIX}/summary/sales'
+GROUP_BYS = ('day', 'week', 'month', 'qtr', 'category', 'venue', 'event')
+
+
+def totals(start: date, end: date) -> tuple:
+    """quantity, revenue and commission of the sales of a date range"""
+    stmt = select([
+        func.coalesce(func.sum(sales.c.qtysold), 0),
+        func.coalesce(func.sum(sales.c.pricepaid), 0),
+        func.coalesce(func.sum(sales.c.commission), 0),
+    ]).select_from(sales.join(dates, sales.c.dateid == dates.c.dateid)).where(
+        dates.c.caldate.between(start, end))
+    with engine.connect() as conn:
+        qty, revenue, commission = conn.execute(stmt).first()
+    return int(qty), float(revenue), float(commission)
+
+
+class TestSalesSeries(AppTestCase):
+    start = date(2008, 2, 1)
+    end = date(2008, 2, 10)
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        qty, _, _ = totals(cls.start, cls.end)
+        if not qty:
+            raise unittest.SkipTest('no sales loaded')
+
+    def calendar(self) -> list:
+        """calendar rows of the range, in date order"""
+        stmt = dates.select().where(dates.c.caldate.between(
+            self.start, self.end)).order_by(dates.c.caldate)
+        with engine.connect() as conn:
+            return conn.execute(stmt).fetchall()
+
+    def series(self, client, start: date, end: date, group_by: str):
+        resp = client.get(URL,
+                          params={
+                              'start': start.isoformat(),
+                              'end': end.isoformat(),
+                              'group_by': group_by,
+                          })
+        self.assertEqual(200, resp.status_code, resp.text)
+        self.assertEqual(group_by, resp.json()['group_by'])
+        return resp.json()['result']
+
+    def assertTotals(self, expected: tuple, result: list):
+        qty, revenue, commission = expected
+        self.assertEqual(qty, sum(g['qtysold'] for g in result))
+        self.assertAlmostEqual(revenue, sum(g['revenue'] for g in result), 2)
+        self.assertAlmostEqual(commission,
+                               sum(g['commission'] for g in result), 2)
+
+    def test_group_by(self):
+        """every grouping adds up to the sales of the range"""
+        expected = totals(self.start, self.end)
+        with TestClient(app) as client:
+            for group_by in GROUP_BYS:
+                with self.subTest(group_by=group_by):
+                    result = self.series(client, self.start, self.end,
+                                         group_by)
+                    self.assertTotals(expected, result)
+                    keys = [g['key'] for g in result]
+                    self.assertEqual(len(keys), len(set(keys)))
+            days = self.series(client, self.start, self.end, 'day')
+            self.assertEqual(sorted(g['key'] for g in days),
+                             [g['key'] for g in days])
+            for group_by, label in (
+                    ('week', lambda r: f'{r.year}-W{r.week:02d}'),
+                    ('month', lambda r: f'{r.year}-{r.month.strip()}'),
+                    ('qtr', lambda r: f'{r.year}-Q{r.qtr.strip()}')):
+                with self.subTest(group_by=group_by):
+                    self.assertEqual(
+                        list(dict.fromkeys(map(label, self.calendar()))), [
+                            g['key'] for g in self.series(
+                                client, self.start, self.end, group_by)
+                        ])
+            categories = self.series(client, self.start, self.end,
+                                     'category')
+            self.assertEqual(sorted(int(g['key']) for g in categories),
+                             [int(g['key']) for g in categories])
+            self.assertTrue(all(g['name'] for g in categories))
+
+    def test_boundaries(self):
+        """both ends are part of the range"""
+        with TestClient(app) as client:
+            days = self.series(client, self.start, self.end, 'day')
+            self.assertEqual(self.start.isoformat(), days[0]['key'])
+            self.assertEqual(self.end.isoformat(), days[-1]['key'])
+            one = self.series(client, self.end, self.end, 'day')
+            self.assertEqual([self.end.isoformat()], [g['key'] for g in one])
+            self.assertTotals(totals(self.end, self.end), one)
+            # the day after the end is left out
+            before = self.series(client, self.start,
+                                 self.end - timedelta(days=1), 'category')
+            self.assertTotals(
+                totals(self.start, self.end - timedelta(days=1)), before)
+
+    def test_empty_range(self):
+        with TestClient(app) as client:
+            for group_by in GROUP_BYS:
+                with self.subTest(group_by=group_by):
+                    self.assertEqual([],
+                                     self.series(client, date(2007, 1, 1),
+                                                 date(2007, 1, 31),
+                                                 group_by))
+
+    def test_invalid(self):
+        with TestClient(app) as client:
+            resp = client.get(URL,
+                              params={
+                                  'start': self.end.isoformat(),
+                                  'end': self.start.isoformat(),
+                              })
+            self.assertEqual(400, resp.status_code)
+            resp = client.get(URL,
+                              params={
+                                  'start': self.start.isoformat(),
+                                  'end': self.end.isoformat(),
+                                  'group_by': 'seller',
+                              })
+            self.assertEqual(400, resp.status_code)
+
+    def test_cap(self):
+        """more groups than SUMMARY_MAX_GROUPS are refused, not cut off"""
+        with TestClient(app) as client:
+            with mock.patch.object(cfg, 'SUMMARY_MAX_GROUPS', 3):
+                resp = client.get(URL,
+                                  params={
+                                      'start': self.start.isoformat(),
+                                      'end': self.end.isoformat(),
+                                  })
+                self.assertEqual(400, resp.status_code)
+                self.assertIn('more than 3 groups', resp.text)
+                self.assertEqual(
+                    1, len(self.series(client, self.end, self.end, 'day')))
+            # events of a month, more than the default cap of 5000 on the
+            # sample
+            first, last = date(2008, 2, 1), date(2008, 2, 29)
+            stmt = select([func.count(sales.c.eventid.distinct())
+                           ]).select_from(
+                               sales.join(dates,
+                                          sales.c.dateid == dates.c.dateid)
+                           ).where(dates.c.caldate.between(first, last))
+            with engine.connect() as conn:
+                events = conn.execute(stmt).scalar()
+            resp = client.get(URL,
+                              params={
+                                  'start': first.isoformat(),
+                                  'end': last.isoformat(),
+                                  'group_by': 'event',
+                              })
+            if events > cfg.SUMMARY_MAX_GROUPS:
+                self.assertEqual(400, resp.status_code)
+            else:
+                self.assertEqual(events, len(resp.json()['result']))
+
+
+class TestTotalSales(AppTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        stmt = select([
+            func.min(daily_sales.c.caldate),
+            func.max(daily_sales.c.caldate)
+        ])
+        with engine.connect() as conn:
+            cls.first, cls.last = conn.execute(stmt).first()
+        if cls.first is None or cls.first == cls.last:
+            raise unittest.SkipTest('no sales rolled up')
+
+    def total(self, client, day: date, **headers):
+        return client.get(TOTAL_URL,
+                          params={'date': day.isoformat()},
+                          headers=headers)
+
+    def test_closed(self):
+        """a date the rollup is past may be cached for good"""
+        with TestClient(app) as client:
+            resp = self.total(client, self.first)
+            self.assertEqual(200, resp.status_code)
+            self.assertEqual(
+                f'public, max-age={cfg.HTTP_IMMUTABLE_MAX_AGE}, immutable',
+                resp.headers['cache-control'])
+            resp = self.total(client,
+                              self.first,
+                              **{'If-None-Match': resp.headers['etag']})
+            self.assertEqual(304, resp.status_code)
+            self.assertIn('immutable', resp.headers['cache-control'])
+
+    def test_open(self):
+        """dates without a rollup row, or its last one, are revalidated"""
+        with TestClient(app) as client:
+            for day in (self.last, self.first - timedelta(days=1),
+                        self.last + timedelta(days=1)):
+                with self.subTest(day=day):
+                    resp = self.total(client, day)
+                    self.assertEqual(200, resp.status_code)
+                    self.assertEqual(f'public, max-age={cfg.HTTP_MAX_AGE}',
+                                     resp.headers['cache-control'])
+                    self.assertIn('etag', resp.headers)
+            self.assertEqual(
+                0,
+                self.total(client,
+                           self.first - timedelta(days=1)).json()['result'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
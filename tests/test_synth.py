@@ -0,0 +1,132 @@
+import asyncio
+import filecmp
+import os
+import tempfile
+import unittest
+
+import asyncpg
+
+from app import cfg
+from app.models import synth
+from app.models.dao import SAMPLE_FILES, Dao
+from app.models.session import database
+from app.models.tables import (categories, dates, events, listings, sales,
+                               users, venues)
+
+DSN = (f'postgresql://{cfg.SA_USR}:{cfg.SA_PWD}'
+       f'@{cfg.SA_HOST}:{cfg.SA_PORT}/{cfg.SA_DB}')
+
+
+def fetch(query: str) -> list:
+    async def helper():
+        conn = await asyncpg.connect(DSN, timeout=5)
+        try:
+            return await conn.fetch(query)
+        finally:
+            await conn.close()
+
+    return asyncio.run(helper())
+
+
+class TestSynth(unittest.TestCase):
+    def test_sizes(self):
+        n = synth.sizes(10)
+        self.assertEqual(1724560, n[sales])
+        self.assertEqual(11, n[categories])
+        self.assertEqual(365, n[dates])
+        self.assertEqual(1, synth.sizes(0.00001)[venues])
+
+    def test_chunks(self):
+        self.assertEqual([(1, 4), (5, 8), (9, 10)], synth.chunks(10, 3))
+        self.assertEqual([(1, 1), (2, 2)], synth.chunks(2, 4))
+        self.assertEqual([], synth.chunks(0, 4))
+
+
+class TestSynthRows(unittest.TestCase):
+    n = synth.sizes(0.02)
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        try:
+            fetch('SELECT 1')
+        except (OSError, asyncpg.PostgresError) as err:
+            raise unittest.SkipTest(f'no test database: {err!r}')
+
+    def rows(self, table, first: int = 1, last: int = None) -> str:
+        return synth.rows(table, self.n, first, last or self.n[table])
+
+    def test_columns(self):
+        """columns of the tables, primary key first, one row per key"""
+        for table in (users, venues, categories, dates, events, listings,
+                      sales):
+            with self.subTest(table=table.name):
+                got = fetch(f'SELECT * FROM ({self.rows(table)}) g')
+                self.assertEqual(self.n[table], len(got))
+                self.assertEqual([col.name for col in table.c],
+                                 list(got[0].keys()))
+                self.assertEqual(self.n[table],
+                                 len({row[0] for row in got}))
+
+    def test_deterministic(self):
+        query = f'SELECT * FROM ({self.rows(sales, 5, 9)}) g ORDER BY 1'
+        self.assertEqual(fetch(query), fetch(query))
+        self.assertEqual(
+            fetch(query),
+            fetch(f'SELECT * FROM ({self.rows(sales)}) g '
+                  f'WHERE salesid BETWEEN 5 AND 9 ORDER BY 1'))
+
+    def test_consistent(self):
+        """a sale agrees with its listing and falls between the listing
+        and the event"""
+        got = fetch(f'''
+            WITH e AS ({self.rows(events)}),
+                 l AS ({self.rows(listings)}),
+                 s AS ({self.rows(sales)})
+            SELECT count(*) FILTER (WHERE s.eventid <> l.eventid
+                                    OR s.sellerid <> l.sellerid) AS ref,
+                   count(*) FILTER (WHERE s.dateid < l.dateid
+                                    OR s.dateid > e.dateid
+                                    OR l.dateid > e.dateid) AS day,
+                   count(*) FILTER (WHERE s.qtysold > l.numtickets) AS qty,
+                   count(*) FILTER (WHERE e.eventid IS NULL) AS missing
+            FROM s JOIN l USING (listid)
+            LEFT JOIN e ON e.eventid = s.eventid''')[0]
+        self.assertEqual({'ref': 0, 'day': 0, 'qty': 0, 'missing': 0},
+                         dict(got))
+
+
+class TestGenerateSample(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        TestSynthRows.setUpClass()
+
+    @staticmethod
+    def generate(path: str, jobs: int):
+        async def helper():
+            await database.connect()
+            try:
+                return await Dao().generate_sample(path, 0.002, jobs)
+            finally:
+                await database.disconnect()
+
+        return asyncio.run(helper())
+
+    def test_parts_in_key_order(self):
+        """files written in parts on several connections are the same as
+        written on one"""
+        with tempfile.TemporaryDirectory() as one, \
+                tempfile.TemporaryDirectory() as three:
+            self.generate(one, 1)
+            stats = self.generate(three, 3)
+            self.assertEqual(sorted(SAMPLE_FILES.values()),
+                             sorted(os.listdir(three)))
+            for stat, filename in zip(stats, SAMPLE_FILES.values()):
+                with self.subTest(table=stat.table):
+                    self.assertTrue(
+                        filecmp.cmp(os.path.join(one, filename),
+                                    os.path.join(three, filename),
+                                    shallow=False))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
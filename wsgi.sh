@@ -2,8 +2,14 @@
 
 CPUS=$(getconf _NPROCESSORS_ONLN 2> /dev/null)
 LOG_FILE="/app/logs/gunicorn.log"
-WORKERS=$((2*CPUS+1))
+# read by config.py to size the connection pool of each worker
+export WORKERS=${WORKERS:-$((2*CPUS+1))}
 BIND=0.0.0.0:8000
+# metric samples of all workers, merged by /metrics; stale ones of a
+# previous run would be counted too
+export prometheus_multiproc_dir=${prometheus_multiproc_dir:-/dev/shm/metrics}
+rm -rf "$prometheus_multiproc_dir"
+mkdir -p "$prometheus_multiproc_dir"
 APP_MODULE=run:app
 
 exec gunicorn $APP_MODULE --bind=$BIND \